@@ -0,0 +1,190 @@
+"""
+交易数据库压力测试工具
+
+在临时数据库文件上创建 N 个模拟用户，由 M 个线程（或进程）按给定的买卖比例
+并发调用 Database.execute_trade，统计吞吐量、延迟分位数，
+最后按交易记录核对每个用户的现金和持仓是否守恒。
+
+用法示例:
+    python load_test.py --users 50 --workers 8 --trades 20000
+    python load_test.py --users 10 --workers 4 --mode processes --buy-ratio 0.5
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+INITIAL_BALANCE = 1000000.0
+USER_PREFIX = "load_user_"
+
+
+def create_users(database, count, balance=INITIAL_BALANCE):
+    """通过 add_user 创建模拟用户，返回用户名列表"""
+    users = []
+    for i in range(count):
+        username = f"{USER_PREFIX}{i}"
+        database.add_user(username, "load_test", initial_balance=balance)
+        users.append(username)
+    return users
+
+
+def make_plan(users, codes, trades, buy_ratio=0.6, max_lots=10, seed=None):
+    """
+    生成交易计划：随机用户、随机股票、随机买卖方向，数量为 100 股的整数倍
+    :return: [(username, transaction_type, stock_code, quantity)]
+    """
+    rng = np.random.default_rng(seed)
+    user_idx = rng.integers(len(users), size=trades)
+    code_idx = rng.integers(len(codes), size=trades)
+    is_buy = rng.random(trades) < buy_ratio
+    quantity = rng.integers(1, max_lots + 1, size=trades) * 100
+    return [(users[u], "buy" if b else "sell", codes[c], int(q))
+            for u, c, b, q in zip(user_idx, code_idx, is_buy, quantity)]
+
+
+def run_trades(database, plan):
+    """
+    依次执行一段交易计划，逐笔计时
+    :return: (延迟数组(秒), 成功数, 拒绝数, 异常数)
+    """
+    latencies = np.empty(len(plan))
+    filled = rejected = errors = 0
+    for i, (username, transaction_type, stock_code, quantity) in enumerate(plan):
+        start = time.perf_counter()
+        try:
+            success, _ = database.execute_trade(username, transaction_type, stock_code, quantity)
+            if success:
+                filled += 1
+            else:
+                rejected += 1
+        except Exception as e:
+            errors += 1
+            print(f"压力测试: 交易异常: {e}")
+        latencies[i] = time.perf_counter() - start
+    return latencies, filled, rejected, errors
+
+
+def _run_in_process(db_path, plan):
+    """工作进程：打开同一个数据库文件执行自己那一段计划"""
+    from modules.database import Database
+    return run_trades(Database(db_path), plan)
+
+
+def run_load(database, plan, workers=4, mode="threads"):
+    """
+    把计划按轮转方式分给 workers 个线程/进程并发执行
+    :return: (总耗时(秒), 延迟数组, 成功数, 拒绝数, 异常数)
+    """
+    slices = [plan[i::workers] for i in range(workers)]
+    start = time.perf_counter()
+    if mode == "processes":
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_run_in_process, [database.db_path] * workers, slices))
+    else:
+        results = [None] * workers
+
+        def worker(i):
+            results[i] = run_trades(database, slices[i])
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = np.concatenate([r[0] for r in results]) if results else np.empty(0)
+    return (elapsed, latencies, sum(r[1] for r in results), sum(r[2] for r in results),
+            sum(r[3] for r in results))
+
+
+def check_consistency(database, users, balance=INITIAL_BALANCE):
+    """
+    用交易记录重算每个用户的现金和持仓，与 users/holdings 表核对
+    :return: 不一致项的描述列表（为空表示守恒）
+    """
+    problems = []
+    for username in users:
+        transactions = database.get_user_transactions(username)
+        sign = np.array([1 if t["type"] == "buy" else -1 for t in transactions])
+        amounts = np.array([t["amount"] for t in transactions])
+        expected_cash = balance - float((sign * amounts).sum()) if len(transactions) else balance
+        actual_cash = database.get_user(username)["balance"]
+        if abs(expected_cash - actual_cash) > 1e-6 * max(1.0, abs(expected_cash)):
+            problems.append(f"{username} 现金 {actual_cash:.2f} != 按交易记录重算的 {expected_cash:.2f}")
+        if actual_cash < -1e-6:
+            problems.append(f"{username} 现金为负: {actual_cash:.2f}")
+
+        expected_shares = {}
+        for t, s in zip(transactions, sign):
+            expected_shares[t["stock_code"]] = expected_shares.get(t["stock_code"], 0) + int(s) * t["quantity"]
+        holdings = database.get_holdings(username)
+        for code in set(expected_shares) | set(holdings):
+            expected = expected_shares.get(code, 0)
+            actual = holdings.get(code, {}).get("quantity", 0)
+            if expected != actual:
+                problems.append(f"{username} {code} 持仓 {actual} != 按交易记录重算的 {expected}")
+            if actual < 0:
+                problems.append(f"{username} {code} 持仓为负: {actual}")
+    return problems
+
+
+def print_report(elapsed, latencies, filled, rejected, errors, problems):
+    total = filled + rejected + errors
+    print(f"压力测试: 共 {total} 笔，成交 {filled}，拒绝 {rejected}，异常 {errors}，耗时 {elapsed:.2f} 秒")
+    print(f"          吞吐量 {total / elapsed if elapsed > 0 else 0:.0f} 笔/秒")
+    if len(latencies):
+        p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000
+        print(f"          延迟(毫秒) p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  "
+              f"最大 {latencies.max() * 1000:.2f}")
+    if problems:
+        print(f"压力测试: 一致性检查失败，{len(problems)} 处不一致:")
+        for problem in problems[:20]:
+            print(f"          {problem}")
+    else:
+        print("压力测试: 一致性检查通过（现金和持仓与交易记录一致）")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="交易数据库并发压力测试（使用临时数据库文件）")
+    parser.add_argument("--users", type=int, default=20, help="模拟用户数")
+    parser.add_argument("--workers", type=int, default=4, help="并发线程/进程数")
+    parser.add_argument("--mode", choices=["threads", "processes"], default="threads")
+    parser.add_argument("--trades", type=int, default=5000, help="交易总笔数")
+    parser.add_argument("--buy-ratio", type=float, default=0.6, help="买单比例")
+    parser.add_argument("--max-lots", type=int, default=10, help="每笔最多多少手（100股）")
+    parser.add_argument("--stocks", type=int, default=20, help="参与交易的股票数")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--keep", action="store_true", help="测试结束后保留临时数据库文件")
+    args = parser.parse_args(argv)
+
+    from modules.database import Database
+
+    temp_dir = tempfile.mkdtemp(prefix="stock_load_")
+    db_path = os.path.join(temp_dir, "load_test.db")
+    try:
+        database = Database(db_path)
+        users = create_users(database, args.users)
+        codes = sorted(database.get_stocks())[:args.stocks]
+        plan = make_plan(users, codes, args.trades, args.buy_ratio, args.max_lots, args.seed)
+        print(f"压力测试: {len(users)} 个用户，{len(codes)} 只股票，{args.workers} 个{'进程' if args.mode == 'processes' else '线程'}，"
+              f"{len(plan)} 笔交易，数据库 {db_path}")
+
+        elapsed, latencies, filled, rejected, errors = run_load(database, plan, args.workers, args.mode)
+        problems = check_consistency(database, users)
+        print_report(elapsed, latencies, filled, rejected, errors, problems)
+        return 1 if problems or errors else 0
+    finally:
+        if args.keep:
+            print(f"压力测试: 临时数据库保留在 {db_path}")
+        else:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,19 +2,41 @@
 股票模拟交易系统模块包
 """
 
-# 导出模块
-from .database import db
-from .stock_data import stock_manager
-from .login import LoginFrame
-from .market import MarketFrame
-from .trading import TradingFrame
-from .recommendation import RecommendationFrame, StockRecommendationEngine
-from .news import NewsFrame
-from .account import AccountFrame
-from .admin import AdminFrame
+import importlib
+
+# 导出名称 -> 所在子模块。第一次访问时才导入对应子模块，
+# 只用其中一个子模块（如 modules.database）时不会连带导入界面和行情接口
+_EXPORTS = {
+    'db': 'database',
+    'stock_manager': 'stock_data',
+    'bar_store': 'bar_store',
+    'factor_table': 'factor_table',
+    'correlation_service': 'correlation',
+    'ui_dispatcher': 'ui_dispatcher',
+    'LoginFrame': 'login',
+    'MarketFrame': 'market',
+    'WatchlistFrame': 'watchlist',
+    'HeatmapFrame': 'heatmap',
+    'TradingFrame': 'trading',
+    'RecommendationFrame': 'recommendation',
+    'StockRecommendationEngine': 'recommendation',
+    'NewsFrame': 'news',
+    'AccountFrame': 'account',
+    'AdminFrame': 'admin',
+}
 
 __all__ = [
-    'db', 'stock_manager', 'LoginFrame', 'MarketFrame', 
+    'db', 'stock_manager', 'bar_store', 'factor_table', 'correlation_service', 'ui_dispatcher',
+    'LoginFrame', 'MarketFrame', 'WatchlistFrame', 'HeatmapFrame',
     'TradingFrame', 'RecommendationFrame', 'StockRecommendationEngine',
     'NewsFrame', 'AccountFrame', 'AdminFrame'
 ]
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module}", __name__), name)
+    globals()[name] = value
+    return value
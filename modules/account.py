@@ -6,7 +6,11 @@ from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import pandas as pd
 import numpy as np
 import matplotlib
+import threading
 from .database import db
+from .ui_dispatcher import ui_dispatcher
+from .performance import performance_service
+from .tax_lots import lot_book
 from datetime import datetime
 
 # 设置matplotlib支持中文显示
@@ -58,6 +62,9 @@ class AccountFrame(tb.Frame):
         # 创建账户信息区域
         self.create_account_info()
         
+        # 创建业绩表现区域
+        self.create_performance_info()
+        
         # 创建持仓信息区域
         self.create_holdings_info()
         
@@ -114,6 +121,26 @@ class AccountFrame(tb.Frame):
         self.profit_var = tk.StringVar()
         self.profit_label = tb.Label(account_frame, textvariable=self.profit_var, bootstyle="light")
         self.profit_label.grid(row=4, column=1, sticky="w", padx=10, pady=5)
+        
+        # 已实现盈亏（卖出按先进先出匹配买入批次）
+        tb.Label(account_frame, text="已实现盈亏:", bootstyle="light").grid(row=5, column=0, sticky="w", padx=10, pady=5)
+        self.realized_var = tk.StringVar()
+        self.realized_label = tb.Label(account_frame, textvariable=self.realized_var, bootstyle="light")
+        self.realized_label.grid(row=5, column=1, sticky="w", padx=10, pady=5)
+    
+    def create_performance_info(self):
+        """创建业绩表现区域（数据来自每日净值表）"""
+        performance_frame = tb.LabelFrame(self.left_frame, text="业绩表现", bootstyle="info")
+        performance_frame.pack(fill=tk.X, pady=10)
+        
+        self.performance_vars = {}
+        items = [("total_return", "累计收益率:"), ("annual_return", "年化收益率:"), ("volatility", "年化波动率:"),
+                 ("sharpe", "夏普比率:"), ("max_drawdown", "最大回撤:"), ("days", "净值天数:")]
+        for i, (key, text) in enumerate(items):
+            row, column = divmod(i, 2)
+            tb.Label(performance_frame, text=text, bootstyle="light").grid(row=row, column=column * 2, sticky="w", padx=10, pady=5)
+            self.performance_vars[key] = tk.StringVar(value="--")
+            tb.Label(performance_frame, textvariable=self.performance_vars[key], bootstyle="info").grid(row=row, column=column * 2 + 1, sticky="w", padx=10, pady=5)
     
     def create_holdings_info(self):
         """创建持仓信息区域"""
@@ -174,6 +201,9 @@ class AccountFrame(tb.Frame):
         
         # 创建持仓分布图表
         self.create_holdings_distribution_chart()
+        
+        # 创建净值走势图表
+        self.create_nav_chart()
     
     def create_asset_distribution_chart(self):
         """创建资产分布图表"""
@@ -215,6 +245,54 @@ class AccountFrame(tb.Frame):
         self.holdings_canvas = FigureCanvasTkAgg(self.holdings_fig, master=self.holdings_chart_frame)
         self.holdings_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
     
+    def create_nav_chart(self):
+        """创建净值走势图表"""
+        self.nav_chart_frame = tb.Frame(self.right_frame, bootstyle="dark")
+        self.nav_chart_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        
+        self.nav_fig, self.nav_ax = plt.subplots(figsize=(6, 3), dpi=100)
+        self.nav_fig.patch.set_facecolor(CHART_BG_COLOR)
+        self.nav_ax.set_facecolor(CHART_AREA_COLOR)
+        self.nav_ax.set_title("净值走势", color=TEXT_COLOR)
+        
+        self.nav_canvas = FigureCanvasTkAgg(self.nav_fig, master=self.nav_chart_frame)
+        self.nav_canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+    
+    def load_performance(self):
+        """从每日净值表读取净值走势和业绩指标"""
+        values, _ = performance_service.nav_table(self.username)
+        metrics = performance_service.metrics(self.username).get(self.username)
+        
+        def percent(value):
+            return f"{value * 100:.2f}%" if np.isfinite(value) else "--"
+        
+        if metrics:
+            self.performance_vars["total_return"].set(percent(metrics["total_return"]))
+            self.performance_vars["annual_return"].set(percent(metrics["annual_return"]))
+            self.performance_vars["volatility"].set(percent(metrics["volatility"]))
+            self.performance_vars["sharpe"].set(f"{metrics['sharpe']:.2f}" if np.isfinite(metrics["sharpe"]) else "--")
+            self.performance_vars["max_drawdown"].set(percent(metrics["max_drawdown"]))
+            self.performance_vars["days"].set(str(metrics["days"] + 1))
+        else:
+            for var in self.performance_vars.values():
+                var.set("--")
+        
+        self.nav_ax.clear()
+        self.nav_ax.set_title("净值走势", color=TEXT_COLOR)
+        if values.empty:
+            self.nav_ax.text(0.5, 0.5, '暂无净值记录（每个交易日收盘后自动记录）', horizontalalignment='center',
+                             verticalalignment='center', color=TEXT_COLOR, fontsize=11, transform=self.nav_ax.transAxes)
+            self.nav_ax.axis('off')
+        else:
+            series = values[self.username].dropna()
+            self.nav_ax.plot(series.index, series.to_numpy(), color=ACCENT_COLOR, linewidth=1.5)
+            self.nav_ax.tick_params(axis='x', colors=TEXT_COLOR, rotation=20)
+            self.nav_ax.tick_params(axis='y', colors=TEXT_COLOR)
+            self.nav_ax.grid(color=GRID_COLOR, linestyle='--', alpha=0.5)
+        self.nav_ax.set_facecolor(CHART_AREA_COLOR)
+        self.nav_fig.tight_layout()
+        self.nav_canvas.draw()
+    
     def load_account_data(self):
         """加载账户数据"""
         # 更新状态
@@ -317,13 +395,39 @@ class AccountFrame(tb.Frame):
         else:
             self.profit_label.config(bootstyle="light", foreground=TEXT_COLOR)  # 白色
         
+        self.load_realized_pnl()
+        
         # 更新图表
         self.update_asset_chart(balance, holdings_value)
         self.update_holdings_chart(holdings_data)
+        self.load_performance()
         
         # 更新状态
         self.status_var.set(f"账户数据已更新 - {datetime.now().strftime('%H:%M:%S')}")
     
+    def load_realized_pnl(self):
+        """在后台线程中处理新成交的税务批次并汇总已实现盈亏，结果转回主线程显示"""
+        username = self.username
+        
+        def do_load():
+            try:
+                realized = lot_book.realized_total(username)
+            except Exception as e:
+                print(f"加载已实现盈亏失败: {e}")
+                return
+            ui_dispatcher.post(self.show_realized_pnl, realized, key=(self, "realized"))
+        
+        threading.Thread(target=do_load, daemon=True).start()
+    
+    def show_realized_pnl(self, realized):
+        self.realized_var.set(f"{realized:.2f}")
+        if realized > 0:
+            self.realized_label.config(bootstyle="danger", foreground=UP_COLOR)
+        elif realized < 0:
+            self.realized_label.config(bootstyle="success", foreground=DOWN_COLOR)
+        else:
+            self.realized_label.config(bootstyle="light", foreground=TEXT_COLOR)
+    
     def update_asset_chart(self, balance, holdings_value):
         """更新资产分布图表"""
         # 清除图表
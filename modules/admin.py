@@ -8,6 +8,7 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import matplotlib
 from .database import db
+from .performance import performance_service
 
 # 设置matplotlib支持中文显示
 matplotlib.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'SimSun', 'Heiti TC', 'WenQuanYi Micro Hei', 'Arial Unicode MS', 'sans-serif']
@@ -168,6 +169,42 @@ class AdminFrame(tb.Frame):
         
         # 创建交易量统计图表
         self.create_transaction_stats_chart(right_frame)
+        
+        # 创建业绩排行表
+        self.create_performance_table()
+    
+    def create_performance_table(self):
+        """创建用户业绩表（数据来自每日净值表）"""
+        table_title = tb.Label(self.stats_tab, text="用户业绩", font=("微软雅黑", 12, "bold"), bootstyle="info")
+        table_title.pack(pady=5, anchor="w")
+        
+        columns = ('用户名', '最新净值', '累计收益率', '年化收益率', '年化波动率', '夏普比率', '最大回撤', '天数')
+        self.performance_tree = tb.Treeview(self.stats_tab, columns=columns, show='headings', height=6, bootstyle="dark")
+        for col in columns:
+            self.performance_tree.heading(col, text=col)
+            self.performance_tree.column(col, width=100)
+        self.performance_tree.pack(fill=tk.X, pady=5)
+    
+    def load_performance_table(self):
+        """一次计算全部用户的业绩指标，按累计收益率排序"""
+        for item in self.performance_tree.get_children():
+            self.performance_tree.delete(item)
+        
+        def percent(value):
+            return f"{value * 100:.2f}%" if np.isfinite(value) else "--"
+        
+        metrics = performance_service.metrics()
+        for username, m in sorted(metrics.items(), key=lambda item: item[1]["total_return"], reverse=True):
+            self.performance_tree.insert('', tk.END, values=(
+                username,
+                f"{m['latest_value']:.2f}",
+                percent(m["total_return"]),
+                percent(m["annual_return"]),
+                percent(m["volatility"]),
+                f"{m['sharpe']:.2f}" if np.isfinite(m["sharpe"]) else "--",
+                percent(m["max_drawdown"]),
+                m["days"] + 1
+            ))
     
     def create_user_assets_chart(self, parent):
         """创建用户资产分布图表"""
@@ -284,6 +321,9 @@ class AdminFrame(tb.Frame):
         
         # 更新交易统计图表
         self.update_transaction_stats_chart(transaction_counts)
+        
+        # 更新业绩表
+        self.load_performance_table()
     
     def update_user_assets_chart(self, usernames, balances, holdings_values):
         """更新用户资产分布图表"""
@@ -0,0 +1,180 @@
+import os
+import threading
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+# 缓存的K线字段
+BAR_FIELDS = ('open', 'high', 'low', 'close', 'volume')
+
+
+class BarStore:
+    """日K线本地缓存，每只股票保存为一个npz列式文件，供分析/回测离线使用"""
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or os.path.join("data", "bars")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._memory = {}  # code -> (dates, fields, covered_start, covered_end)
+
+    def _path(self, code):
+        return os.path.join(self.cache_dir, f"{code}.npz")
+
+    def _read(self, code):
+        """读取缓存（优先内存），返回 (dates, fields, covered_start, covered_end) 或 None"""
+        with self._lock:
+            if code in self._memory:
+                return self._memory[code]
+        path = self._path(code)
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                dates = data['date'].astype('datetime64[D]')
+                fields = {f: data[f].astype(np.float64) for f in BAR_FIELDS if f in data.files}
+                covered = data['covered'].astype('datetime64[D]')
+        except Exception as e:
+            print(f"BarStore: 读取 {code} 缓存失败: {e}")
+            return None
+        entry = (dates, fields, covered[0], covered[1])
+        with self._lock:
+            self._memory[code] = entry
+        return entry
+
+    def _write(self, code, dates, fields, covered_start, covered_end):
+        """写入缓存文件并更新内存"""
+        order = np.argsort(dates, kind='stable')
+        dates = dates[order]
+        fields = {f: np.asarray(v, dtype=np.float64)[order] for f, v in fields.items()}
+        covered = np.array([covered_start, covered_end], dtype='datetime64[D]')
+        tmp_path = self._path(code) + ".tmp.npz"
+        np.savez(tmp_path, date=dates.astype('datetime64[D]'), covered=covered, **fields)
+        os.replace(tmp_path, self._path(code))
+        with self._lock:
+            self._memory[code] = (dates, fields, covered[0], covered[1])
+
+    def _fetch(self, code, start, end):
+        """
+        从行情接口获取 [start, end] 区间的日K线
+        :return: (dates, fields)，区间内没有K线时为空数组；获取失败时返回None
+        """
+        from .stock_data import stock_manager
+        try:
+            df = stock_manager.get_stock_data(code, start_date=str(start), end_date=str(end), raise_errors=True)
+        except Exception as e:
+            print(f"BarStore: 获取 {code} {start} ~ {end} 的K线失败: {e}")
+            return None
+        if df is None:
+            return None
+        if df.empty:
+            return np.array([], dtype='datetime64[D]'), {}
+        if 'date' not in df.columns:
+            return None
+        dates = pd.to_datetime(df['date']).values.astype('datetime64[D]')
+        fields = {f: pd.to_numeric(df[f], errors='coerce').values for f in BAR_FIELDS if f in df.columns}
+        return dates, fields
+
+    def _merge(self, entry, fetched):
+        """合并新获取的数据，同一日期以新数据为准"""
+        dates, fields = entry[0], entry[1]
+        new_dates, new_fields = fetched
+        keep = ~np.isin(dates, new_dates)
+        merged = {}
+        for f in BAR_FIELDS:
+            old = fields.get(f, np.full(len(dates), np.nan))[keep]
+            new = new_fields.get(f, np.full(len(new_dates), np.nan))
+            merged[f] = np.concatenate([old, new])
+        return np.concatenate([dates[keep], new_dates]), merged
+
+    def get_bars(self, code, start_date=None, end_date=None, fetch=True):
+        """
+        获取日K线，缓存未覆盖的区间会按需从接口补齐
+        :param code: 股票代码，如"sh.600000"
+        :param start_date: 开始日期，格式YYYY-MM-DD，默认为30天前
+        :param end_date: 结束日期，格式YYYY-MM-DD，默认为今天
+        :param fetch: 为False时只读取本地缓存
+        :return: DataFrame，列为 date(YYYY-MM-DD), open, high, low, close, volume
+        """
+        today = np.datetime64(datetime.now().date(), 'D')
+        end = np.datetime64(end_date, 'D') if end_date else today
+        start = np.datetime64(start_date, 'D') if start_date else end - 30
+
+        entry = self._read(code)
+        if fetch:
+            # 只有获取成功（包括确实没有K线）的区间才计入已覆盖区间，获取失败的下次会重新获取
+            if entry is None:
+                fetched = self._fetch(code, start, end)
+                if fetched is not None:
+                    # 当天的K线可能尚未收盘，不计入已覆盖区间，下次会重新获取
+                    self._write(code, fetched[0], fetched[1], start, min(end, today - 1))
+            else:
+                dates, fields, covered_start, covered_end = entry
+                changed = False
+                if start < covered_start:
+                    fetched = self._fetch(code, start, covered_start - 1)
+                    if fetched is not None:
+                        dates, fields = self._merge((dates, fields), fetched)
+                        covered_start = start
+                        changed = True
+                if end > covered_end:
+                    fetched = self._fetch(code, covered_end + 1, end)
+                    if fetched is not None:
+                        dates, fields = self._merge((dates, fields), fetched)
+                        covered_end = max(covered_end, min(end, today - 1))
+                        changed = True
+                if changed:
+                    self._write(code, dates, fields, covered_start, covered_end)
+            entry = self._read(code)
+
+        if entry is None:
+            return pd.DataFrame(columns=['date'] + list(BAR_FIELDS))
+
+        dates, fields = entry[0], entry[1]
+        mask = (dates >= start) & (dates <= end)
+        df = pd.DataFrame({f: fields[f][mask] for f in BAR_FIELDS if f in fields})
+        df.insert(0, 'date', pd.to_datetime(dates[mask]).strftime('%Y-%m-%d'))
+        return df.reset_index(drop=True)
+
+    def cached_codes(self):
+        """返回已缓存的股票代码列表"""
+        return sorted(name[:-4] for name in os.listdir(self.cache_dir)
+                      if name.endswith('.npz') and not name.endswith('.tmp.npz'))
+
+    def load_panel(self, codes=None, start_date=None, end_date=None,
+                   fields=('close', 'volume'), dtype=np.float64):
+        """
+        从本地缓存构造对齐的行情面板（不访问网络）
+        :param codes: 股票代码列表，默认为全部已缓存股票
+        :param fields: 需要的字段
+        :return: (dates, codes, {field: T×N数组})，缺失值为NaN
+        """
+        codes = list(codes) if codes is not None else self.cached_codes()
+        entries = []
+        for code in codes:
+            entry = self._read(code)
+            if entry is not None:
+                entries.append((code, entry))
+        if not entries:
+            return np.array([], dtype='datetime64[D]'), [], {f: np.empty((0, 0), dtype=dtype) for f in fields}
+
+        start = np.datetime64(start_date, 'D') if start_date else None
+        end = np.datetime64(end_date, 'D') if end_date else None
+        all_dates = np.unique(np.concatenate([e[0] for _, e in entries]))
+        if start is not None:
+            all_dates = all_dates[all_dates >= start]
+        if end is not None:
+            all_dates = all_dates[all_dates <= end]
+
+        panel = {f: np.full((len(all_dates), len(entries)), np.nan, dtype=dtype) for f in fields}
+        for j, (_, (dates, data, _, _)) in enumerate(entries):
+            rows = np.searchsorted(all_dates, dates)
+            valid = (rows < len(all_dates))
+            valid[valid] = all_dates[rows[valid]] == dates[valid]
+            for f in fields:
+                if f in data:
+                    panel[f][rows[valid], j] = data[f][valid]
+        return all_dates, [code for code, _ in entries], panel
+
+
+# 创建K线缓存实例
+bar_store = BarStore()
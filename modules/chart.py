@@ -0,0 +1,924 @@
+import math
+import threading
+import tkinter as tk
+import numpy as np
+import pandas as pd
+from matplotlib.backends import _backend_tk
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgb
+from matplotlib.ticker import FuncFormatter, MaxNLocator
+
+# 图表配色（与行情页面一致）
+TEXT_COLOR = "#ffffff"
+ACCENT_COLOR = "#1e90ff"
+GRID_COLOR = "#1a3c5e"
+CHART_BG_COLOR = "#0d1926"
+CHART_AREA_COLOR = "#142638"
+UP_COLOR = "#ff4d4d"  # 涨用红色
+DOWN_COLOR = "#00e676"  # 跌用绿色
+
+# 每根K线至少占用的像素宽度，超过时按像素宽度合并
+MIN_BAR_PIXELS = 3
+
+# 缩放时最少显示的K线数
+MIN_VISIBLE_BARS = 10
+
+# 热力图颜色在 ±HEATMAP_LIMIT% 处饱和
+HEATMAP_LIMIT = 5.0
+HEATMAP_FLAT_COLOR = "#3a4a5c"  # 平盘
+HEATMAP_EMPTY_COLOR = CHART_BG_COLOR  # 无数据/空白格
+
+
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets 降采样：保留走势形状的前提下把折线压缩到 n_out 个点
+    :return: 被保留的点的下标数组
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)
+    keep = np.empty(n_out, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # 下一个桶的平均点
+        next_start = edges[i + 1]
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+        # 选出与上一个保留点、下一个桶平均点组成的三角形面积最大的点
+        area = np.abs((x[a] - avg_x) * (y[start:stop] - y[a]) - (x[a] - x[start:stop]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+
+def aggregate_bars(opens, highs, lows, closes, volumes, start, stop, step):
+    """
+    把 [start, stop) 区间的K线每 step 根合并成一根（开盘取首、收盘取尾、最高/最低取极值、成交量求和），
+    分桶边界对齐到 step 的整数倍，平移时合并结果保持稳定
+    :return: (桶中心横坐标, 桶宽度, 开, 高, 低, 收, 量)
+    """
+    bounds = np.arange(start - start % step, stop, step)
+    bounds[0] = start
+    last = np.append(bounds[1:], stop) - 1
+    offsets = bounds - start
+    o = opens[bounds]
+    c = closes[last]
+    h = np.maximum.reduceat(highs[start:stop], offsets)
+    lo = np.minimum.reduceat(lows[start:stop], offsets)
+    v = np.add.reduceat(volumes[start:stop], offsets)
+    centers = (bounds + last) / 2
+    widths = (last - bounds + 1).astype(float)
+    return centers, widths, o, h, lo, c, v
+
+
+def _rectangles(centers, half_widths, bottoms, tops):
+    """生成 PolyCollection 用的矩形顶点数组 (n, 4, 2)"""
+    left, right = centers - half_widths, centers + half_widths
+    return np.stack([np.column_stack([left, bottoms]), np.column_stack([left, tops]),
+                     np.column_stack([right, tops]), np.column_stack([right, bottoms])], axis=1)
+
+
+class OffscreenCanvas(FigureCanvasTkAgg):
+    """
+    后台渲染的Tk画布。
+    draw() / draw_idle() 不在Tk主线程中绘制：对图表的修改以任务的形式提交给渲染线程，
+    渲染线程在 render_lock 下依次执行任务，再把整张图画进Agg缓冲区，
+    然后复制出一帧通过 after() 交给Tk线程，主线程每次只需把这帧 blit 到 PhotoImage 上。
+    同一 key 的待执行任务只保留最新一个，连续多次修改合并成一次渲染；
+    Tk线程来不及显示的旧帧直接丢弃。
+    """
+
+    def __init__(self, figure, master=None):
+        self.render_lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._jobs = []            # [(key, 任务函数)]
+        self._dirty = False        # 是否需要重新渲染
+        self._frame = None         # 等待Tk线程显示的最新一帧
+        self._present_pending = False
+        self._closed = False
+        super().__init__(figure, master=master)
+        self._render_thread = threading.Thread(target=self._render_loop, name="chart-render", daemon=True)
+        self._render_thread.start()
+
+    # ---------- 提交任务 ----------
+
+    def submit(self, func=None, key=None):
+        """
+        提交一个在渲染线程中执行的任务，执行完后重新渲染
+        :param func: 修改图表的函数，为None时只请求重绘
+        :param key: 合并键，队列中已有同一 key 的任务时用新任务替换它
+        """
+        with self._cond:
+            if func is not None:
+                for i, (pending_key, _) in enumerate(self._jobs):
+                    if key is not None and pending_key == key:
+                        self._jobs[i] = (key, func)
+                        break
+                else:
+                    self._jobs.append((key, func))
+            self._dirty = True
+            self._cond.notify()
+
+    def run_or_submit(self, func, key=None):
+        """渲染线程空闲时直接在当前线程执行（十字线这类只需局部blit的改动），忙时排队"""
+        if self.render_lock.acquire(blocking=False):
+            try:
+                func()
+            finally:
+                self.render_lock.release()
+        else:
+            self.submit(func, key)
+
+    def draw(self):
+        self.submit()
+
+    def draw_idle(self):
+        self.submit()
+
+    def close(self):
+        """停止渲染线程"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+
+    # ---------- 渲染线程 ----------
+
+    def _render_loop(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                jobs, self._jobs = self._jobs, []
+                self._dirty = False
+
+            with self.render_lock:
+                for _, func in jobs:
+                    try:
+                        func()
+                    except Exception as e:
+                        print(f"图表渲染任务出错: {e}")
+                with self._cond:
+                    if not self._jobs:
+                        self._dirty = False  # 任务中请求的重绘由本次渲染完成
+                try:
+                    FigureCanvasAgg.draw(self)
+                    frame = np.array(self.buffer_rgba())  # 复制一份，渲染下一帧时不影响显示
+                except Exception as e:
+                    print(f"图表渲染出错: {e}")
+                    continue
+
+            with self._cond:
+                self._frame = frame
+                schedule = not self._present_pending
+                self._present_pending = True
+            if schedule:
+                try:
+                    self._tkcanvas.after(0, self._present)
+                except (RuntimeError, tk.TclError):
+                    return  # 窗口已经销毁
+
+    # ---------- Tk线程 ----------
+
+    def _present(self):
+        """（Tk线程）把渲染好的最新一帧 blit 到画布上"""
+        with self._cond:
+            frame, self._frame = self._frame, None
+            self._present_pending = False
+        if frame is None:
+            return
+        if frame.shape[:2] != (self._tkphoto.height(), self._tkphoto.width()):
+            return  # 渲染期间画布尺寸变了，等下一帧
+        _backend_tk.blit(self._tkphoto, frame, (0, 1, 2, 3))
+
+    def blit(self, bbox=None):
+        # 渲染线程中不直接操作Tk，整帧画完后会统一显示
+        if threading.current_thread() is not self._render_thread:
+            super().blit(bbox)
+
+    def resize(self, event):
+        # 修改图表尺寸要等渲染线程画完当前帧
+        with self.render_lock:
+            super().resize(event)
+
+    def _update_device_pixel_ratio(self, event=None):
+        with self.render_lock:
+            super()._update_device_pixel_ratio(event)
+
+
+class PriceChart:
+    """
+    常驻的K线图渲染器（价格区 + 成交量区）。
+    坐标轴、刻度、网格和各个图元只在创建时生成一次，切换股票或刷新时只替换数据。
+    K线实体、影线和成交量柱各用一个 PolyCollection / LineCollection 绘制，
+    可见K线数超过坐标区像素宽度时按像素合并（K线取开高低收极值、折线用LTTB），
+    多年日线或密集的小时线也只绘制与像素数相当的图元。
+    横坐标为K线序号，没有交易的时段不会留下空白。
+    鼠标悬停的十字线用 blit 绘制：完整重绘后缓存背景，移动鼠标时只恢复背景并重画十字线。
+    支持滚轮缩放和拖动平移；视图接近已加载数据的最左端时调用 on_need_history(最早日期)，
+    由调用方异步取回更早的数据后用 prepend 拼接到前面。
+    """
+
+    def __init__(self, fig, ax, canvas, volume_ax=None):
+        self.fig = fig
+        self.ax = ax
+        self.volume_ax = volume_ax
+        self.canvas = canvas
+        self.period = None
+        self.style = "candle"  # "candle" K线 或 "line" 折线
+        self.on_need_history = None  # 回调：需要更早的历史数据时调用，参数为当前最早的日期
+        self._drag = None  # 拖动平移时记录 (起始像素x, 起始xlim)
+        self._set_empty()
+
+        # 坐标轴外观只设置一次
+        fig.patch.set_facecolor(CHART_BG_COLOR)
+        axes = [ax] + ([volume_ax] if volume_ax is not None else [])
+        for a in axes:
+            a.set_facecolor(CHART_AREA_COLOR)
+            a.tick_params(axis='both', colors=TEXT_COLOR)
+            a.grid(True, linestyle='--', alpha=0.3, color=GRID_COLOR)
+        ax.set_ylabel("价格", color=TEXT_COLOR)
+        bottom_ax = axes[-1]
+        bottom_ax.set_xlabel("时间", color=TEXT_COLOR)
+        bottom_ax.tick_params(axis='x', labelrotation=30)
+        bottom_ax.xaxis.set_major_locator(MaxNLocator(nbins=8, integer=True))
+        bottom_ax.xaxis.set_major_formatter(FuncFormatter(self._format_x))
+        if volume_ax is not None:
+            ax.tick_params(axis='x', labelbottom=False)
+            volume_ax.set_ylabel("成交量", color=TEXT_COLOR)
+            volume_ax.yaxis.set_major_locator(MaxNLocator(nbins=3))
+            volume_ax.yaxis.set_major_formatter(FuncFormatter(self._format_volume))
+
+        # 常驻图元
+        self.wicks = LineCollection([], linewidths=1)
+        self.bodies = PolyCollection([], linewidths=0.8)
+        ax.add_collection(self.wicks)
+        ax.add_collection(self.bodies)
+        self.line, = ax.plot([], [], linestyle='-', color=ACCENT_COLOR, linewidth=1.5, visible=False)
+        self.last_point, = ax.plot([], [], linestyle='', marker='o', color='red', markersize=7, zorder=5)
+        self.last_label = ax.annotate('', (0, 0), xytext=(-8, 8), textcoords='offset points',
+                                      ha='right', color=TEXT_COLOR, visible=False,
+                                      bbox=dict(boxstyle="round,pad=0.2", fc=CHART_AREA_COLOR, alpha=0.7))
+        self.message = ax.text(0.5, 0.5, '', horizontalalignment='center', verticalalignment='center',
+                               color=TEXT_COLOR, transform=ax.transAxes, visible=False)
+        self.volume_bars = PolyCollection([], linewidths=0)
+        if volume_ax is not None:
+            volume_ax.add_collection(self.volume_bars)
+
+        # 悬停十字线（animated图元不参与普通重绘，只在blit时绘制）
+        self.hover_line = ax.axvline(x=0, color='gray', linestyle='-', linewidth=1, alpha=0.8,
+                                     animated=True, visible=False)
+        self.hover_text = ax.text(0, 0, '', ha='center', va='top', fontsize=9, fontweight='bold',
+                                  color='red', animated=True, visible=False,
+                                  bbox=dict(boxstyle='round,pad=0.3', facecolor='white', alpha=0.9,
+                                            edgecolor='gray'))
+        self.hover_index = None
+        self._background = None
+        canvas.mpl_connect('draw_event', self._on_draw)
+
+        fig.subplots_adjust(left=0.12, right=0.96, top=0.92, bottom=0.18, hspace=0.05)
+
+    def _set_empty(self):
+        self.dates = pd.DatetimeIndex([])
+        self.x = np.array([], dtype=float)   # 横坐标（K线序号）
+        self.open = self.high = self.low = self.close = self.volume = np.array([], dtype=float)
+
+    # ---------- 坐标格式 ----------
+
+    def _format_x(self, value, pos=None):
+        i = int(round(value))
+        if i < 0 or i >= len(self.dates):
+            return ''
+        return self.dates[i].strftime('%m-%d %H:%M' if self.period == "hourly" else '%Y-%m-%d')
+
+    @staticmethod
+    def _format_volume(value, pos=None):
+        if value >= 1e8:
+            return f"{value / 1e8:.1f}亿"
+        if value >= 1e4:
+            return f"{value / 1e4:.0f}万"
+        return f"{value:.0f}"
+
+    # ---------- 数据 ----------
+
+    def set_period(self, period):
+        """日线/小时线只影响横坐标的日期格式"""
+        self.period = period
+
+    def set_style(self, style):
+        """切换K线/折线显示"""
+        if style != self.style:
+            self.style = style
+            self.refresh_view()
+
+    def set_title(self, title):
+        self.ax.set_title(title, color=TEXT_COLOR)
+
+    def _clear_artists(self):
+        self.wicks.set_segments([])
+        self.bodies.set_verts([])
+        self.volume_bars.set_verts([])
+        self.line.set_data([], [])
+
+    def show_message(self, title, text=''):
+        """清空数据并在图中显示提示文字"""
+        self.set_title(title)
+        self._set_empty()
+        self._clear_artists()
+        self.last_point.set_data([], [])
+        self.last_label.set_visible(False)
+        self.message.set_text(text)
+        self.message.set_visible(bool(text))
+        self.hide_hover()
+        self.canvas.draw_idle()
+
+    @staticmethod
+    def _frame_to_arrays(df):
+        """把行情DataFrame转换为 (日期, 开, 高, 低, 收, 量) 数组"""
+        close = pd.to_numeric(df['close'], errors='coerce').to_numpy(dtype=float)
+
+        def price_column(name):
+            if name not in df.columns:
+                return close.copy()
+            values = pd.to_numeric(df[name], errors='coerce').to_numpy(dtype=float)
+            return np.where(np.isnan(values), close, values)
+
+        if 'volume' in df.columns:
+            volume = pd.to_numeric(df['volume'], errors='coerce').fillna(0).to_numpy(dtype=float)
+        else:
+            volume = np.zeros(len(close))
+        dates = pd.DatetimeIndex(pd.to_datetime(df['date']))
+        return dates, price_column('open'), price_column('high'), price_column('low'), close, volume
+
+    def _update_last_point(self):
+        if len(self.x):
+            last_x, last_price = self.x[-1], self.close[-1]
+            self.last_point.set_data([last_x], [last_price])
+            self.last_label.xy = (last_x, last_price)
+            self.last_label.set_text(f'{last_price:.2f}')
+            self.last_label.set_visible(True)
+        else:
+            self.last_point.set_data([], [])
+            self.last_label.set_visible(False)
+
+    def set_data(self, df, title, period, view_bars=None):
+        """
+        替换图表数据
+        :param df: 包含 date, close 列的DataFrame（open/high/low/volume 可选，缺失时用收盘价/0代替）
+        :param view_bars: 初始显示最近多少根K线，默认显示全部
+        """
+        self.set_period(period)
+        self.set_title(title)
+        self.dates, self.open, self.high, self.low, self.close, self.volume = self._frame_to_arrays(df)
+        self.x = np.arange(len(self.close), dtype=float)
+
+        self.message.set_visible(False)
+        self._update_last_point()
+        self._reset_hover()
+        n = max(len(self.x), 1)
+        shown = min(view_bars, n) if view_bars else n
+        self.ax.set_xlim(n - shown - 0.5, n - 0.5)
+        self.refresh_view()
+
+    def prepend(self, df):
+        """把更早的历史数据拼接到前面，保持当前视图位置不变"""
+        dates, o, h, lo, c, v = self._frame_to_arrays(df)
+        if len(self.dates):
+            older = dates < self.dates[0]
+            dates, o, h, lo, c, v = dates[older], o[older], h[older], lo[older], c[older], v[older]
+        count = len(dates)
+        if count == 0:
+            return 0
+
+        self.dates = dates.append(self.dates)
+        self.open = np.concatenate([o, self.open])
+        self.high = np.concatenate([h, self.high])
+        self.low = np.concatenate([lo, self.low])
+        self.close = np.concatenate([c, self.close])
+        self.volume = np.concatenate([v, self.volume])
+        self.x = np.arange(len(self.close), dtype=float)
+
+        # 横坐标是K线序号，前面插入后视图整体右移同样的根数
+        left, right = self.ax.get_xlim()
+        self.ax.set_xlim(left + count, right + count)
+        self._update_last_point()
+        self._reset_hover()
+        self.refresh_view()
+        return count
+
+    def merge_latest(self, df):
+        """
+        并入最新的K线（定时刷新用）：与最后一根同一时间的替换，更晚的追加在后面，
+        已加载的更早历史和当前视图保持不变；视图原本停在最右端时跟随新K线右移
+        :return: 新追加的K线根数
+        """
+        dates, o, h, lo, c, v = self._frame_to_arrays(df)
+        if len(self.dates) == 0 or len(dates) == 0:
+            return 0
+        newer = dates >= self.dates[-1]
+        if not newer.any():
+            return 0
+        dates, o, h, lo, c, v = dates[newer], o[newer], h[newer], lo[newer], c[newer], v[newer]
+
+        old_count = len(self.close)
+        keep = old_count - 1 if dates[0] == self.dates[-1] else old_count
+        self.dates = self.dates[:keep].append(dates)
+        self.open = np.concatenate([self.open[:keep], o])
+        self.high = np.concatenate([self.high[:keep], h])
+        self.low = np.concatenate([self.low[:keep], lo])
+        self.close = np.concatenate([self.close[:keep], c])
+        self.volume = np.concatenate([self.volume[:keep], v])
+        self.x = np.arange(len(self.close), dtype=float)
+
+        added = len(self.close) - old_count
+        left, right = self.ax.get_xlim()
+        if added and right >= old_count - 1.5:
+            self.ax.set_xlim(left + added, right + added)
+        self._update_last_point()
+        self.refresh_view()
+        return added
+
+    # ---------- 缩放与平移 ----------
+
+    def _set_view(self, left, right):
+        """设置横坐标范围（限制在已加载数据附近）并刷新"""
+        n = len(self.x)
+        width = right - left
+        # 左侧允许留出少量空白，用于触发加载更早的数据
+        left = min(max(left, -0.5 - width * 0.2), n - 0.5 - MIN_VISIBLE_BARS)
+        self.ax.set_xlim(left, left + width)
+        self.refresh_view()
+        if self.on_need_history and n and left < width * 0.5:
+            self.on_need_history(self.dates[0])
+
+    def zoom(self, center, factor):
+        """以 center 为中心缩放，factor<1 放大"""
+        n = len(self.x)
+        if n == 0:
+            return
+        left, right = self.ax.get_xlim()
+        if center is None:
+            center = (left + right) / 2
+        width = min(max((right - left) * factor, MIN_VISIBLE_BARS), n + n * 0.2)
+        ratio = (center - left) / (right - left) if right > left else 0.5
+        new_left = center - width * ratio
+        self._set_view(new_left, new_left + width)
+
+    def start_drag(self, pixel_x):
+        self._drag = (pixel_x, self.ax.get_xlim())
+        self._reset_hover()
+
+    def drag(self, pixel_x):
+        """拖动平移：按像素位移换算成K线根数"""
+        if self._drag is None or len(self.x) == 0:
+            return
+        start_pixel, (left, right) = self._drag
+        bars_per_pixel = (right - left) / max(1.0, self.ax.bbox.width)
+        shift = (start_pixel - pixel_x) * bars_per_pixel
+        self._set_view(left + shift, right + shift)
+
+    def end_drag(self):
+        self._drag = None
+
+    @property
+    def dragging(self):
+        return self._drag is not None
+
+    # ---------- 按可见范围生成图元 ----------
+
+    def visible_range(self):
+        """当前横坐标范围内的K线下标区间 [start, stop)"""
+        left, right = self.ax.get_xlim()
+        start = max(0, int(math.floor(left + 0.5)))
+        stop = min(len(self.x), int(math.ceil(right + 0.5)))
+        return start, max(start, stop)
+
+    def refresh_view(self):
+        """按当前可见范围和像素宽度重新生成K线/折线/成交量图元并请求重绘"""
+        start, stop = self.visible_range()
+        count = stop - start
+        if count == 0:
+            self._clear_artists()
+            self.canvas.draw_idle()
+            return
+
+        pixels = max(1, int(self.ax.bbox.width))
+        step = max(1, int(math.ceil(count / max(1, pixels // MIN_BAR_PIXELS))))
+        centers, widths, o, h, lo, c, volumes = aggregate_bars(
+            self.open, self.high, self.low, self.close, self.volume, start, stop, step)
+        rising = c >= o
+        colors = np.where(rising, UP_COLOR, DOWN_COLOR)
+
+        if self.style == "line":
+            keep = start + lttb(self.x[start:stop], self.close[start:stop], pixels)
+            self.line.set_data(self.x[keep], self.close[keep])
+            self.line.set_visible(True)
+            self.wicks.set_segments([])
+            self.bodies.set_verts([])
+            y_low, y_high = np.nanmin(self.close[start:stop]), np.nanmax(self.close[start:stop])
+        else:
+            self.line.set_visible(False)
+            # 影线：每根一条竖线段；实体：每根一个矩形
+            self.wicks.set_segments(np.stack([np.column_stack([centers, lo]),
+                                              np.column_stack([centers, h])], axis=1))
+            self.wicks.set_color(colors)
+            self.bodies.set_verts(_rectangles(centers, widths * 0.35, np.minimum(o, c), np.maximum(o, c)))
+            self.bodies.set_facecolor(colors)
+            self.bodies.set_edgecolor(colors)
+            y_low, y_high = np.nanmin(lo), np.nanmax(h)
+
+        # 成交量柱
+        if self.volume_ax is not None:
+            self.volume_bars.set_verts(_rectangles(centers, widths * 0.35, np.zeros_like(volumes), volumes))
+            self.volume_bars.set_facecolor(colors)
+            self.volume_ax.set_ylim(0, max(float(np.nanmax(volumes)), 1.0) * 1.1)
+
+        # 纵坐标只按可见数据缩放
+        if np.isfinite(y_low) and np.isfinite(y_high):
+            margin = (y_high - y_low) * 0.05 or max(abs(y_high) * 0.01, 0.01)
+            self.ax.set_ylim(y_low - margin, y_high + margin)
+        self.canvas.draw_idle()
+
+    # ---------- 悬停十字线 ----------
+
+    def _on_draw(self, event):
+        """每次完整重绘后缓存坐标区背景，并把十字线画进这一帧"""
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        if self.hover_index is not None:
+            self.ax.draw_artist(self.hover_line)
+            self.ax.draw_artist(self.hover_text)
+
+    def nearest_index(self, xdata):
+        """二分查找距离 xdata 最近的数据点下标"""
+        n = len(self.x)
+        if n == 0 or xdata is None:
+            return None
+        i = int(np.searchsorted(self.x, xdata))
+        if i >= n:
+            return n - 1
+        if i > 0 and xdata - self.x[i - 1] <= self.x[i] - xdata:
+            return i - 1
+        return i
+
+    def hover(self, xdata):
+        """显示最接近 xdata 的K线的十字线和开高低收；与上次是同一根时不重画"""
+        index = self.nearest_index(xdata)
+        if index is None:
+            self.hide_hover()
+            return
+        if index == self.hover_index:
+            return
+        self.hover_index = index
+
+        x = self.x[index]
+        y_min, y_max = self.ax.get_ylim()
+
+        self.hover_line.set_xdata([x, x])
+        self.hover_text.set_position((x, y_max - (y_max - y_min) * 0.03))  # 在图表顶部显示
+        self.hover_text.set_text(f"{self._format_x(x)}\n"
+                                 f"开 {self.open[index]:.2f}  高 {self.high[index]:.2f}\n"
+                                 f"低 {self.low[index]:.2f}  收 {self.close[index]:.2f}(元)")
+        self.hover_line.set_visible(True)
+        self.hover_text.set_visible(True)
+        self._blit_hover()
+
+    def _reset_hover(self):
+        self.hover_index = None
+        self.hover_line.set_visible(False)
+        self.hover_text.set_visible(False)
+
+    def hide_hover(self):
+        if self.hover_index is None:
+            return
+        self._reset_hover()
+        self._blit_hover()
+
+    def _blit_hover(self):
+        if self._background is None:
+            return
+        self.canvas.restore_region(self._background)
+        if self.hover_index is not None:
+            self.ax.draw_artist(self.hover_line)
+            self.ax.draw_artist(self.hover_text)
+        self.canvas.blit(self.ax.bbox)
+
+
+class SparklineGrid:
+    """
+    自选股迷你走势图网格：所有股票画在同一个坐标区里，每只股票占一个格子。
+    全部走势线合成一个 LineCollection，线段坐标由 时间×股票 的收盘价面板一次向量化算出；
+    收到新报价时只改写对应股票的最后一个点和文字，再整体替换线段数组。
+    """
+
+    PAD_X = 0.06       # 格子内左右留白（占格子宽度的比例）
+    TEXT_HEIGHT = 0.3  # 格子上方文字区高度
+    PAD_BOTTOM = 0.08
+
+    def __init__(self, fig, canvas, columns=6):
+        self.fig = fig
+        self.canvas = canvas
+        self.columns = columns
+        self.codes = []
+        self.names = []
+        self.closes = np.empty((0, 0))  # (T+1)×N，最后一行是最新报价
+        self.changes = np.empty(0)
+        self.selected = None
+
+        fig.patch.set_facecolor(CHART_BG_COLOR)
+        self.ax = fig.add_axes([0, 0, 1, 1])
+        self.ax.set_axis_off()
+        self.cells = PolyCollection([], facecolors=CHART_AREA_COLOR, edgecolors=GRID_COLOR, linewidths=0.8)
+        self.lines = LineCollection([], linewidths=1.2)
+        self.ax.add_collection(self.cells)
+        self.ax.add_collection(self.lines)
+        self.highlight = PolyCollection([], facecolors='none', edgecolors=ACCENT_COLOR, linewidths=2)
+        self.ax.add_collection(self.highlight)
+        self.message = self.ax.text(0.5, 0.5, '', ha='center', va='center', color=TEXT_COLOR,
+                                    transform=self.ax.transAxes, visible=False)
+        self.titles = []   # 格子左上角：名称和代码
+        self.quotes = []   # 格子右上角：最新价和涨跌幅
+        self._segments = np.empty((0, 0, 2))
+
+    @property
+    def rows(self):
+        return max(1, math.ceil(len(self.codes) / self.columns))
+
+    def _cell_origin(self, index):
+        """格子左上角坐标（纵轴向下）"""
+        index = np.asarray(index)
+        return index % self.columns, index // self.columns
+
+    def show_message(self, text):
+        self.set_data([], [], np.empty((0, 0)), np.empty(0))
+        self.message.set_text(text)
+        self.message.set_visible(True)
+        self.canvas.draw_idle()
+
+    def set_data(self, codes, names, closes, changes):
+        """
+        替换全部数据
+        :param codes: 股票代码列表
+        :param names: 股票名称列表
+        :param closes: T×N 收盘价面板（可含NaN），最后一行应为最新价
+        :param changes: 每只股票的当日涨跌幅(%)
+        """
+        self.codes = list(codes)
+        self.names = list(names)
+        closes = pd.DataFrame(np.asarray(closes, dtype=float)).ffill().bfill().to_numpy(copy=True)
+        self.closes = closes if closes.size else np.empty((0, len(self.codes)))
+        self.changes = np.asarray(changes, dtype=float)
+        if self.selected is not None and self.selected >= len(self.codes):
+            self.selected = None
+        self.message.set_visible(False)
+
+        n = len(self.codes)
+        self.ax.set_xlim(0, self.columns)
+        self.ax.set_ylim(self.rows, 0)
+        col, row = self._cell_origin(np.arange(n))
+        self.cells.set_verts(_rectangles(col + 0.5, np.full(n, 0.48), row + 0.02, row + 0.98))
+        self._segments = self._compute_segments(self.closes, np.arange(n))
+        self.lines.set_segments(self._segments)
+        self.lines.set_colors(self._line_colors(self.changes))
+
+        # 文字图元按需增减
+        while len(self.titles) < n:
+            self.titles.append(self.ax.text(0, 0, '', ha='left', va='top', fontsize=8, color=TEXT_COLOR))
+            self.quotes.append(self.ax.text(0, 0, '', ha='right', va='top', fontsize=8, fontweight='bold'))
+        for i, (title, quote) in enumerate(zip(self.titles, self.quotes)):
+            visible = i < n
+            title.set_visible(visible)
+            quote.set_visible(visible)
+            if visible:
+                title.set_position((col[i] + self.PAD_X / 2, row[i] + 0.06))
+                title.set_text(f"{self.names[i]}\n{self.codes[i]}")
+                quote.set_position((col[i] + 1 - self.PAD_X / 2, row[i] + 0.06))
+                self._update_quote_text(i)
+        self._update_highlight()
+        self.canvas.draw_idle()
+
+    def _compute_segments(self, closes, columns):
+        """把指定列的收盘价归一化到各自格子里，返回 (列数, T, 2) 的线段坐标"""
+        t, n = closes.shape[0], len(columns)
+        if t == 0 or n == 0:
+            return np.empty((n, 0, 2))
+        values = closes[:, columns]
+        low = values.min(axis=0)
+        span = values.max(axis=0) - low
+        norm = np.divide(values - low, span, out=np.full_like(values, 0.5), where=span > 0)
+        norm[np.isnan(values)] = np.nan  # 没有数据的股票不画线
+        col, row = self._cell_origin(columns)
+        steps = np.linspace(0, 1, t)[:, None] if t > 1 else np.full((1, 1), 0.5)
+        xs = col + self.PAD_X + steps * (1 - 2 * self.PAD_X)
+        height = 1 - self.TEXT_HEIGHT - self.PAD_BOTTOM
+        ys = row + 1 - self.PAD_BOTTOM - norm * height
+        return np.stack([xs, ys], axis=-1).transpose(1, 0, 2)
+
+    @staticmethod
+    def _line_colors(changes):
+        colors = np.where(changes > 0, UP_COLOR, np.where(changes < 0, DOWN_COLOR, TEXT_COLOR))
+        return list(colors)
+
+    def _update_quote_text(self, i):
+        change = self.changes[i]
+        price = self.closes[-1, i] if self.closes.size else float('nan')
+        self.quotes[i].set_text(f"{price:.2f}\n{change:+.2f}%" if np.isfinite(price) else "无数据")
+        self.quotes[i].set_color(UP_COLOR if change > 0 else DOWN_COLOR if change < 0 else TEXT_COLOR)
+
+    def update_quotes(self, quotes):
+        """
+        增量更新最新报价：只重算有变化的股票的线段和文字
+        :param quotes: {代码: (最新价, 涨跌幅)}
+        :return: 实际更新的股票数
+        """
+        if not self.codes or not self.closes.size:
+            return 0
+        index = {code: i for i, code in enumerate(self.codes)}
+        changed = []
+        for code, (price, change) in quotes.items():
+            i = index.get(code)
+            if i is None or not price:
+                continue
+            if self.closes[-1, i] != price or self.changes[i] != change:
+                self.closes[-1, i] = price
+                self.changes[i] = change
+                changed.append(i)
+        if not changed:
+            return 0
+        changed = np.array(changed)
+        self._segments[changed] = self._compute_segments(self.closes, changed)
+        self.lines.set_segments(self._segments)
+        self.lines.set_colors(self._line_colors(self.changes))
+        for i in changed:
+            self._update_quote_text(i)
+        self.canvas.draw_idle()
+        return len(changed)
+
+    def index_at(self, xdata, ydata):
+        """坐标 -> 格子对应的股票下标（空白处为None）"""
+        if xdata is None or ydata is None:
+            return None
+        col, row = int(xdata), int(ydata)
+        index = row * self.columns + col
+        if 0 <= col < self.columns and 0 <= index < len(self.codes):
+            return index
+        return None
+
+    def select(self, index):
+        self.selected = index
+        self._update_highlight()
+        self.canvas.draw_idle()
+
+    def _update_highlight(self):
+        if self.selected is None:
+            self.highlight.set_verts([])
+            return
+        col, row = self._cell_origin(np.array([self.selected]))
+        self.highlight.set_verts(_rectangles(col + 0.5, np.array([0.48]), row + 0.02, row + 0.98))
+
+
+class MarketHeatmap:
+    """
+    全市场热力图：每只股票一个方格，按涨跌幅着色，同一分组（板块）的股票排在一起。
+    整张图是一个 AxesImage，颜色由 涨跌幅 -> 颜色查找表 的向量化索引生成，
+    新行情到来时只重写颜色数组，几千个方格的更新几乎没有开销。
+    """
+
+    def __init__(self, fig, canvas, limit=HEATMAP_LIMIT):
+        self.fig = fig
+        self.canvas = canvas
+        self.limit = limit
+        self.codes = []
+        self.names = []
+        self.groups = []          # 每只股票所属分组
+        self.group_order = []     # 分组显示顺序
+        self.changes = np.empty(0)
+        self._latest = {}         # 最近一次行情 {代码: 涨跌幅}，重新排版后据此着色
+        self.width = 1
+        self._group_ids = np.empty(0, dtype=int)
+        self._rows = np.empty(0, dtype=int)  # 每只股票方格的行、列
+        self._cols = np.empty(0, dtype=int)
+        self._cell_index = np.full((1, 1), -1)  # 行×列 -> 股票下标，-1表示空白
+        self._lut = self._build_lut()
+        self._empty = (np.array(to_rgb(HEATMAP_EMPTY_COLOR) + (1.0,)) * 255).astype(np.uint8)
+        self._pixels = np.zeros((1, 1, 4), dtype=np.uint8)
+
+        fig.patch.set_facecolor(CHART_BG_COLOR)
+        self.ax = fig.add_axes([0.01, 0.01, 0.98, 0.98])
+        self.ax.set_axis_off()
+        self.image = self.ax.imshow(self._pixels, interpolation='nearest', aspect='auto')
+        self.group_labels = []
+        self.message = self.ax.text(0.5, 0.5, '', ha='center', va='center', color=TEXT_COLOR,
+                                    transform=self.ax.transAxes, visible=False)
+
+    @staticmethod
+    def _build_lut(n=256):
+        """涨跌幅颜色查找表：下标 0 为跌停侧（绿），n-1 为涨停侧（红），中间为平盘色"""
+        t = np.linspace(-1, 1, n)[:, None]
+        flat = np.array(to_rgb(HEATMAP_FLAT_COLOR))
+        up = np.array(to_rgb(UP_COLOR))
+        down = np.array(to_rgb(DOWN_COLOR))
+        rgb = np.where(t < 0, flat + (down - flat) * -t, flat + (up - flat) * t)
+        return (np.column_stack([rgb, np.ones(n)]) * 255).astype(np.uint8)
+
+    def show_message(self, text):
+        self.message.set_text(text)
+        self.message.set_visible(True)
+        self.canvas.draw_idle()
+
+    def set_universe(self, codes, names, groups, group_order=None):
+        """
+        设置股票集合并重新排版（股票集合变化时调用）
+        :param groups: 每只股票的分组名
+        :param group_order: 分组显示顺序，默认按首次出现的顺序
+        """
+        codes = list(codes)
+        groups = list(groups)
+        if group_order is None:
+            group_order = list(dict.fromkeys(groups))
+        rank = {g: i for i, g in enumerate(group_order)}
+        order = sorted(range(len(codes)), key=lambda i: (rank.get(groups[i], len(rank)), codes[i]))
+        self.codes = [codes[i] for i in order]
+        self.names = [list(names)[i] for i in order] if names is not None else list(self.codes)
+        self.groups = [groups[i] for i in order]
+        self.group_order = [g for g in group_order if g in set(groups)]
+        group_rank = {g: i for i, g in enumerate(self.group_order)}
+        self._group_ids = np.array([group_rank[g] for g in self.groups], dtype=int)
+
+        # 按画布宽高比确定每行方格数，每个分组上方留一行写标题
+        n = len(self.codes)
+        w, h = self.fig.get_size_inches()
+        self.width = max(10, math.ceil(math.sqrt(max(n, 1) * w / h)))
+        rows = np.empty(n, dtype=int)
+        cols = np.empty(n, dtype=int)
+        label_rows = []
+        row = 0
+        start = 0
+        for count in np.bincount(self._group_ids, minlength=len(self.group_order)):
+            label_rows.append(row)
+            k = np.arange(count)
+            rows[start:start + count] = row + 1 + k // self.width
+            cols[start:start + count] = k % self.width
+            row += 1 + math.ceil(count / self.width)
+            start += count
+        self._rows, self._cols = rows, cols
+        self._cell_index = np.full((max(row, 1), self.width), -1)
+        self._cell_index[rows, cols] = np.arange(n)
+        self._pixels = np.empty(self._cell_index.shape + (4,), dtype=np.uint8)
+        self._pixels[:] = self._empty
+
+        while len(self.group_labels) < len(self.group_order):
+            self.group_labels.append(self.ax.text(0, 0, '', ha='left', va='center', fontsize=9,
+                                                  color=TEXT_COLOR, fontweight='bold'))
+        for i, label in enumerate(self.group_labels):
+            label.set_visible(i < len(label_rows))
+            if i < len(label_rows):
+                label.set_position((-0.4, label_rows[i]))
+        self.image.set_extent((-0.5, self.width - 0.5, self._cell_index.shape[0] - 0.5, -0.5))
+        self.message.set_visible(not n)
+        self.set_changes(self._latest)
+
+    def set_changes(self, changes):
+        """
+        更新涨跌幅并重新着色
+        :param changes: {代码: 涨跌幅(%)}，缺失或为None表示无数据
+        """
+        self._latest = changes
+        self.changes = np.array([np.nan if changes.get(code) is None else changes[code] for code in self.codes],
+                                dtype=float)
+        self._recolor()
+
+    def _recolor(self):
+        changes = self.changes
+        valid = np.isfinite(changes)
+        index = np.clip((np.nan_to_num(changes) / self.limit + 1) / 2 * (len(self._lut) - 1),
+                        0, len(self._lut) - 1).astype(int)
+        colors = self._lut[index]
+        colors[~valid] = self._empty
+        self._pixels[self._rows, self._cols] = colors
+        self.image.set_data(self._pixels)
+
+        # 分组标题带上涨跌家数
+        n_groups = len(self.group_order)
+        total = np.bincount(self._group_ids, minlength=n_groups)
+        up = np.bincount(self._group_ids[changes > 0], minlength=n_groups)
+        down = np.bincount(self._group_ids[changes < 0], minlength=n_groups)
+        for i, (label, group) in enumerate(zip(self.group_labels, self.group_order)):
+            label.set_text(f"{group}  共{total[i]}只  上涨{up[i]}  下跌{down[i]}")
+        self.canvas.draw_idle()
+
+    def index_at(self, xdata, ydata):
+        """坐标 -> 方格对应的股票下标（空白处为None）"""
+        if xdata is None or ydata is None:
+            return None
+        row, col = int(round(ydata)), int(round(xdata))
+        if 0 <= row < self._cell_index.shape[0] and 0 <= col < self.width:
+            index = self._cell_index[row, col]
+            return int(index) if index >= 0 else None
+        return None
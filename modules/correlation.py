@@ -0,0 +1,361 @@
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+from .bar_store import bar_store
+
+CORRELATION_DIR = os.path.join("data", "correlation")
+
+
+class CorrelationService:
+    """
+    全市场收益率相关性服务。
+    在最近 window 个交易日的日收益率上维护 N×N 的二阶矩矩阵 Σ r·rᵀ 和共同有数据的天数矩阵
+    （float32 内存映射文件），停牌等缺失日不计入（不当作0%收益率）：
+    二阶矩只在两只股票都有数据的日子上累加，均值和方差按各自有数据的日子计算。
+    相关系数按行块从二阶矩、天数和各股收益率之和推出，不需要把整个矩阵读入内存。
+    新交易日到来时只做秩k更新（加上新的一天、减去移出窗口的一天），不必全量重算。
+    """
+
+    def __init__(self, data_dir=None, window=120, min_periods=60, block_size=512):
+        self.data_dir = data_dir or CORRELATION_DIR
+        self.window = window
+        self.min_periods = min_periods
+        self.block_size = block_size
+        self._lock = threading.RLock()
+
+        self.codes = []
+        self._index = {}
+        self.dates = np.array([], dtype='datetime64[D]')
+        self._returns = None   # window×N 窗口内收益率（缺失为NaN）
+        self._sums = None      # N 窗口内有数据的收益率之和
+        self._moments = None   # N×N 二阶矩（内存映射）
+        self._counts = None    # N×N 两只股票都有数据的天数（内存映射），对角线为各自有数据的天数
+        self._labels = None    # 聚类结果缓存
+        self._stats = None     # (均值, 标准差) 缓存
+        self._updates_since_rebuild = 0
+
+    # ---------- 持久化 ----------
+
+    def _path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def _save_state(self):
+        np.save(self._path("returns.npy"), self._returns)
+        np.save(self._path("sums.npy"), self._sums)
+        meta = {
+            "codes": self.codes,
+            "dates": [str(d) for d in self.dates],
+            "window": self.window,
+            "updates_since_rebuild": self._updates_since_rebuild,
+            "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        with open(self._path("meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+    def load(self):
+        """加载上次生成的结果，不存在或损坏时返回False"""
+        try:
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            returns = np.load(self._path("returns.npy"))
+            sums = np.load(self._path("sums.npy"))
+            n = len(meta["codes"])
+            moments = np.memmap(self._path("moments.f32"), dtype=np.float32, mode="r+",
+                                shape=(max(n, 1), max(n, 1)))
+            counts = np.memmap(self._path("counts.f32"), dtype=np.float32, mode="r+",
+                               shape=(max(n, 1), max(n, 1)))
+        except Exception as e:
+            if os.path.exists(self._path("meta.json")):
+                print(f"相关性服务: 加载失败: {e}")
+            return False
+
+        with self._lock:
+            self.codes = meta["codes"]
+            self._index = {code: i for i, code in enumerate(self.codes)}
+            self.dates = np.array(meta["dates"], dtype='datetime64[D]')
+            self.window = meta.get("window", self.window)
+            self._updates_since_rebuild = meta.get("updates_since_rebuild", 0)
+            self._returns, self._sums, self._moments, self._counts = returns, sums, moments, counts
+            self._labels = None
+            self._stats = None
+        return True
+
+    @property
+    def ready(self):
+        return self._moments is not None
+
+    # ---------- 构建与增量更新 ----------
+
+    def _load_returns(self, codes, start_date):
+        """从K线缓存读取收盘价面板并计算日收益率（当天尚未收盘，不计入）"""
+        end_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        dates, codes, panel = bar_store.load_panel(codes, start_date=start_date, end_date=end_date,
+                                                   fields=('close',))
+        close = panel['close']
+        if len(dates) < 2:
+            return dates[1:], codes, np.empty((0, len(codes)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = close[1:] / close[:-1] - 1
+        returns[~np.isfinite(returns)] = np.nan
+        return dates[1:], codes, returns
+
+    def _build_matrix(self, name, values, n):
+        """分块计算 valuesᵀ·values 写入内存映射文件（先写临时文件再替换），返回打开的映射"""
+        tmp_path = self._path(name.replace(".f32", ".tmp.f32"))
+        matrix = np.memmap(tmp_path, dtype=np.float32, mode="w+", shape=(max(n, 1), max(n, 1)))
+        for start in range(0, n, self.block_size):
+            stop = min(start + self.block_size, n)
+            matrix[start:stop, :n] = values[:, start:stop].T @ values
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, self._path(name))
+        return np.memmap(self._path(name), dtype=np.float32, mode="r+", shape=(max(n, 1), max(n, 1)))
+
+    def rebuild(self, codes=None):
+        """
+        全量重建（分块计算二阶矩矩阵）
+        :param codes: 股票代码列表，默认为全部已缓存股票
+        """
+        # 按自然日多取一些，保证覆盖 window 个交易日
+        start_date = (datetime.now() - timedelta(days=int(self.window * 1.6) + 30)).strftime("%Y-%m-%d")
+        dates, codes, returns = self._load_returns(codes, start_date)
+        dates, returns = dates[-self.window:], returns[-self.window:]
+
+        # 窗口内有效数据不足的股票不参与计算
+        keep = (~np.isnan(returns)).sum(axis=0) >= min(self.min_periods, len(dates))
+        codes = [code for code, k in zip(codes, keep) if k]
+        window_returns = returns[:, keep].astype(np.float32)
+        n = len(codes)
+
+        os.makedirs(self.data_dir, exist_ok=True)
+        with self._lock:
+            # 先释放旧的映射，Windows下才能替换文件
+            self._moments = None
+            self._counts = None
+            r64 = np.nan_to_num(window_returns.astype(np.float64))
+            observed = np.isfinite(window_returns).astype(np.float64)
+            self._moments = self._build_matrix("moments.f32", r64, n)
+            self._counts = self._build_matrix("counts.f32", observed, n)
+
+            self.codes = codes
+            self._index = {code: i for i, code in enumerate(codes)}
+            self.dates = dates
+            self._returns = window_returns
+            self._sums = r64.sum(axis=0)
+            self._labels = None
+            self._stats = None
+            self._updates_since_rebuild = 0
+            self._save_state()
+
+        print(f"相关性服务: 已重建 {n} 只股票 × {len(dates)} 个交易日")
+        return n
+
+    def update(self):
+        """
+        把K线缓存中的新交易日并入窗口：二阶矩只做秩k更新。
+        股票池变化、累计更新过多或新数据超过一个窗口时改为全量重建。
+        :return: 并入的交易日数量
+        """
+        with self._lock:
+            if not self.ready or len(self.dates) == 0:
+                self.rebuild()
+                return len(self.dates)
+            last_date = self.dates[-1]
+            codes = list(self.codes)
+
+        # 需要上一交易日收盘价计算收益率，多取几天
+        start_date = str(last_date - 10)
+        dates, loaded_codes, returns = self._load_returns(codes, start_date)
+        new = dates > last_date
+        if not new.any():
+            return 0
+        if loaded_codes != codes or new.sum() >= self.window or \
+                self._updates_since_rebuild + new.sum() >= self.window:
+            # 股票池变化或float32累计误差可能变大，直接重建
+            self.rebuild()
+            return int(new.sum())
+
+        added = returns[new].astype(np.float32)
+        with self._lock:
+            k = len(added)
+            n_drop = max(0, len(self._returns) + k - self.window)
+            dropped = self._returns[:n_drop]
+
+            a64, d64 = np.nan_to_num(added.astype(np.float64)), np.nan_to_num(dropped.astype(np.float64))
+            am, dm = np.isfinite(added).astype(np.float64), np.isfinite(dropped).astype(np.float64)
+            n = len(self.codes)
+            for start in range(0, n, self.block_size):
+                stop = min(start + self.block_size, n)
+                delta = a64[:, start:stop].T @ a64
+                count_delta = am[:, start:stop].T @ am
+                if n_drop:
+                    delta -= d64[:, start:stop].T @ d64
+                    count_delta -= dm[:, start:stop].T @ dm
+                self._moments[start:stop, :n] += delta.astype(np.float32)
+                self._counts[start:stop, :n] += count_delta.astype(np.float32)
+            self._moments.flush()
+            self._counts.flush()
+
+            self._sums += a64.sum(axis=0) - d64.sum(axis=0)
+            self._returns = np.concatenate([self._returns[n_drop:], added])
+            self.dates = np.concatenate([self.dates[n_drop:], dates[new]])
+            self._labels = None
+            self._stats = None
+            self._updates_since_rebuild += k
+            self._save_state()
+
+        print(f"相关性服务: 已并入 {k} 个新交易日")
+        return k
+
+    # ---------- 查询 ----------
+
+    def _corr_rows(self, rows):
+        """
+        由二阶矩推出若干行的相关系数（rows为行下标数组）。
+        每对股票只用两者都有数据的日子，均值和标准差按各自有数据的日子计算；共同天数不足2天的为NaN
+        """
+        n = len(self.codes)
+        if len(self._returns) < 2:
+            # 收益率窗口不足两天时相关系数无定义
+            return np.full((len(rows), n), np.nan)
+        if self._stats is None:
+            observed = np.diagonal(self._counts[:n, :n]).astype(np.float64)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean = self._sums / observed
+                variance = np.diagonal(self._moments[:n, :n]).astype(np.float64) / observed - mean ** 2
+            std = np.sqrt(np.clip(variance, 0, None))
+            std[(observed < 2) | ~(std >= 1e-8)] = np.nan
+            self._stats = (mean, std)
+        mean, std = self._stats
+
+        pair = np.asarray(self._counts[rows, :n], dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = np.asarray(self._moments[rows, :n], dtype=np.float64) / pair - np.outer(mean[rows], mean)
+            corr = cov / np.outer(std[rows], std)
+        corr[pair < 2] = np.nan
+        return np.clip(corr, -1, 1)
+
+    def correlation(self, codes):
+        """返回给定股票之间的相关系数矩阵，未收录的股票为NaN"""
+        with self._lock:
+            if not self.ready:
+                return np.full((len(codes), len(codes)), np.nan)
+            idx = np.array([self._index.get(code, -1) for code in codes])
+            known = idx >= 0
+            result = np.full((len(codes), len(codes)), np.nan)
+            if known.any():
+                rows = self._corr_rows(idx[known])
+                result[np.ix_(known, known)] = rows[:, idx[known]]
+            return result
+
+    def iter_blocks(self):
+        """按行块遍历完整的相关系数矩阵，产出 (起始行, 块)"""
+        with self._lock:
+            n = len(self.codes) if self.ready else 0
+        for start in range(0, n, self.block_size):
+            with self._lock:
+                block = self._corr_rows(np.arange(start, min(start + self.block_size, n)))
+            yield start, block.astype(np.float32)
+
+    def neighbors(self, code, k=10, most=True):
+        """
+        查找与某只股票相关性最高（most=False时为最低）的k只股票
+        :return: [(代码, 相关系数), ...]
+        """
+        with self._lock:
+            i = self._index.get(code)
+            if i is None:
+                return []
+            row = self._corr_rows(np.array([i]))[0]
+        row[i] = np.nan
+        valid = np.nonzero(~np.isnan(row))[0]
+        if len(valid) == 0:
+            return []
+        key = -row[valid] if most else row[valid]
+        k = min(k, len(valid))
+        top = valid[np.argpartition(key, k - 1)[:k]]
+        top = top[np.argsort(-row[top] if most else row[top])]
+        return [(self.codes[j], float(row[j])) for j in top]
+
+    def clusters(self, n_clusters=20, iterations=20, seed=0):
+        """
+        按收益率相关性聚类（球面k均值：标准化后的收益率向量内积即为相关系数）
+        :return: 每只股票的类别编号数组，与 self.codes 对齐
+        """
+        with self._lock:
+            if not self.ready or not self.codes:
+                return np.array([], dtype=np.int32)
+            if self._labels is not None and len(self._labels[1]) == n_clusters:
+                return self._labels[0]
+            returns = self._returns.astype(np.float64)
+
+        # 按有数据的日子去均值，缺失日取均值（对内积没有贡献）
+        observed = np.isfinite(returns)
+        mean = np.where(observed, returns, 0.0).sum(axis=0) / np.maximum(observed.sum(axis=0), 1)
+        z = np.where(observed, returns - mean, 0.0)
+        norms = np.linalg.norm(z, axis=0)
+        z = np.divide(z, norms, out=np.zeros_like(z), where=norms > 1e-8).T  # N×window
+        n = len(z)
+        n_clusters = min(n_clusters, n)
+
+        # k-means++ 初始化
+        rng = np.random.default_rng(seed)
+        centers = [z[rng.integers(n)]]
+        best = z @ centers[0]
+        for _ in range(1, n_clusters):
+            weight = np.clip(1 - best, 0, None)
+            total = weight.sum()
+            j = rng.choice(n, p=weight / total) if total > 0 else rng.integers(n)
+            centers.append(z[j])
+            best = np.maximum(best, z @ z[j])
+        centers = np.array(centers)
+
+        labels = np.zeros(n, dtype=np.int32)
+        for it in range(iterations):
+            new_labels = np.argmax(z @ centers.T, axis=1).astype(np.int32)
+            if it and np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+            for c in range(n_clusters):
+                members = z[labels == c]
+                if len(members):
+                    center = members.sum(axis=0)
+                    norm = np.linalg.norm(center)
+                    if norm > 0:
+                        centers[c] = center / norm
+
+        with self._lock:
+            self._labels = (labels, centers)
+        return labels
+
+    def cluster_of(self, code, n_clusters=20):
+        """返回 (类别编号, 同类股票代码列表)，未收录时为 (None, [])"""
+        labels = self.clusters(n_clusters)
+        i = self._index.get(code)
+        if i is None or i >= len(labels):
+            return None, []
+        members = [self.codes[j] for j in np.nonzero(labels == labels[i])[0] if j != i]
+        return int(labels[i]), members
+
+    def diversification(self, code, holdings):
+        """
+        评估新买入股票与现有持仓的相关性
+        :param holdings: 持仓股票代码列表
+        :return: {"max": (代码, 相关系数) 或 None, "mean": 平均相关系数或None}
+        """
+        others = [h for h in holdings if h != code]
+        if code not in self._index or not others:
+            return {"max": None, "mean": None}
+        corr = self.correlation([code] + others)[0, 1:]
+        valid = ~np.isnan(corr)
+        if not valid.any():
+            return {"max": None, "mean": None}
+        j = int(np.nanargmax(corr))
+        return {"max": (others[j], float(corr[j])), "mean": float(corr[valid].mean())}
+
+
+# 创建相关性服务实例（启动时加载上次生成的结果）
+correlation_service = CorrelationService()
+correlation_service.load()
@@ -1,18 +1,68 @@
 import os
+import json
+import random
 import sqlite3
+import threading
+import time
 from datetime import datetime
 
+# 等待其它连接释放写锁的时间（秒）
+BUSY_TIMEOUT = 5.0
+# 写事务冲突时的最多尝试次数；重试间隔（秒）按指数退避并加随机抖动
+WRITE_RETRIES = 20
+WRITE_RETRY_DELAY = 0.002
+
+
+def _is_conflict(error):
+    """是否为并发写冲突（可以重试）"""
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+
 class Database:
     """基于SQLite的数据库类，用于管理用户数据和股票数据"""
     
-    def __init__(self):
-        self.data_dir = "data"
+    def __init__(self, db_path=None):
+        """
+        :param db_path: 数据库文件路径，默认为 data/stock_simulator.db（压力测试等工具可指定临时文件）
+        """
+        if db_path is None:
+            db_path = os.path.join("data", "stock_simulator.db")
+        self.data_dir = os.path.dirname(db_path) or "."
         os.makedirs(self.data_dir, exist_ok=True)
-        self.db_path = os.path.join(self.data_dir, "stock_simulator.db")
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+        self.db_path = db_path
+        self._local = threading.local()  # 每个线程使用自己的连接，事务互不干扰
+        self._delete_listeners = []  # 删除用户后的回调 callback(username)
+        # WAL 模式下读不阻塞写，多个线程的连接可以并发读
+        self.conn.execute("PRAGMA journal_mode=WAL")
         self._initialize_tables()
         self._initialize_default_data()
+        self._initialize_ledger()
+
+    @property
+    def conn(self):
+        """当前线程的数据库连接（第一次使用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT)
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def _retry_on_conflict(self, func, *args):
+        """
+        乐观并发：写事务与其它连接的写入冲突（数据库被锁定）时回滚当前事务，
+        稍等片刻后整体重试，不在应用层加全局锁
+        """
+        for attempt in range(WRITE_RETRIES):
+            try:
+                return func(*args)
+            except sqlite3.OperationalError as e:
+                if self.conn.in_transaction:
+                    self.conn.rollback()
+                if not _is_conflict(e) or attempt == WRITE_RETRIES - 1:
+                    raise
+                time.sleep(WRITE_RETRY_DELAY * min(2 ** attempt, 50) * random.random())
 
     def _initialize_tables(self):
         cursor = self.conn.cursor()
@@ -56,10 +106,101 @@ class Database:
                 timestamp TEXT
             )
         ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS watchlist (
+                username TEXT,
+                stock_code TEXT,
+                added_at TEXT,
+                PRIMARY KEY (username, stock_code)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT,
+                stock_code TEXT,
+                side TEXT,
+                order_type TEXT,
+                trigger_price REAL,
+                quantity INTEGER,
+                status TEXT,
+                fill_price REAL,
+                message TEXT,
+                created_at TEXT,
+                updated_at TEXT
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status)")
+        # 账本快照：某用户在 event_id（transactions.id）处的余额和持仓，event_id=0 为开户时的状态
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ledger_snapshots (
+                username TEXT,
+                event_id INTEGER,
+                balance REAL,
+                holdings TEXT,
+                created_at TEXT,
+                PRIMARY KEY (username, event_id)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_transactions_user ON transactions (username, id)")
+        # 税务批次：每笔买入（open_event_id 为买入的 transactions.id，0 为开户时已有的持仓）一个批次，
+        # quantity 为尚未卖出的数量
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tax_lots (
+                username TEXT,
+                stock_code TEXT,
+                open_event_id INTEGER,
+                open_date TEXT,
+                open_price REAL,
+                original_quantity INTEGER,
+                quantity INTEGER,
+                PRIMARY KEY (username, stock_code, open_event_id)
+            )
+        ''')
+        # 已实现盈亏：一笔卖出按先进先出匹配到的每个批次一行
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS realized_pnl (
+                sell_event_id INTEGER,
+                open_event_id INTEGER,
+                username TEXT,
+                stock_code TEXT,
+                stock_name TEXT,
+                date TEXT,
+                quantity INTEGER,
+                open_price REAL,
+                close_price REAL,
+                pnl REAL,
+                PRIMARY KEY (sell_event_id, open_event_id)
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_realized_user ON realized_pnl (username, date)")
+        # 批次表已处理到的事件号
+        cursor.execute("CREATE TABLE IF NOT EXISTS lot_watermark (id INTEGER PRIMARY KEY CHECK (id=1), last_event_id INTEGER)")
+        # 每日收盘净值：每个用户每天一行
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS nav_history (
+                username TEXT,
+                date TEXT,
+                cash REAL,
+                market_value REAL,
+                total_value REAL,
+                flow REAL,
+                PRIMARY KEY (username, date)
+            ) WITHOUT ROWID
+        ''')
         cursor.execute("PRAGMA table_info(holdings)")
         columns = [row[1] for row in cursor.fetchall()]
         if 'name' not in columns:
             cursor.execute('ALTER TABLE holdings ADD COLUMN name TEXT')
+        cursor.execute("PRAGMA table_info(orders)")
+        columns = [row[1] for row in cursor.fetchall()]
+        if 'client_order_id' not in columns:
+            cursor.execute('ALTER TABLE orders ADD COLUMN client_order_id TEXT')
+        # 客户端订单号在同一用户内唯一，重复提交时返回原订单的结果
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_client_id ON orders (username, client_order_id)
+            WHERE client_order_id IS NOT NULL
+        ''')
         self.conn.commit()
 
     def _initialize_default_data(self):
@@ -214,6 +355,43 @@ class Database:
         
         self.conn.commit()
 
+    def _initialize_ledger(self):
+        """
+        为还没有开户快照的用户补写开户快照（event_id=0）：
+        由当前余额、持仓倒推回全部交易之前的状态，之后用交易记录重放即可得到任意时刻的账户
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT username, balance FROM users
+            WHERE username NOT IN (SELECT username FROM ledger_snapshots WHERE event_id=0)
+        ''')
+        users = cursor.fetchall()
+        if not users:
+            return
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        snapshots = []
+        for user in users:
+            username = user["username"]
+            cursor.execute('''
+                SELECT stock_code,
+                       SUM(CASE type WHEN 'buy' THEN quantity WHEN 'sell' THEN -quantity ELSE 0 END) AS net_quantity,
+                       SUM(CASE type WHEN 'buy' THEN amount WHEN 'sell' THEN -amount ELSE -amount END) AS net_spent
+                FROM transactions WHERE username=? GROUP BY stock_code
+            ''', (username,))
+            flows = cursor.fetchall()
+            balance = user["balance"] + sum(row["net_spent"] or 0 for row in flows)
+            net_quantity = {row["stock_code"]: row["net_quantity"] or 0 for row in flows if row["stock_code"]}
+            holdings = {}
+            for code, holding in self.get_holdings(username).items():
+                quantity = holding["quantity"] - net_quantity.get(code, 0)
+                if quantity > 0:
+                    holdings[code] = [quantity, holding["cost"], holding["name"]]
+            snapshots.append((username, 0, balance, json.dumps(holdings, ensure_ascii=False), now))
+        cursor.executemany("INSERT INTO ledger_snapshots (username, event_id, balance, holdings, created_at) "
+                           "VALUES (?, ?, ?, ?, ?)", snapshots)
+        self.conn.commit()
+        print(f"账本: 已为 {len(snapshots)} 个用户生成开户快照")
+
     # 用户相关
     def get_users(self):
         cursor = self.conn.cursor()
@@ -264,8 +442,11 @@ class Database:
         if self.user_exists(username):
             return False
         cursor = self.conn.cursor()
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         cursor.execute("INSERT INTO users (username, password, type, balance, created_at) VALUES (?, ?, ?, ?, ?)",
-                       (username, password, user_type, initial_balance, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                       (username, password, user_type, initial_balance, now))
+        cursor.execute("INSERT OR REPLACE INTO ledger_snapshots (username, event_id, balance, holdings, created_at) "
+                       "VALUES (?, 0, ?, '{}', ?)", (username, initial_balance, now))
         self.conn.commit()
         return True
 
@@ -273,8 +454,11 @@ class Database:
         if self.user_exists(username):
             return False, "用户名已存在"
         cursor = self.conn.cursor()
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         cursor.execute("INSERT INTO users (username, password, type, balance, created_at) VALUES (?, ?, ?, ?, ?)",
-                       (username, password, user_type, initial_balance, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+                       (username, password, user_type, initial_balance, now))
+        cursor.execute("INSERT OR REPLACE INTO ledger_snapshots (username, event_id, balance, holdings, created_at) "
+                       "VALUES (?, 0, ?, '{}', ?)", (username, initial_balance, now))
         self.conn.commit()
         return True, "用户添加成功"
 
@@ -302,6 +486,13 @@ class Database:
         sql = f"UPDATE users SET {', '.join(update_fields)} WHERE username=?"
         cursor = self.conn.cursor()
         cursor.execute(sql, update_values)
+        # 管理员修改余额记为一笔资金调整（deposit）事件，账本重放时才能得到一致的余额
+        if "balance" in data and data["balance"] != user["balance"]:
+            amount = data["balance"] - user["balance"]
+            cursor.execute('''
+                INSERT INTO transactions (username, type, stock_code, stock_name, price, quantity, amount, timestamp)
+                VALUES (?, 'deposit', NULL, NULL, 0, 0, ?, ?)
+            ''', (username, amount, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
         self.conn.commit()
         return True, "用户信息更新成功"
 
@@ -312,13 +503,35 @@ class Database:
         cursor.execute("DELETE FROM users WHERE username=?", (username,))
         cursor.execute("DELETE FROM holdings WHERE username=?", (username,))
         cursor.execute("DELETE FROM transactions WHERE username=?", (username,))
+        cursor.execute("DELETE FROM watchlist WHERE username=?", (username,))
+        cursor.execute("DELETE FROM orders WHERE username=?", (username,))
+        cursor.execute("DELETE FROM ledger_snapshots WHERE username=?", (username,))
+        cursor.execute("DELETE FROM nav_history WHERE username=?", (username,))
+        cursor.execute("DELETE FROM tax_lots WHERE username=?", (username,))
+        cursor.execute("DELETE FROM realized_pnl WHERE username=?", (username,))
         self.conn.commit()
+        for callback in list(self._delete_listeners):
+            try:
+                callback(username)
+            except Exception as e:
+                print(f"删除用户回调出错: {e}")
         return True, "用户删除成功"
 
+    def add_delete_listener(self, callback):
+        """注册删除用户后的回调 callback(username)，用于清理内存中的缓存"""
+        self._delete_listeners.append(callback)
+
     # 股票相关
-    def get_stocks(self):
+    def get_stocks(self, codes=None):
+        """全部股票，或只取 codes 中的股票（一次查询）"""
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM stocks")
+        if codes is None:
+            cursor.execute("SELECT * FROM stocks")
+        else:
+            codes = list(codes)
+            if not codes:
+                return {}
+            cursor.execute(f"SELECT * FROM stocks WHERE code IN ({','.join('?' * len(codes))})", codes)
         return {row["code"]: dict(row) for row in cursor.fetchall()}
 
     def get_stock(self, code):
@@ -379,6 +592,86 @@ class Database:
         cursor.execute("DELETE FROM holdings WHERE username=? AND stock_code=?", (username, stock_code))
         self.conn.commit()
 
+    # 自选股相关
+    def get_watchlist(self, username):
+        """返回用户的自选股代码列表（按加入时间排序）"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT stock_code FROM watchlist WHERE username=? ORDER BY added_at, stock_code", (username,))
+        return [row["stock_code"] for row in cursor.fetchall()]
+
+    def add_to_watchlist(self, username, stock_code):
+        if not self.get_stock(stock_code):
+            return False, "股票不存在"
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO watchlist (username, stock_code, added_at) VALUES (?, ?, ?)",
+                       (username, stock_code, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        self.conn.commit()
+        if cursor.rowcount == 0:
+            return False, "该股票已在自选股中"
+        return True, "已加入自选股"
+
+    def remove_from_watchlist(self, username, stock_code):
+        cursor = self.conn.cursor()
+        cursor.execute("DELETE FROM watchlist WHERE username=? AND stock_code=?", (username, stock_code))
+        self.conn.commit()
+        return True, "已移出自选股"
+
+    # 挂单相关
+    def add_order(self, username, stock_code, side, order_type, trigger_price, quantity, client_order_id=None):
+        """
+        新增一笔挂单，返回(订单号, 是否新增)
+        :param client_order_id: 客户端订单号，同一用户下已存在时不再新增，返回原订单号
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute('''
+                INSERT INTO orders (username, stock_code, side, order_type, trigger_price, quantity, status,
+                                    client_order_id, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, 'open', ?, ?, ?)
+            ''', (username, stock_code, side, order_type, trigger_price, quantity, client_order_id, now, now))
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            return self.get_order_by_client_id(username, client_order_id)['id'], False
+        self.conn.commit()
+        return cursor.lastrowid, True
+
+    def get_order(self, order_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM orders WHERE id=?", (order_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def get_order_by_client_id(self, username, client_order_id):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM orders WHERE username=? AND client_order_id=?", (username, client_order_id))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def get_open_orders(self):
+        """返回全部未成交的挂单"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM orders WHERE status='open' ORDER BY id")
+        return [dict(row) for row in cursor.fetchall()]
+
+    def get_user_orders(self, username, status=None):
+        cursor = self.conn.cursor()
+        if status:
+            cursor.execute("SELECT * FROM orders WHERE username=? AND status=? ORDER BY id DESC", (username, status))
+        else:
+            cursor.execute("SELECT * FROM orders WHERE username=? ORDER BY id DESC", (username,))
+        return [dict(row) for row in cursor.fetchall()]
+
+    def update_order_status(self, order_id, status, fill_price=None, message=None, expected_status='open'):
+        """修改订单状态；只有当前状态为 expected_status 时才会修改，返回是否修改成功"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE orders SET status=?, fill_price=?, message=?, updated_at=?
+            WHERE id=? AND status=?
+        ''', (status, fill_price, message, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), order_id, expected_status))
+        self.conn.commit()
+        return cursor.rowcount > 0
+
     # 交易记录相关
     def record_transaction(self, username, transaction_type, stock_code, stock_name, price, quantity, amount):
         cursor = self.conn.cursor()
@@ -389,71 +682,519 @@ class Database:
         self.conn.commit()
         return True, "交易记录保存成功"
 
-    def get_user_transactions(self, username):
+    def get_user_transactions(self, username, since_id=None):
+        """返回用户的买卖记录（不含资金调整）；指定 since_id 时只返回该记录之后新增的"""
+        cursor = self.conn.cursor()
+        if since_id is not None:
+            cursor.execute("SELECT * FROM transactions WHERE username=? AND id>? AND type IN ('buy', 'sell') "
+                           "ORDER BY id", (username, since_id))
+        else:
+            cursor.execute("SELECT * FROM transactions WHERE username=? AND type IN ('buy', 'sell') "
+                           "ORDER BY timestamp", (username,))
+        return [dict(row) for row in cursor.fetchall()]
+
+    # 账本相关：transactions 表即只追加的事件日志，ledger_snapshots 为物化快照
+    def get_ledger_events(self, username, after_id=0, until_id=None, until_time=None):
+        """按事件号顺序返回用户在 (after_id, until_id] 区间、时间不晚于 until_time 的全部事件"""
+        sql = "SELECT * FROM transactions WHERE username=? AND id>?"
+        params = [username, after_id]
+        if until_id is not None:
+            sql += " AND id<=?"
+            params.append(until_id)
+        if until_time is not None:
+            sql += " AND timestamp<=?"
+            params.append(until_time)
         cursor = self.conn.cursor()
-        cursor.execute("SELECT * FROM transactions WHERE username=? ORDER BY timestamp", (username,))
+        cursor.execute(sql + " ORDER BY id", params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def get_last_event_id(self, username, until_time=None):
+        """用户最后一个（不晚于 until_time 的）事件号，没有事件时为0"""
+        cursor = self.conn.cursor()
+        if until_time is not None:
+            cursor.execute("SELECT MAX(id) FROM transactions WHERE username=? AND timestamp<=?", (username, until_time))
+        else:
+            cursor.execute("SELECT MAX(id) FROM transactions WHERE username=?", (username,))
+        return cursor.fetchone()[0] or 0
+
+    def get_ledger_snapshot(self, username, max_event_id=None):
+        """返回事件号不超过 max_event_id 的最新快照 {event_id, balance, holdings}，没有时返回None"""
+        cursor = self.conn.cursor()
+        if max_event_id is not None:
+            cursor.execute("SELECT * FROM ledger_snapshots WHERE username=? AND event_id<=? "
+                           "ORDER BY event_id DESC LIMIT 1", (username, max_event_id))
+        else:
+            cursor.execute("SELECT * FROM ledger_snapshots WHERE username=? ORDER BY event_id DESC LIMIT 1",
+                           (username,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {"event_id": row["event_id"], "balance": row["balance"], "holdings": json.loads(row["holdings"])}
+
+    def add_ledger_snapshots(self, snapshots):
+        """
+        批量写入快照
+        :param snapshots: [(username, event_id, balance, holdings)]，holdings 为 {代码: [数量, 成本价, 名称]}
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor = self.conn.cursor()
+        cursor.executemany("INSERT OR REPLACE INTO ledger_snapshots (username, event_id, balance, holdings, created_at) "
+                           "VALUES (?, ?, ?, ?, ?)",
+                           [(username, event_id, balance, json.dumps(holdings, ensure_ascii=False), now)
+                            for username, event_id, balance, holdings in snapshots])
+        self.conn.commit()
+
+    def rebuild_accounts(self, usernames, replay, events=None):
+        """
+        在一个 BEGIN IMMEDIATE 写事务中（可选地先追加事件）按账本重建用户的余额和持仓表，
+        重放期间其它连接的成交不能提交，重建结果不会覆盖并发成交
+        :param replay: replay(username) -> {"balance", "holdings"}，通过本线程的连接读取，能看到本事务追加的事件
+        :param events: 先追加的事件 [dict]，字段同 transactions 表（不含 id）；
+                       时点查询按事件号截取，时间早于该用户已有最新事件的事件整批拒绝
+        :return: (是否成功, 提示信息)
+        """
+        return self._retry_on_conflict(self._rebuild_accounts, usernames, replay, events or [])
+
+    def _rebuild_accounts(self, usernames, replay, events):
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if events:
+                error = self._insert_ledger_events(cursor, events)
+                if error:
+                    self.conn.rollback()
+                    return False, error
+            for username in usernames:
+                state = replay(username)
+                cursor.execute("UPDATE users SET balance=? WHERE username=?", (state["balance"], username))
+                cursor.execute("DELETE FROM holdings WHERE username=?", (username,))
+                cursor.executemany("INSERT INTO holdings (username, stock_code, quantity, cost, name) "
+                                   "VALUES (?, ?, ?, ?, ?)",
+                                   [(username, code, quantity, cost, name)
+                                    for code, (quantity, cost, name) in state["holdings"].items()])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return True, f"已追加 {len(events)} 个事件，重建 {len(usernames)} 个用户的账户"
+
+    def _insert_ledger_events(self, cursor, events):
+        """按时间顺序写入事件（不提交），有事件早于该用户已有的最新事件时不写入并返回错误信息"""
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        rows = sorted(((e["username"], e["type"], e.get("stock_code"), e.get("stock_name"), e.get("price", 0),
+                        e.get("quantity", 0), e["amount"], e.get("timestamp") or now) for e in events),
+                      key=lambda row: row[7])
+        earliest = {}
+        for row in rows:
+            earliest.setdefault(row[0], row[7])
+        for username, timestamp in earliest.items():
+            cursor.execute("SELECT MAX(timestamp) FROM transactions WHERE username=?", (username,))
+            latest = cursor.fetchone()[0]
+            if latest is not None and timestamp < latest:
+                return f"{username} 的事件时间 {timestamp} 早于已有的最新事件 {latest}，不能补录"
+        cursor.executemany('''
+            INSERT INTO transactions (username, type, stock_code, stock_name, price, quantity, amount, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        return None
+
+    # 净值相关
+    def save_nav_rows(self, rows):
+        """
+        批量写入每日净值（一次 executemany、一次提交，同一用户同一天的记录会被覆盖）
+        :param rows: [(username, date, cash, market_value, total_value, flow)]
+        """
+        cursor = self.conn.cursor()
+        cursor.executemany("INSERT OR REPLACE INTO nav_history (username, date, cash, market_value, total_value, flow) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.conn.commit()
+        return len(rows)
+
+    def get_nav_history(self, username=None, start_date=None):
+        """返回 [(username, date, total_value, flow)]，按用户、日期排序"""
+        sql = "SELECT username, date, total_value, flow FROM nav_history WHERE 1=1"
+        params = []
+        if username is not None:
+            sql += " AND username=?"
+            params.append(username)
+        if start_date is not None:
+            sql += " AND date>=?"
+            params.append(start_date)
+        cursor = self.conn.cursor()
+        cursor.execute(sql + " ORDER BY username, date", params)
+        return [tuple(row) for row in cursor.fetchall()]
+
+    def get_last_nav_dates(self):
+        """各用户最后一次记录净值的日期 {username: "YYYY-MM-DD"}"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT username, MAX(date) FROM nav_history GROUP BY username")
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+    def get_account_values(self):
+        """
+        全部用户的现金和按当前价计算的持仓市值（一次分组查询）
+        :return: {username: (balance, market_value)}，没有现价的持仓按成本价计
+        """
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT u.username, u.balance, COALESCE(v.market_value, 0)
+            FROM users u LEFT JOIN (
+                SELECT h.username,
+                       SUM(h.quantity * COALESCE(NULLIF(s.price, 0), NULLIF(h.cost, 0), 0)) AS market_value
+                FROM holdings h LEFT JOIN stocks s ON s.code=h.stock_code
+                GROUP BY h.username
+            ) v ON v.username=u.username
+        ''')
+        return {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+    def get_nav_users(self, date=None):
+        """有净值记录（或在 date 当天有记录）的用户集合"""
+        cursor = self.conn.cursor()
+        if date is not None:
+            cursor.execute("SELECT username FROM nav_history WHERE date=?", (date,))
+        else:
+            cursor.execute("SELECT DISTINCT username FROM nav_history")
+        return {row[0] for row in cursor.fetchall()}
+
+    def get_daily_flows(self, date):
+        """某一天各用户的资金调整合计 {username: amount}"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT username, SUM(amount) FROM transactions WHERE type='deposit' AND timestamp LIKE ? "
+                       "GROUP BY username", (f"{date}%",))
+        return {row[0]: row[1] for row in cursor.fetchall()}
+
+    # 税务批次相关
+    def get_lot_watermark(self):
+        """批次表已处理到的事件号，从未处理过时返回None"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT last_event_id FROM lot_watermark WHERE id=1")
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def get_open_lots(self):
+        """全部未卖完的批次，按用户、股票、买入顺序排列"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM tax_lots WHERE quantity>0 ORDER BY username, stock_code, open_event_id")
+        return [dict(row) for row in cursor.fetchall()]
+
+    def get_opening_holdings(self):
+        """各用户开户快照（event_id=0）中的持仓 {username: {代码: [数量, 成本价, 名称]}}"""
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT username, holdings FROM ledger_snapshots WHERE event_id=0")
+        return {row["username"]: json.loads(row["holdings"]) for row in cursor.fetchall()}
+
+    def get_events_after(self, after_id, limit=None):
+        """全部用户在 after_id 之后的事件，按事件号排序"""
+        cursor = self.conn.cursor()
+        if limit:
+            cursor.execute("SELECT * FROM transactions WHERE id>? ORDER BY id LIMIT ?", (after_id, limit))
+        else:
+            cursor.execute("SELECT * FROM transactions WHERE id>? ORDER BY id", (after_id,))
+        return [dict(row) for row in cursor.fetchall()]
+
+    def save_lot_changes(self, lots, realized, expected_watermark, watermark):
+        """
+        在一个事务中写入批次变化、已实现盈亏并推进处理位置。
+        只有处理位置仍为 expected_watermark 时才写入（乐观并发，防止两个进程重复处理同一批事件）
+        :param lots: [(username, stock_code, open_event_id, open_date, open_price, original_quantity, quantity)]
+        :param realized: [(sell_event_id, open_event_id, username, stock_code, stock_name, date, quantity,
+                           open_price, close_price, pnl)]
+        :return: 是否写入
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("BEGIN")
+            if expected_watermark is None:
+                cursor.execute("INSERT OR IGNORE INTO lot_watermark (id, last_event_id) VALUES (1, ?)", (watermark,))
+            else:
+                cursor.execute("UPDATE lot_watermark SET last_event_id=? WHERE id=1 AND last_event_id=?",
+                               (watermark, expected_watermark))
+            if cursor.rowcount == 0:
+                self.conn.rollback()
+                return False
+            cursor.executemany("INSERT OR REPLACE INTO tax_lots (username, stock_code, open_event_id, open_date, "
+                               "open_price, original_quantity, quantity) VALUES (?, ?, ?, ?, ?, ?, ?)", lots)
+            cursor.executemany("INSERT OR REPLACE INTO realized_pnl (sell_event_id, open_event_id, username, stock_code, "
+                               "stock_name, date, quantity, open_price, close_price, pnl) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", realized)
+            self.conn.commit()
+            return True
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def get_realized_pnl(self, username, group_by="trade", start_date=None, end_date=None):
+        """
+        已实现盈亏汇总
+        :param group_by: "trade" 按每笔卖出，"day" 按日期，"symbol" 按股票
+        :return: [dict]，含 quantity 卖出数量、cost 成本、proceeds 卖出金额、pnl 已实现盈亏
+        """
+        keys = {
+            "trade": "sell_event_id, date, stock_code, stock_name",
+            "day": "date",
+            "symbol": "stock_code, stock_name",
+        }[group_by]
+        sql = (f"SELECT {keys}, SUM(quantity) AS quantity, SUM(quantity*open_price) AS cost, "
+               f"SUM(quantity*close_price) AS proceeds, SUM(pnl) AS pnl FROM realized_pnl WHERE username=?")
+        params = [username]
+        if start_date is not None:
+            sql += " AND date>=?"
+            params.append(start_date)
+        if end_date is not None:
+            sql += " AND date<=?"
+            params.append(end_date)
+        cursor = self.conn.cursor()
+        cursor.execute(f"{sql} GROUP BY {keys} ORDER BY {keys.split(',')[0]}", params)
         return [dict(row) for row in cursor.fetchall()]
 
     # 交易执行
-    def execute_trade(self, username, transaction_type, stock_code, quantity):
-        user = self.get_user(username)
-        stock = self.get_stock(stock_code)
-        
+    def execute_trade(self, username, transaction_type, stock_code, quantity, price=None, client_order_id=None):
+        """
+        按股票当前价格（或指定的成交价 price）执行买卖，余额、持仓和交易记录在同一个事务中提交
+        :param client_order_id: 客户端订单号，重复提交（如超时重试）时不再成交，直接返回第一次的结果
+        """
+        return self.execute_trades([(username, transaction_type, stock_code, quantity, price, client_order_id)])[0]
+
+    def execute_trades(self, trades):
+        """
+        在一个事务中依次执行多笔交易并一次提交（分组提交），每笔交易各自成败
+        :param trades: [(username, transaction_type, stock_code, quantity, price, client_order_id, order_id)]，
+                       price为None时按当前价格，后三项可省略；
+                       指定 order_id（挂单成交）时订单状态与成交在同一事务中改为已成交/已拒绝，
+                       订单已不是未成交状态时不成交
+        :return: [(是否成功, 提示信息)]，与 trades 一一对应
+        """
+        return self._retry_on_conflict(self._execute_trades, trades)
+
+    def _execute_trades(self, trades):
+        results = []
+        cursor = self.conn.cursor()
+        try:
+            if not self.conn.in_transaction:
+                cursor.execute("BEGIN")
+            for trade in trades:
+                username, transaction_type, stock_code, quantity, price, client_order_id, order_id = \
+                    tuple(trade) + (None,) * (7 - len(trade))
+                # 每笔交易一个保存点，数据库出错时只撤销这一笔
+                cursor.execute("SAVEPOINT trade")
+                try:
+                    result = self._previous_result(cursor, username, client_order_id)
+                    if result is None:
+                        result = self._apply_trade(cursor, username, transaction_type, stock_code, quantity, price)
+                        if client_order_id is not None:
+                            self._record_market_order(cursor, username, transaction_type, stock_code, quantity,
+                                                      client_order_id, result)
+                        if order_id is not None and not self._settle_order(cursor, order_id, result):
+                            cursor.execute("ROLLBACK TO SAVEPOINT trade")
+                            result = (False, "订单已成交或已撤销")
+                except sqlite3.IntegrityError:
+                    # 同一客户端订单号已被另一次提交写入
+                    cursor.execute("ROLLBACK TO SAVEPOINT trade")
+                    result = self._previous_result(cursor, username, client_order_id) or (False, "重复的客户端订单号")
+                except sqlite3.Error as e:
+                    if _is_conflict(e):
+                        raise  # 写冲突，整批回滚后重试
+                    cursor.execute("ROLLBACK TO SAVEPOINT trade")
+                    result = (False, f"交易失败: {e}")
+                cursor.execute("RELEASE SAVEPOINT trade")
+                results.append(result)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return results
+
+    def execute_basket(self, username, orders):
+        """
+        一篮子委托全部成交或全部不成交（如30只股票的调仓）。
+        先在内存中按"先卖后买"模拟整篮交易，校验余额和持仓，全部通过后在一个事务中写入。
+        :param orders: [(transaction_type, stock_code, quantity)] 或 [(transaction_type, stock_code, quantity, price)]
+        :return: (是否成功, 提示信息, [(是否成功, 提示信息)]) 每腿结果与 orders 一一对应
+        """
+        legs = [tuple(order) + (None,) * (4 - len(order)) for order in orders]
+        if not legs:
+            return False, "委托篮子为空", []
+        # 卖出在前，卖出所得可用于同一篮子中的买入
+        sequence = sorted(range(len(legs)), key=lambda i: legs[i][0] != "sell")
+
+        return self._retry_on_conflict(self._execute_basket, username, legs, sequence)
+
+    def _execute_basket(self, username, legs, sequence):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT balance FROM users WHERE username=?", (username,))
+        user = cursor.fetchone()
         if not user:
+            return False, "用户不存在", [(False, "用户不存在")] * len(legs)
+
+        codes = sorted({leg[1] for leg in legs})
+        placeholders = ",".join("?" * len(codes))
+        cursor.execute(f"SELECT code, price FROM stocks WHERE code IN ({placeholders})", codes)
+        prices = {row["code"]: row["price"] for row in cursor.fetchall()}
+        cursor.execute(f"SELECT stock_code, quantity FROM holdings WHERE username=? AND stock_code IN ({placeholders})",
+                       [username] + codes)
+        held = {row["stock_code"]: row["quantity"] for row in cursor.fetchall()}
+
+        # 内存中模拟整篮交易
+        balance = user["balance"]
+        results = [None] * len(legs)
+        for i in sequence:
+            transaction_type, stock_code, quantity, price = legs[i]
+            if stock_code not in prices:
+                results[i] = (False, "股票不存在")
+            elif transaction_type not in ("buy", "sell"):
+                results[i] = (False, "交易类型无效")
+            elif not quantity or quantity <= 0:
+                results[i] = (False, "交易数量必须大于0")
+            else:
+                amount = (prices[stock_code] if price is None else price) * quantity
+                if transaction_type == "buy":
+                    if balance < amount:
+                        results[i] = (False, "余额不足")
+                        continue
+                    balance -= amount
+                    held[stock_code] = held.get(stock_code, 0) + quantity
+                else:
+                    if held.get(stock_code, 0) < quantity:
+                        results[i] = (False, "持仓不足")
+                        continue
+                    balance += amount
+                    held[stock_code] -= quantity
+                results[i] = (True, "校验通过")
+
+        failed = sum(1 for ok, _ in results if not ok)
+        if failed:
+            results = [result if not result[0] else (False, "未执行: 篮子中有委托校验失败") for result in results]
+            return False, f"{failed} 笔委托校验失败，整篮未执行", results
+
+        # 全部校验通过，在一个事务中写入
+        try:
+            if not self.conn.in_transaction:
+                cursor.execute("BEGIN")
+            for i in sequence:
+                results[i] = self._apply_trade(cursor, username, *legs[i])
+                if not results[i][0]:
+                    raise RuntimeError(results[i][1])
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            if _is_conflict(e):
+                raise  # 写冲突，回滚后重试
+            print(f"篮子委托执行失败，已回滚: {e}")
+            return False, f"篮子委托执行失败: {e}", [(False, "已回滚")] * len(legs)
+        return True, f"{len(legs)} 笔委托全部成交", results
+
+    def _previous_result(self, cursor, username, client_order_id):
+        """客户端订单号已处理过时返回当时的结果，否则返回None"""
+        if client_order_id is None:
+            return None
+        cursor.execute("SELECT status, message FROM orders WHERE username=? AND client_order_id=?",
+                       (username, client_order_id))
+        row = cursor.fetchone()
+        if row is None or row["status"] == 'open':
+            return None
+        return row["status"] == 'filled', row["message"]
+
+    def _record_market_order(self, cursor, username, side, stock_code, quantity, client_order_id, result):
+        """把带客户端订单号的市价单及其结果记入订单表（与成交在同一事务中）"""
+        success, message = result
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute('''
+            INSERT INTO orders (username, stock_code, side, order_type, trigger_price, quantity, status,
+                                fill_price, message, client_order_id, created_at, updated_at)
+            VALUES (?, ?, ?, 'market', NULL, ?, ?, ?, ?, ?, ?, ?)
+        ''', (username, stock_code, side, quantity, 'filled' if success else 'rejected',
+              self._fill_price(cursor, result), message, client_order_id, now, now))
+
+    def _settle_order(self, cursor, order_id, result):
+        """把未成交的挂单按成交结果改为已成交/已拒绝（与成交在同一事务中），订单已不是未成交时返回False"""
+        success, message = result
+        cursor.execute('''
+            UPDATE orders SET status=?, fill_price=?, message=?, updated_at=?
+            WHERE id=? AND status='open'
+        ''', ('filled' if success else 'rejected', self._fill_price(cursor, result), message,
+              datetime.now().strftime("%Y-%m-%d %H:%M:%S"), order_id))
+        return cursor.rowcount > 0
+
+    @staticmethod
+    def _fill_price(cursor, result):
+        """刚写入的成交记录的价格，未成交时为None"""
+        if not result[0]:
+            return None
+        cursor.execute("SELECT price FROM transactions WHERE id=last_insert_rowid()")
+        return cursor.fetchone()["price"]
+
+    def _apply_trade(self, cursor, username, transaction_type, stock_code, quantity, price=None):
+        """
+        在当前事务中执行一笔交易（不提交）。
+        余额和持仓用带条件的增量UPDATE修改（如 balance>=金额 才扣款），
+        不依赖先读出的旧值，其它连接的并发交易不会被覆盖；条件不满足时不修改任何数据。
+        """
+        # 负数量会让带条件的UPDATE恒成立（扣款变成加款），必须在修改前拒绝
+        if transaction_type not in ("buy", "sell"):
+            return False, "交易类型无效"
+        if not quantity or quantity <= 0:
+            return False, "交易数量必须大于0"
+
+        cursor.execute("SELECT 1 FROM users WHERE username=?", (username,))
+        if not cursor.fetchone():
             return False, "用户不存在"
-        
+
+        cursor.execute("SELECT name, price FROM stocks WHERE code=?", (stock_code,))
+        stock = cursor.fetchone()
         if not stock:
             return False, "股票不存在"
-            
-        price = stock["price"]
+
+        if price is None:
+            price = stock["price"]
+        if not price or price <= 0:
+            return False, "成交价格无效"
         amount = price * quantity
-        holdings = self.get_holdings(username)
-        
+
         if transaction_type == "buy":
-            if user["balance"] < amount:
+            cursor.execute("UPDATE users SET balance=balance-? WHERE username=? AND balance>=?",
+                           (amount, username, amount))
+            if cursor.rowcount == 0:
                 return False, "余额不足"
-                
-            # 更新用户余额
-            user_balance = user["balance"] - amount
-            self.update_user(username, {"balance": user_balance})
-            
-            # 更新持仓
-            if stock_code in holdings:
-                old_quantity = holdings[stock_code]["quantity"]
-                old_cost = holdings[stock_code]["cost"]
-            else:
-                old_quantity = 0
-                old_cost = 0
-                
-            new_quantity = old_quantity + quantity
-            new_cost = (old_cost * old_quantity + amount) / new_quantity if new_quantity > 0 else 0
-            
-            # 更新或添加持仓
-            self.update_holding(username, stock_code, new_quantity, new_cost, stock["name"])
-            
-        elif transaction_type == "sell":
-            if stock_code not in holdings or holdings[stock_code]["quantity"] < quantity:
-                return False, "持仓不足"
-                
-            # 更新用户余额
-            user_balance = user["balance"] + amount
-            self.update_user(username, {"balance": user_balance})
-            
-            # 更新持仓
-            new_quantity = holdings[stock_code]["quantity"] - quantity
-            new_cost = holdings[stock_code]["cost"]  # 卖出不改变成本价
-            
-            # 如果持仓为0，删除该股票持仓
-            if new_quantity <= 0:
-                self.delete_holding(username, stock_code)
-            else:
-                self.update_holding(username, stock_code, new_quantity, new_cost, stock["name"])
+            # 加仓时按加权平均重新计算成本价
+            cursor.execute('''
+                INSERT INTO holdings (username, stock_code, quantity, cost, name)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(username, stock_code) DO UPDATE SET
+                    quantity=holdings.quantity+excluded.quantity,
+                    cost=(holdings.cost*holdings.quantity+excluded.cost*excluded.quantity)/(holdings.quantity+excluded.quantity),
+                    name=excluded.name
+            ''', (username, stock_code, quantity, price, stock["name"]))
         else:
-            return False, "交易类型无效"
-            
+            cursor.execute("UPDATE holdings SET quantity=quantity-? WHERE username=? AND stock_code=? AND quantity>=?",
+                           (quantity, username, stock_code, quantity))
+            if cursor.rowcount == 0:
+                return False, "持仓不足"
+            # 卖出不改变成本价，数量为0时删除
+            cursor.execute("DELETE FROM holdings WHERE username=? AND stock_code=? AND quantity<=0",
+                           (username, stock_code))
+            cursor.execute("UPDATE users SET balance=balance+? WHERE username=?", (amount, username))
+
         # 记录交易
-        self.record_transaction(username, transaction_type, stock_code, stock["name"], price, quantity, amount)
+        cursor.execute('''
+            INSERT INTO transactions (username, type, stock_code, stock_name, price, quantity, amount, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (username, transaction_type, stock_code, stock["name"], price, quantity, amount,
+              datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
         return True, "交易成功"
 
-# 创建数据库实例
-db = Database() 
+_db_lock = threading.Lock()
+
+
+def __getattr__(name):
+    """
+    默认数据库实例 db 在第一次使用（from .database import db）时才创建，
+    只用 Database 类的工具（如压力测试）不会在当前目录下创建 data/stock_simulator.db
+    """
+    global db
+    if name == "db":
+        with _db_lock:
+            if "db" not in globals():
+                # 创建数据库实例
+                db = Database()
+        return db
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,275 @@
+import os
+import re
+import threading
+import numpy as np
+import pandas as pd
+from .bar_store import bar_store
+from .indicators import indicator_registry
+
+# 因子表的因子列（名称均为指标注册表中的中间量）
+FACTOR_NAMES = ['returns', 'return_3d', 'return_5d', 'ma5', 'ma20',
+                'rsi14', 'volume_ratio', 'volatility10']
+
+# 查询时可用的别名
+FACTOR_ALIASES = {
+    'rsi': 'rsi14',
+    'return_1d': 'returns',
+    'ret1': 'returns',
+    'ret3': 'return_3d',
+    'ret5': 'return_5d',
+    'vol_ratio': 'volume_ratio',
+    'volatility': 'volatility10',
+    'price': 'close',
+    '收盘价': 'close',
+    '成交量': 'volume',
+    '涨跌幅': 'returns',
+    '3日涨幅': 'return_3d',
+    '5日涨幅': 'return_5d',
+    '量比': 'volume_ratio',
+    '波动率': 'volatility10',
+}
+
+FACTOR_TABLE_PATH = os.path.join("data", "factor_table.npz")
+
+
+class QueryError(Exception):
+    """选股条件语法错误"""
+
+
+class _QueryParser:
+    """
+    选股条件解析器，支持:
+        比较  rsi14 < 30, return_5d >= 3%, volume_ratio != 1
+        逻辑  and / or / not (也可写作 & | !)，支持括号
+    结果直接在列数组上计算成布尔掩码
+    """
+
+    TOKEN_RE = re.compile(r"\s*(?:(?P<name>(?:\d+(?=[一-鿿]))?[A-Za-z_一-鿿][\w一-鿿]*)"
+                          r"|(?P<num>-?\d+(?:\.\d+)?%?)|(?P<op><=|>=|==|!=|<|>|=)"
+                          r"|(?P<paren>[()])|(?P<logic>&&|\|\||[&|!]))")
+
+    def __init__(self, expr, columns):
+        self.columns = columns
+        self.tokens = self._tokenize(expr)
+        self.pos = 0
+
+    def _tokenize(self, expr):
+        tokens = []
+        pos = 0
+        expr = expr.strip()
+        while pos < len(expr):
+            match = self.TOKEN_RE.match(expr, pos)
+            if not match or match.end() == pos:
+                raise QueryError(f"无法识别的内容: {expr[pos:]}")
+            kind = match.lastgroup
+            value = match.group(kind)
+            if kind == 'name' and value.lower() in ('and', 'or', 'not'):
+                kind, value = 'logic', value.lower()
+            elif kind == 'logic':
+                value = {'&': 'and', '&&': 'and', '|': 'or', '||': 'or', '!': 'not'}[value]
+            tokens.append((kind, value))
+            pos = match.end()
+        return tokens
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _next(self):
+        token = self._peek()
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            raise QueryError("条件为空")
+        mask = self._or()
+        if self.pos != len(self.tokens):
+            raise QueryError(f"多余的内容: {self._peek()[1]}")
+        return mask
+
+    def _or(self):
+        mask = self._and()
+        while self._peek() == ('logic', 'or'):
+            self._next()
+            mask = mask | self._and()
+        return mask
+
+    def _and(self):
+        mask = self._not()
+        while self._peek() == ('logic', 'and'):
+            self._next()
+            mask = mask & self._not()
+        return mask
+
+    def _not(self):
+        if self._peek() == ('logic', 'not'):
+            self._next()
+            return ~self._not()
+        if self._peek() == ('paren', '('):
+            self._next()
+            mask = self._or()
+            if self._next() != ('paren', ')'):
+                raise QueryError("括号不匹配")
+            return mask
+        return self._comparison()
+
+    def _operand(self):
+        kind, value = self._next()
+        if kind == 'num':
+            return float(value[:-1]) / 100 if value.endswith('%') else float(value)
+        if kind == 'name':
+            column = FACTOR_ALIASES.get(value, FACTOR_ALIASES.get(value.lower(), value))
+            if column not in self.columns:
+                raise QueryError(f"未知的因子: {value}")
+            return self.columns[column]
+        raise QueryError(f"此处应为因子名或数值: {value}")
+
+    def _comparison(self):
+        left = self._operand()
+        kind, op = self._next()
+        if kind != 'op':
+            raise QueryError(f"此处应为比较运算符: {op}")
+        right = self._operand()
+        with np.errstate(invalid='ignore'):
+            if op == '<':
+                return left < right
+            if op == '<=':
+                return left <= right
+            if op == '>':
+                return left > right
+            if op == '>=':
+                return left >= right
+            if op in ('==', '='):
+                return left == right
+            return left != right
+
+
+class FactorTable:
+    """
+    因子表：由本地缓存的日K线生成，每只股票每个交易日一行，按列保存为NumPy数组。
+    查询在整张表上以向量化布尔掩码完成。
+    """
+
+    def __init__(self, codes=None, columns=None):
+        self.codes = np.asarray(codes if codes is not None else [], dtype=object)
+        # 列: code_idx, date, is_latest, close, volume, 以及 FACTOR_NAMES
+        self.columns = columns or {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.columns.get('date', ()))
+
+    @classmethod
+    def from_panel(cls, dates, codes, panel):
+        """由 日期×股票 的行情面板生成因子表"""
+        if len(dates) == 0 or len(codes) == 0:
+            return cls(codes, {})
+        close = pd.DataFrame(panel['close'])
+        volume = pd.DataFrame(panel['volume'])
+        factors = indicator_registry.evaluate({'close': close, 'volume': volume}, FACTOR_NAMES)
+
+        valid = ~np.isnan(panel['close'])
+        # 按股票展开（转置后行优先），同一股票的记录按日期连续存放
+        valid_t = valid.T
+        n_dates = len(dates)
+        code_idx = np.repeat(np.arange(len(codes), dtype=np.int32), n_dates)[valid_t.ravel()]
+        date_col = np.tile(np.asarray(dates, dtype='datetime64[D]'), len(codes))[valid_t.ravel()]
+
+        # 每只股票最后一个有效交易日
+        last_row = np.where(valid.any(axis=0), n_dates - 1 - np.argmax(valid[::-1], axis=0), -1)
+        is_latest = np.zeros_like(valid)
+        has_data = last_row >= 0
+        is_latest[last_row[has_data], np.nonzero(has_data)[0]] = True
+
+        columns = {
+            'code_idx': code_idx,
+            'date': date_col,
+            'is_latest': is_latest.T[valid_t],
+            'close': panel['close'].T[valid_t].astype(np.float32),
+            'volume': panel['volume'].T[valid_t].astype(np.float32),
+        }
+        for name in FACTOR_NAMES:
+            columns[name] = np.asarray(factors[name].values, dtype=np.float32).T[valid_t]
+        return cls(codes, columns)
+
+    def materialize(self, codes=None, days=180):
+        """从本地K线缓存重新生成因子表"""
+        start_date = (pd.Timestamp.now() - pd.Timedelta(days=days)).strftime("%Y-%m-%d")
+        dates, codes, panel = bar_store.load_panel(codes, start_date=start_date)
+        table = FactorTable.from_panel(dates, codes, panel)
+        with self._lock:
+            self.codes, self.columns = table.codes, table.columns
+        print(f"因子表: 已生成 {len(self)} 行 ({len(self.codes)} 只股票 × {len(dates)} 个交易日)")
+        return self
+
+    def save(self, path=FACTOR_TABLE_PATH):
+        with self._lock:
+            np.savez(path, codes=self.codes.astype(str), **self.columns)
+
+    def load(self, path=FACTOR_TABLE_PATH):
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                columns = {key: data[key] for key in data.files if key != 'codes'}
+                codes = data['codes'].astype(object)
+        except Exception as e:
+            print(f"因子表: 加载 {path} 失败: {e}")
+            return False
+        with self._lock:
+            self.codes, self.columns = codes, columns
+        return True
+
+    def mask(self, expr, latest=True, date=None):
+        """把选股条件计算成行掩码；默认只在每只股票的最新交易日上筛选"""
+        with self._lock:
+            columns = self.columns
+        return self._mask(columns, expr, latest, date)
+
+    @staticmethod
+    def _mask(columns, expr, latest, date):
+        if not columns:
+            return np.zeros(0, dtype=bool)
+        mask = _QueryParser(expr, columns).parse() if expr and expr.strip() else np.ones(len(columns['date']), dtype=bool)
+        if date is not None:
+            mask &= columns['date'] == np.datetime64(date, 'D')
+        elif latest:
+            mask &= columns['is_latest']
+        return mask
+
+    def query(self, expr, sort_by=None, ascending=False, limit=None, latest=True, date=None):
+        """
+        执行选股查询
+        :param expr: 条件，如 "rsi14<30 and volume_ratio>1.5 and return_5d>3%"
+        :param sort_by: 排序因子
+        :param limit: 最多返回的行数
+        :return: DataFrame，包含 code, date 及全部因子列
+        """
+        with self._lock:
+            columns, codes = self.columns, self.codes
+        if not columns:
+            return pd.DataFrame(columns=['code', 'date', 'close', 'volume'] + FACTOR_NAMES)
+        mask = self._mask(columns, expr, latest, date)
+        rows = np.nonzero(mask)[0]
+
+        if sort_by:
+            key_name = FACTOR_ALIASES.get(sort_by, sort_by)
+            if key_name not in columns:
+                raise QueryError(f"未知的排序因子: {sort_by}")
+            key = columns[key_name][rows].astype(np.float64)
+            key = np.where(np.isnan(key), np.inf if ascending else -np.inf, key)
+            order = np.argsort(key if ascending else -key, kind='stable')
+            rows = rows[order]
+        if limit is not None:
+            rows = rows[:limit]
+
+        result = {'code': codes[columns['code_idx'][rows]] if len(codes) else np.array([], dtype=object),
+                  'date': columns['date'][rows]}
+        for name in ['close', 'volume'] + FACTOR_NAMES:
+            result[name] = columns[name][rows]
+        return pd.DataFrame(result)
+
+
+# 创建因子表实例（启动时加载上次生成的结果）
+factor_table = FactorTable()
+factor_table.load()
@@ -0,0 +1,107 @@
+import tkinter as tk
+import ttkbootstrap as tb
+from matplotlib.figure import Figure
+from .database import db
+from .chart import OffscreenCanvas, MarketHeatmap
+
+# 检查最新行情的间隔（毫秒）
+SNAPSHOT_INTERVAL_MS = 5000
+
+# 按代码前缀划分板块：(交易所前缀, 代码前缀元组, 板块名)，按顺序匹配
+BOARD_RULES = [
+    ("sh.", ("688", "689"), "科创板"),
+    ("sh.", ("60",), "沪市主板"),
+    ("sh.", ("000",), "上证指数"),
+    ("sz.", ("300", "301"), "创业板"),
+    ("sz.", ("000", "001", "002", "003"), "深市主板"),
+    ("sz.", ("399",), "深证指数"),
+    ("bj.", ("",), "北交所"),
+]
+BOARD_ORDER = [rule[2] for rule in BOARD_RULES] + ["其他"]
+
+
+def board_of(code):
+    """根据 sh./sz. 代码前缀判断所属板块"""
+    for exchange, prefixes, board in BOARD_RULES:
+        if code.startswith(exchange) and code[len(exchange):].startswith(prefixes):
+            return board
+    return "其他"
+
+
+class HeatmapFrame(tb.Frame):
+    """市场热力图页面：全市场股票按板块分组、按涨跌幅着色"""
+
+    def __init__(self, parent, username):
+        super().__init__(parent, bootstyle="dark")
+        self.username = username
+        self.codes = []        # 按板块排好序的股票代码（与热力图方格顺序一致）
+        self.stocks = {}
+        self._snapshot = None  # 上次显示的 {代码: 涨跌幅}
+
+        # 创建标题
+        self.title_label = tb.Label(self, text="市场热力图", font=("微软雅黑", 16, "bold"),
+                                    bootstyle="inverse-dark")
+        self.title_label.pack(pady=10, padx=10, anchor="w")
+
+        self.top_frame = tb.Frame(self, bootstyle="dark")
+        self.top_frame.pack(fill=tk.X, padx=10, pady=5)
+        self.refresh_btn = tb.Button(self.top_frame, text="刷新", command=lambda: self.load_snapshot(relayout=True),
+                                     bootstyle="outline-info")
+        self.refresh_btn.pack(side=tk.LEFT)
+        self.legend_label = tb.Label(self.top_frame, bootstyle="inverse-dark")
+        self.legend_label.pack(side=tk.LEFT, padx=15)
+        self.hover_var = tk.StringVar(value="将鼠标移到方格上查看股票")
+        tb.Label(self.top_frame, textvariable=self.hover_var, bootstyle="inverse-dark").pack(side=tk.RIGHT)
+
+        self.chart_frame = tb.Frame(self, bootstyle="dark")
+        self.chart_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.fig = Figure(figsize=(8, 5), dpi=100)
+        self.canvas = OffscreenCanvas(self.fig, master=self.chart_frame)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        with self.canvas.render_lock:
+            self.heatmap = MarketHeatmap(self.fig, self.canvas)
+        self.legend_label.config(text=f"颜色范围: -{self.heatmap.limit:.0f}%(绿) ~ +{self.heatmap.limit:.0f}%(红)")
+        self.canvas.mpl_connect('motion_notify_event', self.on_mouse_motion)
+
+        self.load_snapshot(relayout=True)
+        self.after(SNAPSHOT_INTERVAL_MS, self.poll_snapshot)
+
+    def load_snapshot(self, relayout=False):
+        """读取全部股票的最新行情；股票集合变化时重新排版，否则只更新颜色"""
+        stocks = db.get_stocks()
+        self.stocks = stocks
+        snapshot = {code: info.get("change") for code, info in stocks.items()}
+        if snapshot == self._snapshot and not relayout:
+            return
+        self._snapshot = snapshot
+
+        if relayout or sorted(stocks) != sorted(self.codes):
+            rank = {board: i for i, board in enumerate(BOARD_ORDER)}
+            codes = sorted(stocks, key=lambda code: (rank[board_of(code)], code))
+            names = [stocks[code].get("name", code) for code in codes]
+            groups = [board_of(code) for code in codes]
+            self.codes = codes
+            self.canvas.submit(lambda: self.heatmap.set_universe(codes, names, groups, BOARD_ORDER), key="universe")
+            if not codes:
+                self.canvas.submit(lambda: self.heatmap.show_message("暂无行情数据"), key="message")
+
+        self.canvas.submit(lambda: self.heatmap.set_changes(snapshot), key="changes")
+
+    def poll_snapshot(self):
+        """定时检查行情变化（页面不可见时跳过）"""
+        try:
+            if self.winfo_ismapped():
+                self.load_snapshot()
+        finally:
+            self.after(SNAPSHOT_INTERVAL_MS, self.poll_snapshot)
+
+    def on_mouse_motion(self, event):
+        """鼠标所在方格的股票信息显示在右上角"""
+        index = self.heatmap.index_at(event.xdata, event.ydata) if event.inaxes else None
+        if index is None or index >= len(self.codes):
+            return
+        code = self.codes[index]
+        info = self.stocks.get(code, {})
+        change = info.get("change") or 0
+        self.hover_var.set(f"{info.get('name', code)} ({code})  {info.get('price', 0):.2f}  "
+                           f"{change:+.2f}%  [{board_of(code)}]")
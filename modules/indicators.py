@@ -0,0 +1,279 @@
+import numpy as np
+import pandas as pd
+
+
+class IndicatorError(Exception):
+    """指标注册或依赖解析错误"""
+
+
+class Indicator:
+    """单个指标节点：声明输入，计算函数签名为 func(ctx, params)"""
+
+    def __init__(self, name, inputs, func, kind, min_length=0):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.func = func
+        self.kind = kind  # "intermediate" 中间量 或 "signal" 信号
+        self.min_length = min_length
+
+
+class IndicatorRegistry:
+    """
+    可插拔的指标注册表。
+    每个指标声明自己依赖的输入，计算时按依赖关系拓扑排序，
+    收益率、滚动窗口等中间量对每只股票只计算一次，供所有信号共享。
+    """
+
+    # 由行情数据直接提供的基础输入
+    BASE_INPUTS = ('close', 'volume')
+
+    def __init__(self):
+        self._indicators = {}
+        self._order_cache = {}
+
+    def register(self, name, inputs=(), kind="intermediate", min_length=0):
+        """注册指标的装饰器"""
+        def decorator(func):
+            self.add(name, func, inputs, kind, min_length)
+            return func
+        return decorator
+
+    def add(self, name, func, inputs=(), kind="intermediate", min_length=0):
+        """注册（或替换）一个指标"""
+        if name in self.BASE_INPUTS:
+            raise IndicatorError(f"指标名 {name} 与基础输入重名")
+        self._indicators[name] = Indicator(name, inputs, func, kind, min_length)
+        self._order_cache.clear()
+
+    def intermediate(self, name, inputs=()):
+        return self.register(name, inputs, kind="intermediate")
+
+    def signal(self, name, inputs=(), min_length=0):
+        return self.register(name, inputs, kind="signal", min_length=min_length)
+
+    def remove(self, name):
+        self._indicators.pop(name, None)
+        self._order_cache.clear()
+
+    def copy(self):
+        """复制注册表，在副本上增删指标不影响原注册表"""
+        registry = IndicatorRegistry()
+        registry._indicators = dict(self._indicators)
+        return registry
+
+    def signals(self):
+        """返回所有已注册信号的名称"""
+        return [name for name, ind in self._indicators.items() if ind.kind == "signal"]
+
+    def resolve(self, targets):
+        """计算目标指标所需的拓扑顺序（只包含用到的节点）"""
+        key = tuple(targets)
+        if key in self._order_cache:
+            return self._order_cache[key]
+
+        order = []
+        state = {}  # name -> 1 访问中, 2 已完成
+
+        def visit(name, path):
+            if name in self.BASE_INPUTS or state.get(name) == 2:
+                return
+            if state.get(name) == 1:
+                raise IndicatorError(f"指标依赖存在环: {' -> '.join(path + [name])}")
+            if name not in self._indicators:
+                raise IndicatorError(f"未注册的指标: {name}")
+            state[name] = 1
+            for dep in self._indicators[name].inputs:
+                visit(dep, path + [name])
+            state[name] = 2
+            order.append(name)
+
+        for target in targets:
+            visit(target, [])
+        self._order_cache[key] = order
+        return order
+
+    def evaluate(self, ctx, names, params=None):
+        """
+        计算中间量的完整序列（不取最后一个值）。
+        基础输入既可以是单只股票的Series，也可以是 日期×股票 的DataFrame，
+        后者可一次算出全市场的因子面板。
+        :return: {名称: 计算结果}
+        """
+        ctx = dict(ctx)
+        params = params or {}
+        for name in self.resolve(names):
+            ctx[name] = self._indicators[name].func(ctx, params)
+        return {name: ctx[name] for name in names}
+
+    def compute(self, df, targets=None, params=None):
+        """
+        对一只股票的行情计算目标信号
+        :param df: 至少包含 close 列的DataFrame（volume列可选）
+        :param targets: 需要的信号名列表，默认为全部信号
+        :param params: 传给各指标的阈值参数
+        :return: {信号名: 信号值}，数据不足或计算失败的信号为0
+        """
+        targets = list(targets) if targets is not None else self.signals()
+        params = params or {}
+        ctx = {col: df[col] for col in self.BASE_INPUTS if col in df.columns}
+        length = len(df)
+        failed = set()
+
+        for name in self.resolve(targets):
+            ind = self._indicators[name]
+            if length < ind.min_length or any(dep not in ctx for dep in ind.inputs):
+                failed.add(name)
+                continue
+            try:
+                ctx[name] = ind.func(ctx, params)
+            except Exception as e:
+                print(f"计算指标 {name} 时出错: {e}")
+                failed.add(name)
+
+        results = {}
+        for name in targets:
+            value = ctx.get(name) if name not in failed else None
+            results[name] = 0 if value is None or pd.isna(value) else value
+        return results
+
+
+# 默认注册表及内置指标
+indicator_registry = IndicatorRegistry()
+
+
+@indicator_registry.intermediate('returns', inputs=('close',))
+def _returns(ctx, params):
+    return ctx['close'].pct_change()
+
+
+@indicator_registry.intermediate('delta', inputs=('close',))
+def _delta(ctx, params):
+    return ctx['close'].diff()
+
+
+@indicator_registry.intermediate('ma5', inputs=('close',))
+def _ma5(ctx, params):
+    return ctx['close'].rolling(window=5).mean()
+
+
+@indicator_registry.intermediate('ma20', inputs=('close',))
+def _ma20(ctx, params):
+    return ctx['close'].rolling(window=20).mean()
+
+
+@indicator_registry.intermediate('volume_ma10', inputs=('volume',))
+def _volume_ma10(ctx, params):
+    return ctx['volume'].rolling(window=10).mean()
+
+
+@indicator_registry.intermediate('return_3d', inputs=('close',))
+def _return_3d(ctx, params):
+    return ctx['close'].pct_change(3)
+
+
+@indicator_registry.intermediate('return_5d', inputs=('close',))
+def _return_5d(ctx, params):
+    return ctx['close'].pct_change(5)
+
+
+@indicator_registry.intermediate('volume_ratio', inputs=('volume', 'volume_ma10'))
+def _volume_ratio(ctx, params):
+    volume_ma = ctx['volume_ma10']
+    return ctx['volume'] / volume_ma.where(volume_ma != 0)
+
+
+@indicator_registry.intermediate('rsi14', inputs=('delta',))
+def _rsi14(ctx, params):
+    delta = ctx['delta']
+    gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+    rs = gain / loss
+    return 100 - (100 / (1 + rs))
+
+
+@indicator_registry.intermediate('volatility10', inputs=('returns',))
+def _volatility10(ctx, params):
+    return ctx['returns'].rolling(window=10).std()
+
+
+@indicator_registry.signal('ma_signal', inputs=('close', 'ma5', 'ma20'), min_length=20)
+def _ma_signal(ctx, params):
+    """移动平均线信号"""
+    current_price = ctx['close'].iloc[-1]
+    ma5_current = ctx['ma5'].iloc[-1]
+    ma20_current = ctx['ma20'].iloc[-1]
+
+    if current_price > ma5_current > ma20_current:
+        return 0.8  # 强烈看涨
+    elif current_price > ma5_current:
+        return 0.6  # 看涨
+    elif current_price < ma5_current < ma20_current:
+        return -0.8  # 强烈看跌
+    elif current_price < ma5_current:
+        return -0.6  # 看跌
+    else:
+        return 0  # 中性
+
+
+@indicator_registry.signal('rsi_signal', inputs=('rsi14',), min_length=15)
+def _rsi_signal(ctx, params):
+    """RSI信号"""
+    current_rsi = ctx['rsi14'].iloc[-1]
+    if pd.isna(current_rsi):
+        return 0
+
+    if current_rsi < params.get('rsi_oversold', 30):
+        return 0.7  # 超卖，看涨
+    elif current_rsi > params.get('rsi_overbought', 70):
+        return -0.7  # 超买，看跌
+    elif current_rsi < 50:
+        return 0.3  # 偏看涨
+    else:
+        return -0.3  # 偏看跌
+
+
+@indicator_registry.signal('volume_signal', inputs=('volume_ratio', 'returns'), min_length=10)
+def _volume_signal(ctx, params):
+    """成交量信号（结合当日涨跌判断量价关系）"""
+    volume_ratio = ctx['volume_ratio'].iloc[-1]
+    if pd.isna(volume_ratio):
+        return 0
+
+    price_change = ctx['returns'].iloc[-1]
+    ratio_high = params.get('volume_ratio_high', 1.5)
+
+    if volume_ratio > ratio_high and price_change > 0:
+        return 0.6  # 放量上涨
+    elif volume_ratio > ratio_high and price_change < 0:
+        return -0.6  # 放量下跌
+    elif volume_ratio < params.get('volume_ratio_low', 0.8):
+        return -0.2  # 缩量，较弱信号
+    else:
+        return 0
+
+
+@indicator_registry.signal('price_momentum', inputs=('return_3d', 'return_5d'), min_length=5)
+def _price_momentum(ctx, params):
+    """价格动量信号（3日和5日收益率加权）"""
+    return_3d = ctx['return_3d'].iloc[-1]
+    return_5d = ctx['return_5d'].iloc[-1]
+    if pd.isna(return_3d) or pd.isna(return_5d):
+        return 0
+
+    momentum_score = (return_3d * 0.6 + return_5d * 0.4) * 10
+    return np.clip(momentum_score, -1, 1)
+
+
+@indicator_registry.signal('volatility_signal', inputs=('volatility10',), min_length=10)
+def _volatility_signal(ctx, params):
+    """波动率信号：波动率过高给予负分，适中给予正分"""
+    current_volatility = ctx['volatility10'].iloc[-1]
+    if pd.isna(current_volatility):
+        return 0
+
+    if current_volatility > params.get('volatility_high', 0.05):
+        return -0.4
+    elif current_volatility < params.get('volatility_low', 0.02):
+        return 0.2
+    else:
+        return 0.1
@@ -0,0 +1,154 @@
+from .database import db
+
+# 每重放多少个事件写一个快照
+SNAPSHOT_INTERVAL = 100
+
+
+class Ledger:
+    """
+    事件溯源账本。
+    transactions 表是只追加的事件日志（buy/sell 成交和 deposit 资金调整），
+    ledger_snapshots 表每隔 interval 个事件保存一次余额和持仓。
+    任意时刻的账户 = 不晚于该时刻的最新快照 + 其后事件的重放，最多重放 interval 个事件；
+    同一用户的事件号顺序即时间顺序（append 拒绝早于已有事件的补录），时点按事件号截取；
+    当前账户直接读 users/holdings 表（与事件在同一事务中更新的物化视图）。
+    快照在重放时顺带写入，也可以用 checkpoint() 主动生成。
+    """
+
+    def __init__(self, interval=SNAPSHOT_INTERVAL):
+        self.interval = interval
+
+    @staticmethod
+    def apply(state, event):
+        """
+        把一个事件应用到账户状态上（口径与 Database._apply_trade 一致）
+        :param state: {"balance": 余额, "holdings": {代码: [数量, 成本价, 名称]}}，原地修改
+        """
+        holdings = state["holdings"]
+        if event["type"] == "buy":
+            state["balance"] -= event["amount"]
+            quantity, cost, _ = holdings.get(event["stock_code"], [0, 0.0, None])
+            new_quantity = quantity + event["quantity"]
+            if new_quantity == 0:
+                holdings.pop(event["stock_code"], None)
+                return
+            if new_quantity > 0:
+                cost = (cost * quantity + event["amount"]) / new_quantity
+            # 数量不为正（数据异常，如负数量的事件）时保留原成本价，由 verify 报告
+            holdings[event["stock_code"]] = [new_quantity, cost, event["stock_name"]]
+        elif event["type"] == "sell":
+            state["balance"] += event["amount"]
+            holding = holdings.get(event["stock_code"])
+            quantity = (holding[0] if holding else 0) - event["quantity"]
+            if quantity > 0:
+                holding[0] = quantity
+            else:
+                holdings.pop(event["stock_code"], None)
+        elif event["type"] == "deposit":
+            state["balance"] += event["amount"]
+
+    def replay(self, username, until_id=None, until_time=None, save_snapshots=True):
+        """
+        从不晚于目标的最新快照开始重放事件
+        :param until_id: 重放到该事件号为止（含），默认重放到最后
+        :param until_time: 只重放不晚于该时间（"YYYY-MM-DD HH:MM:SS"）的事件
+        :param save_snapshots: 重放过程中每满 interval 个事件写一个快照
+        :return: {"event_id": 最后应用的事件号, "balance": 余额, "holdings": {代码: [数量, 成本价, 名称]}}
+        """
+        if until_time is not None:
+            last_id = db.get_last_event_id(username, until_time)
+            until_id = last_id if until_id is None else min(until_id, last_id)
+        snapshot = db.get_ledger_snapshot(username, max_event_id=until_id)
+        if snapshot is None:
+            snapshot = {"event_id": 0, "balance": 0.0, "holdings": {}}
+        state = {"balance": snapshot["balance"], "holdings": snapshot["holdings"]}
+        event_id = snapshot["event_id"]
+
+        new_snapshots = []
+        for i, event in enumerate(db.get_ledger_events(username, after_id=event_id, until_id=until_id), 1):
+            self.apply(state, event)
+            event_id = event["id"]
+            if save_snapshots and i % self.interval == 0:
+                new_snapshots.append((username, event_id, state["balance"],
+                                      {code: list(h) for code, h in state["holdings"].items()}))
+        if new_snapshots:
+            db.add_ledger_snapshots(new_snapshots)
+        return {"event_id": event_id, "balance": state["balance"], "holdings": state["holdings"]}
+
+    def state_at(self, username, timestamp):
+        """某一时刻（"YYYY-MM-DD HH:MM:SS" 或 "YYYY-MM-DD"，按当天收盘后计）的余额和持仓"""
+        if len(timestamp) == 10:
+            timestamp += " 23:59:59"
+        return self.replay(username, until_time=timestamp)
+
+    def current_state(self, username):
+        """当前余额和持仓：直接读物化的 users/holdings 表，不重放"""
+        user = db.get_user(username)
+        if not user:
+            return None
+        holdings = {code: [h["quantity"], h["cost"], h["name"]] for code, h in user.get("holdings", {}).items()}
+        return {"balance": user["balance"], "holdings": holdings}
+
+    def checkpoint(self, username=None):
+        """为一个（或全部）用户在最新事件处生成快照，之后读取当前状态的重放量为0"""
+        usernames = [username] if username else list(db.get_users().keys())
+        snapshots = []
+        for name in usernames:
+            state = self.replay(name)
+            if state["event_id"]:
+                snapshots.append((name, state["event_id"], state["balance"], state["holdings"]))
+        if snapshots:
+            db.add_ledger_snapshots(snapshots)
+        return len(snapshots)
+
+    def verify(self, username, tolerance=1e-6):
+        """
+        用账本重放的结果核对 users/holdings 表
+        :return: 不一致项的描述列表（为空表示一致）
+        """
+        replayed = self.replay(username)
+        current = self.current_state(username)
+        if current is None:
+            return ["用户不存在"]
+        problems = []
+        if abs(replayed["balance"] - current["balance"]) > tolerance * max(1.0, abs(replayed["balance"])):
+            problems.append(f"余额 {current['balance']:.2f} != 账本 {replayed['balance']:.2f}")
+        for code in set(replayed["holdings"]) | set(current["holdings"]):
+            expected = replayed["holdings"].get(code, [0])[0]
+            actual = current["holdings"].get(code, [0])[0]
+            if expected != actual:
+                problems.append(f"{code} 持仓 {actual} != 账本 {expected}")
+            if expected < 0 or actual < 0:
+                problems.append(f"{code} 持仓为负: 持仓表 {actual}，账本 {expected}")
+        return problems
+
+    def _replay_in_transaction(self, username):
+        # 在重建的写事务中重放：不写快照（写快照会提前提交事务）
+        return self.replay(username, save_snapshots=False)
+
+    def rebuild(self, username):
+        """以账本为准重建用户的余额和持仓表（重放与覆盖在同一个写事务中，不会丢失并发成交）"""
+        states = {}
+
+        def replay(name):
+            states[name] = self._replay_in_transaction(name)
+            return states[name]
+
+        db.rebuild_accounts([username], replay)
+        return states.get(username)
+
+    def append(self, events):
+        """
+        批量追加事件（如导入成交），写入和重建涉及用户的余额、持仓在同一个写事务中完成。
+        时点查询按事件号截取，事件时间不能早于该用户已有的最新事件，否则整批拒绝
+        :param events: [dict]，字段同 transactions 表：username, type, stock_code, stock_name, price, quantity, amount, timestamp
+        :return: (是否成功, 提示信息)
+        """
+        if not events:
+            return False, "没有要追加的事件"
+        usernames = sorted({event["username"] for event in events})
+        return db.rebuild_accounts(usernames, self._replay_in_transaction, events)
+
+
+# 创建账本实例
+ledger = Ledger()
@@ -1,19 +1,22 @@
 import tkinter as tk
 from tkinter import messagebox
 import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import pandas as pd
 import threading
 import time
 from datetime import datetime, timedelta
 from .stock_data import stock_manager
+from .bar_store import bar_store
 from .database import db
+from .virtual_list import VirtualList
+from .chart import PriceChart, OffscreenCanvas
+from .ui_dispatcher import ui_dispatcher
 import ttkbootstrap as tb
 from ttkbootstrap import Style  # 显式导入Style
-import mplfinance as mpf
-from matplotlib.figure import Figure
-import matplotlib.dates as mdates
-import numpy as np
+
+# 日K线默认加载的历史天数，以及初始显示的K线根数
+DAILY_HISTORY_DAYS = 365
+DAILY_VIEW_BARS = 120
 
 # 定义全局颜色变量
 BACKGROUND_COLOR = "#0d1926"  # 深蓝色背景
@@ -35,9 +38,11 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
         self.current_stock_code = None # 用于存储当前选中的股票代码
         self.current_stock_name = None # 用于存储当前选中的股票名称
         self.current_chart_period = "daily" #新增：追踪当前图表周期，默认为日线
-        self.current_chart_df = None # 新增：用于存储当前图表的数据
-        self.hover_info_label = None
-        self.last_hover_index = None
+        self.history_loading = False  # 是否正在后台加载更早的历史数据
+        self.chart_request = 0  # 最近一次图表取数请求的序号，旧请求的结果丢弃
+        self.chart_loaded = None  # 图表当前已加载的 (股票代码, 周期)，刷新时只并入最新K线
+        self.history_exhausted = False  # 更早的历史数据已经取完
+        self.refreshing = False  # 是否有刷新/同步正在后台进行
         
         # 不使用background属性，使用bootstyle
         # self.configure(background=BACKGROUND_COLOR)
@@ -122,23 +127,11 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
         self.refresh_indicator = tb.Label(self.status_frame, text="○", bootstyle="danger")
         self.refresh_indicator.pack(side=tk.RIGHT)
         
-        # 新增：鼠标悬停标记相关变量
-        self.hover_line = None  # 垂直参考线
-        self.hover_price_text = None  # 价格文本标记
-        # self.hover_price_box = None  # 价格文本背景框
-        # self.canvas.mpl_connect('motion_notify_event', self.on_mouse_motion)
-        # self.canvas.mpl_connect('axes_leave_event', self.on_mouse_leave)
-        
         # 初始加载数据
         self.load_market_data()
 
         # 设置回调函数，当后台数据同步完成后刷新UI
         stock_manager.set_on_sync_complete_callback(self.on_sync_complete)
-
-        # 鼠标悬停相关初始化
-        self.crosshair_v = None
-        self.crosshair_h = None
-        self.hover_annotation = None
     
     def create_stock_list(self):
         """创建股票列表"""
@@ -151,19 +144,11 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
         self.stock_frame = tb.Frame(self.left_frame, bootstyle="dark")
         self.stock_frame.pack(fill=tk.BOTH, expand=True)
         
-        # 创建股票列表
+        # 创建股票列表（虚拟列表，只渲染可见行，点击列标题可排序）
         columns = ('代码', '名称', '价格', '涨跌幅')
-        self.stock_tree = tb.Treeview(self.stock_frame, columns=columns, show='headings', bootstyle="dark")
-        
-        # 设置列标题
-        for col in columns:
-            self.stock_tree.heading(col, text=col)
-        
-        # 设置列宽
-        self.stock_tree.column('代码', width=100)
-        self.stock_tree.column('名称', width=100)
-        self.stock_tree.column('价格', width=80)
-        self.stock_tree.column('涨跌幅', width=100)  # 扩大涨跌幅列，以便显示更多信息
+        widths = {'代码': 100, '名称': 100, '价格': 80, '涨跌幅': 100}  # 扩大涨跌幅列，以便显示更多信息
+        self.stock_tree = VirtualList(self.stock_frame, columns, widths=widths, 
+                                      on_select=self.on_stock_select, bootstyle="dark")
         
         # 设置表格样式
         style = Style()
@@ -178,17 +163,13 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
                  background=[('selected', ACCENT_COLOR)],
                  foreground=[('selected', TEXT_COLOR)])
         
-        # 添加滚动条
-        scrollbar = tb.Scrollbar(self.stock_frame, orient=tk.VERTICAL, command=self.stock_tree.yview, 
-                               bootstyle="round-dark")
-        self.stock_tree.configure(yscrollcommand=scrollbar.set)
+        # 设置颜色
+        self.stock_tree.tag_configure('up', foreground=UP_COLOR)  # 鲜艳的红色
+        self.stock_tree.tag_configure('down', foreground=DOWN_COLOR)  # 鲜艳的绿色
+        self.stock_tree.tag_configure('flat', foreground=TEXT_COLOR)  # 白色
         
         # 布局
-        self.stock_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        # 绑定选择事件
-        self.stock_tree.bind("<<TreeviewSelect>>", self.on_stock_select)
+        self.stock_tree.pack(fill=tk.BOTH, expand=True)
     
     def create_chart(self):
         """创建图表"""
@@ -213,24 +194,32 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
         plt.style.use('dark_background')
         
         # 创建图表
-        self.fig, self.ax = plt.subplots(figsize=(6, 4), dpi=100)
-        self.canvas = FigureCanvasTkAgg(self.fig, master=self.chart_frame)
+        # 创建图表（上方价格区，下方成交量区，共用横坐标）
+        self.fig, (self.ax, self.volume_ax) = plt.subplots(
+            2, 1, figsize=(6, 4), dpi=100, sharex=True, gridspec_kw={'height_ratios': [3, 1]})
+        # 图表在后台线程中渲染，主线程只负责把画好的帧显示出来；
+        # 之后对 self.chart 的修改都通过 self.canvas.submit 交给渲染线程执行
+        self.canvas = OffscreenCanvas(self.fig, master=self.chart_frame)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
         
-        # 初始化图表
-        self.ax.set_title(self.chart_title_var.get(), color=TEXT_COLOR)
-        self.ax.set_xlabel("日期", color=TEXT_COLOR)
-        self.ax.set_ylabel("价格", color=TEXT_COLOR)
-        self.ax.tick_params(colors=TEXT_COLOR)
-        self.fig.patch.set_facecolor(CHART_BG_COLOR)  # 设置图表背景颜色
-        self.ax.set_facecolor(CHART_AREA_COLOR)  # 设置坐标区域背景颜色
-        
-        # 设置网格线
-        self.ax.grid(True, linestyle='--', alpha=0.3, color=GRID_COLOR)
+        # 初始化图表（常驻的图元，之后只替换数据）
+        with self.canvas.render_lock:
+            self.chart = PriceChart(self.fig, self.ax, self.canvas, volume_ax=self.volume_ax)
+            # 该回调在渲染线程中触发，转回主线程处理
+            self.chart.on_need_history = lambda oldest_date: ui_dispatcher.post(
+                self.load_older_history, oldest_date, key=(self, "history"))
+            self.chart.set_period(self.current_chart_period)
+            self.chart.set_title(self.chart_title_var.get())
+        self.chart_style = self.chart.style
+        self.chart_dragging = False
         
         # 绑定鼠标事件
         self.canvas.mpl_connect('motion_notify_event', self.on_mouse_motion)
         self.canvas.mpl_connect('axes_leave_event', self.on_mouse_leave)
+        # 滚轮缩放、左键拖动平移
+        self.canvas.mpl_connect('scroll_event', self.on_chart_scroll)
+        self.canvas.mpl_connect('button_press_event', self.on_chart_press)
+        self.canvas.mpl_connect('button_release_event', self.on_chart_release)
         
         self.canvas.draw()
     
@@ -249,6 +238,12 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
                                             bootstyle="outline-info", width=5)
         self.hourly_chart_btn.pack(side=tk.LEFT, padx=0)
         
+        # K线/折线切换
+        self.chart_style_btn = tb.Button(parent_frame, text="折线", 
+                                         command=self.toggle_chart_style, 
+                                         bootstyle="outline-secondary", width=5)
+        self.chart_style_btn.pack(side=tk.LEFT, padx=(5, 0))
+        
         # 初始化时，根据默认周期更新按钮状态
         self.update_period_button_states()
 
@@ -261,10 +256,8 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
                 self.update_chart(self.current_stock_code, self.current_stock_name)
             else:
                  # 如果还没有选中的股票，只更新标题
-                self.ax.clear()
                 self.chart_title_var.set("请选择股票查看日K线走势")
-                self.ax.set_title(self.chart_title_var.get(), color=TEXT_COLOR)
-                self.canvas.draw()
+                self.show_chart_message(self.chart_title_var.get())
 
     def set_hourly_chart_period(self):
         """设置图表周期为小时线并刷新"""
@@ -274,10 +267,19 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
             if self.current_stock_code and self.current_stock_name:
                 self.update_chart(self.current_stock_code, self.current_stock_name)
             else:
-                self.ax.clear()
                 self.chart_title_var.set("请选择股票查看近24小时走势")
-                self.ax.set_title(self.chart_title_var.get(), color=TEXT_COLOR)
-                self.canvas.draw()
+                self.show_chart_message(self.chart_title_var.get())
+
+    def show_chart_message(self, title, text=''):
+        """清空图表并显示提示文字"""
+        self.canvas.submit(lambda: self.chart.show_message(title, text), key="chart")
+
+    def toggle_chart_style(self):
+        """在K线和收盘价折线之间切换"""
+        self.chart_style = "line" if self.chart_style == "candle" else "candle"
+        style = self.chart_style
+        self.canvas.submit(lambda: self.chart.set_style(style), key="style")
+        self.chart_style_btn.config(text="K线" if style == "line" else "折线")
 
     def update_period_button_states(self):
         """根据当前选择的周期更新按钮的样式 (例如，选中的按钮为实心)"""
@@ -288,49 +290,34 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
             self.daily_chart_btn.config(bootstyle="outline-info")
             self.hourly_chart_btn.config(bootstyle="info")
 
+    @staticmethod
+    def format_stock_row(code, info):
+        """生成一行的显示值和颜色标签"""
+        name = info.get("name", "")
+        price = info.get("price", 0)
+        change = info.get("change", 0)
+        
+        # 根据涨跌幅设置颜色标签
+        if change > 0:
+            tag = "up"
+            change_str = f"+{change:.2f}%"
+        elif change < 0:
+            tag = "down"
+            change_str = f"{change:.2f}%"
+        else:
+            tag = "flat"
+            change_str = f"{change:.2f}%"
+        return (code, name, f"{price:.2f}", change_str), tag
+    
     def load_market_data(self):
-        """加载市场数据"""
+        """加载市场数据（只更新有变化的行）"""
         # 更新状态
         self.status_label.config(text="状态: 正在加载数据...", bootstyle="warning")
         self.refresh_indicator.config(text="●", bootstyle="warning")
         
-        # 清空列表
-        for item in self.stock_tree.get_children():
-            self.stock_tree.delete(item)
-        
         # 获取股票数据
         stocks = db.get_stocks()
-        
-        # 扩大涨跌幅列，以便显示更多信息
-        self.stock_tree.column('涨跌幅', width=100)
-        
-        # 添加到列表
-        for code, info in stocks.items():
-            name = info.get("name", "")
-            price = info.get("price", 0)
-            change = info.get("change", 0)
-            
-            # 根据涨跌幅设置颜色标签
-            if change > 0:
-                tag = "up"
-                change_str = f"+{change:.2f}%"
-            elif change < 0:
-                tag = "down"
-                change_str = f"{change:.2f}%"
-            else:
-                tag = "flat"
-                change_str = f"{change:.2f}%"
-            
-            # 添加数据获取时间标记
-            timestamp = datetime.now().strftime("%H:%M:%S")
-            
-            # 插入数据
-            self.stock_tree.insert('', tk.END, values=(code, name, f"{price:.2f}", change_str), tags=(tag,))
-        
-        # 设置颜色
-        self.stock_tree.tag_configure('up', foreground=UP_COLOR)  # 鲜艳的红色
-        self.stock_tree.tag_configure('down', foreground=DOWN_COLOR)  # 鲜艳的绿色
-        self.stock_tree.tag_configure('flat', foreground=TEXT_COLOR)  # 白色
+        self.stock_tree.update_rows([self.format_stock_row(code, info) for code, info in stocks.items()])
         
         # 更新最后刷新时间
         current_time = datetime.now().strftime("%H:%M:%S")
@@ -345,37 +332,80 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
     
     def refresh_market(self):
         """刷新市场数据"""
+        if self.refreshing:
+            return  # 上一次刷新还没完成，完成时会一并更新界面
+        self.refreshing = True
+        
         # 更新状态
         self.status_label.config(text="状态: 正在刷新实时数据...", bootstyle="warning")
         self.refresh_indicator.config(text="●", bootstyle="warning")
         self.refresh_btn.config(state=tk.DISABLED)
         
         def do_refresh():
-            # 先同步价格数据（确保数据库中的价格与实际价格一致）
-            stock_manager.sync_stock_prices()
-            
-            # 更新股票价格
-            stock_manager.update_stock_prices()
-            
-            # 重新加载数据
-            self.load_market_data()
-            
-            # 如果有选中的股票，重新加载图表
-            selected_items = self.stock_tree.selection()
-            if selected_items:
-                item = selected_items[0]
-                values = self.stock_tree.item(item, 'values')
-                if values:
-                    code = values[0]
-                    name = values[1]
-                    self.update_chart(code, name)
-            
-            # 恢复按钮状态
-            self.refresh_btn.config(state=tk.NORMAL)
+            try:
+                # 先同步价格数据（确保数据库中的价格与实际价格一致）
+                stock_manager.sync_stock_prices()
+                
+                # 更新股票价格
+                stock_manager.update_stock_prices()
+            finally:
+                # 界面更新交给主线程调度器，重复的重新加载会被合并
+                self.post_reload()
         
         # 使用线程进行刷新，避免界面卡顿
         threading.Thread(target=do_refresh, daemon=True).start()
     
+    def post_reload(self):
+        """（任意线程）请求重新加载行情列表和当前图表，并结束刷新状态"""
+        ui_dispatcher.post(self.load_market_data, key=(self, "reload"))
+        ui_dispatcher.post(self.reload_selected_chart, key=(self, "chart"))
+        ui_dispatcher.post(self.finish_refresh, key=(self, "finish"))
+    
+    def reload_selected_chart(self):
+        """
+        刷新选中股票的图表：图表已加载同一股票和周期时只取最新的K线并入，
+        保留已加载的更早历史和当前的缩放/平移位置；否则重新加载
+        """
+        values = self.stock_tree.selected_values()
+        if not values:
+            return
+        code = values[0]
+        if self.chart_loaded == (code, self.current_chart_period) and len(self.chart.dates):
+            self.update_latest_bars(code, self.current_chart_period, self.chart.dates[-1])
+        else:
+            self.update_chart(code, values[1])
+
+    def update_latest_bars(self, code, period, last_date):
+        """在后台线程中取回 last_date 之后（含）的K线，交给渲染线程并入图表"""
+        request = self.chart_request
+
+        def do_load():
+            try:
+                if period == "daily":
+                    df = bar_store.get_bars(code, start_date=last_date.strftime("%Y-%m-%d"))
+                else:
+                    df = stock_manager.get_stock_hourly_data(code, lookback_hours=24)
+            except Exception as e:
+                print(f"刷新 {code} 的最新K线失败: {e}")
+                return
+            if request != self.chart_request or df.empty or 'date' not in df.columns or 'close' not in df.columns:
+                return
+
+            def do_merge():
+                if self.chart_loaded == (code, period):
+                    self.chart.merge_latest(df)
+
+            self.canvas.submit(do_merge, key="latest")
+
+        threading.Thread(target=do_load, daemon=True).start()
+    
+    def finish_refresh(self):
+        """恢复按钮状态"""
+        self.refreshing = False
+        self.refresh_btn.configure(state=tk.NORMAL)
+        if hasattr(self, 'sync_btn'):
+            self.sync_btn.configure(state=tk.NORMAL)
+    
     def toggle_auto_refresh(self):
         """切换自动刷新状态"""
         if self.auto_refresh_var.get():
@@ -394,7 +424,7 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
         """自动刷新任务"""
         while self.update_running:
             # 刷新数据
-            self.after(0, self.refresh_market)
+            ui_dispatcher.post(self.refresh_market, key=(self, "refresh"))
             # 等待30秒（模拟实时行情的刷新间隔）
             time.sleep(30)
     
@@ -411,30 +441,8 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
         # 搜索股票
         results = stock_manager.search_stocks(keyword)
         
-        # 清空列表
-        for item in self.stock_tree.get_children():
-            self.stock_tree.delete(item)
-        
-        # 添加搜索结果
-        for stock in results:
-            code = stock.get("code", "")
-            name = stock.get("name", "")
-            price = stock.get("price", 0)
-            change = stock.get("change", 0)
-            
-            # 根据涨跌幅设置颜色标签
-            if change > 0:
-                tag = "up"
-                change_str = f"+{change:.2f}%"
-            elif change < 0:
-                tag = "down"
-                change_str = f"{change:.2f}%"
-            else:
-                tag = "flat"
-                change_str = f"{change:.2f}%"
-            
-            # 插入数据
-            self.stock_tree.insert('', tk.END, values=(code, name, f"{price:.2f}", change_str), tags=(tag,))
+        # 列表只保留搜索结果
+        self.stock_tree.set_rows([self.format_stock_row(stock.get("code", ""), stock) for stock in results])
         
         # 更新状态
         if results:
@@ -443,16 +451,8 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
             self.status_label.config(text=f"状态: 未找到匹配结果", bootstyle="danger")
             messagebox.showinfo("提示", f"未找到与 '{keyword}' 相关的股票")
     
-    def on_stock_select(self, event):
-        """处理股票选择事件"""
-        selected_items = self.stock_tree.selection()
-        if not selected_items:
-            self.current_stock_code = None # 清除当前选中的股票
-            self.current_stock_name = None
-            return
-        
-        item = selected_items[0]
-        values = self.stock_tree.item(item, 'values')
+    def on_stock_select(self, values):
+        """处理股票选择事件（values为选中行的显示值）"""
         if not values:
             self.current_stock_code = None
             self.current_stock_name = None
@@ -468,95 +468,90 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
         self.update_chart(code, name) # update_chart会根据current_chart_period选择数据源
     
     def update_chart(self, code, name):
-        """根据当前选择的周期更新图表"""
-        self.ax.clear() # 清除旧图
-        df = pd.DataFrame()
+        """
+        根据当前选择的周期更新图表（复用已有图元，只替换数据）。
+        取数在后台线程中完成，取到的数据再交给渲染线程绘制；连续切换股票时只显示最后一只。
+        """
+        period = self.current_chart_period
+        self.history_loading = False
+        self.history_exhausted = period != "daily"  # 小时线接口只提供最近几天的数据
 
-        if self.current_chart_period == "daily":
+        if period == "daily":
             self.chart_title_var.set(f"{name} ({code}) - 日K线")
-            # 计算60天前的日期和今天的日期
-            end_date_daily = datetime.now().strftime("%Y-%m-%d")
-            start_date_daily = (datetime.now() - timedelta(days=60)).strftime("%Y-%m-%d")
-            df = stock_manager.get_stock_data(code, start_date=start_date_daily, end_date=end_date_daily)
-        elif self.current_chart_period == "hourly":
+        elif period == "hourly":
             self.chart_title_var.set(f"{name} ({code}) - 近24小时")
-            df = stock_manager.get_stock_hourly_data(code, lookback_hours=24)
-        
-        # 保存当前图表数据供鼠标悬停功能使用
-        self.current_chart_df = df.copy() if not df.empty else None
-        
-        self.ax.set_title(self.chart_title_var.get(), color=TEXT_COLOR)
+        title = self.chart_title_var.get()
+
+        self.chart_request += 1
+        self.chart_loaded = None
+        request = self.chart_request
+        threading.Thread(target=self._load_chart_data, args=(request, code, name, period, title),
+                         daemon=True).start()
+
+    def _load_chart_data(self, request, code, name, period, title):
+        """（后台线程）获取K线数据，校验后提交给渲染线程；期间又切换了图表则丢弃"""
+        try:
+            if period == "daily":
+                # 日线走本地K线缓存，只补齐缺失的区间
+                start_date_daily = (datetime.now() - timedelta(days=DAILY_HISTORY_DAYS)).strftime("%Y-%m-%d")
+                df = bar_store.get_bars(code, start_date=start_date_daily)
+            elif period == "hourly":
+                df = stock_manager.get_stock_hourly_data(code, lookback_hours=24)
+            else:
+                df = pd.DataFrame()
+        except Exception as e:
+            print(f"获取 {code} 的 {period} 数据失败: {e}")
+            df = pd.DataFrame()
+        if request != self.chart_request:
+            return
 
         if df.empty:
-            msg = f"未找到 {code} 的 {self.current_chart_period} 数据"
-            messagebox.showinfo("提示", msg)
-            self.status_label.config(text=f"状态: {msg}", bootstyle="danger")
-            self.ax.text(0.5, 0.5, msg, horizontalalignment='center', verticalalignment='center', color=TEXT_COLOR, transform=self.ax.transAxes)
-            self.canvas.draw()
+            msg = f"未找到 {code} 的 {period} 数据"
+            ui_dispatcher.post(self._show_chart_error, "提示", msg)
+            self.canvas.submit(lambda: self.chart.show_message(title, msg), key="chart")
             return
 
         # 确保 'date' 和 'close' 列存在
         if 'date' not in df.columns or 'close' not in df.columns:
-            msg = f"{code} 返回的数据缺少 'date' 或 'close' 列 ({self.current_chart_period} 周期)"
-            messagebox.showerror("数据错误", msg)
-            self.status_label.config(text=f"状态: {msg}", bootstyle="danger")
-            self.ax.text(0.5, 0.5, "数据格式错误", horizontalalignment='center', verticalalignment='center', color=TEXT_COLOR, transform=self.ax.transAxes)
-            self.canvas.draw()
+            msg = f"{code} 返回的数据缺少 'date' 或 'close' 列 ({period} 周期)"
+            ui_dispatcher.post(self._show_chart_error, "数据错误", msg)
+            self.canvas.submit(lambda: self.chart.show_message(title, "数据格式错误"), key="chart")
             return
-        
+
+        self.canvas.submit(lambda: self._render_chart(df, code, name, period, title), key="chart")
+
+    def _render_chart(self, df, code, name, period, title):
+        """（渲染线程）用已取到的K线数据更新图表，界面提示转回主线程显示"""
         # 'date' 列对于小时数据已经是 datetime 对象，对于日线数据是 YYYY-MM-DD 字符串
-        # Matplotlib 可以处理这两种情况，但为了统一和更好的格式化，我们转换为 datetime
         try:
-            df['date'] = pd.to_datetime(df['date'])
+            view_bars = DAILY_VIEW_BARS if period == "daily" else None
+            self.chart.set_data(df, title, period, view_bars=view_bars)
         except Exception as e:
             print(f"转换日期列失败: {e}")
-            messagebox.showerror("数据错误", f"日期格式无法解析: {e}")
-            # Fallback or return
-            self.canvas.draw()
+            ui_dispatcher.post(messagebox.showerror, "数据错误", f"日期格式无法解析: {e}")
+            self.chart.show_message(title, "数据格式错误")
             return
 
-        self.ax.plot(df['date'], df['close'], marker='.', linestyle='-', color=ACCENT_COLOR, linewidth=1.5)
-        
-        self.ax.set_xlabel("时间", color=TEXT_COLOR)
-        self.ax.set_ylabel("价格", color=TEXT_COLOR)
-        self.ax.tick_params(axis='x', colors=TEXT_COLOR, labelrotation=45)
-        self.ax.tick_params(axis='y', colors=TEXT_COLOR)
-        self.ax.grid(True, linestyle='--', alpha=0.3, color=GRID_COLOR)
-        self.fig.patch.set_facecolor(CHART_BG_COLOR)
-        self.ax.set_facecolor(CHART_AREA_COLOR)
+        self.chart_loaded = (code, period)
+        ui_dispatcher.post(self.set_status, f"状态: {name}({code}) {period} 图表已加载", "success",
+                           key=(self, "status"))
 
-        # 设置X轴日期格式和定位器
-        if self.current_chart_period == "daily":
-            date_format = mdates.DateFormatter('%Y-%m-%d')
-            # 自动选择最优的日期刻度定位器，同时限制刻度数量
-            self.ax.xaxis.set_major_locator(mdates.AutoDateLocator(minticks=5, maxticks=10, tz=None))
-            self.ax.xaxis.set_minor_locator(mdates.DayLocator()) # 以天为次刻度单位
-        elif self.current_chart_period == "hourly":
-            date_format = mdates.DateFormatter('%m-%d %H:%M')
-            # 对于小时图，可以更密集一些，比如每隔几个小时一个主刻度
-            # AutoDateLocator 仍然可用，或者指定 HourLocator
-            self.ax.xaxis.set_major_locator(mdates.AutoDateLocator(minticks=4, maxticks=8, tz=None))
-            # self.ax.xaxis.set_major_locator(mdates.HourLocator(interval=4)) # 例如每4小时一个主刻度
-            self.ax.xaxis.set_minor_locator(mdates.HourLocator(byhour=range(0, 24, 6))) # 每6小时一个次刻度
-        
-        self.ax.xaxis.set_major_formatter(date_format)
-        self.fig.autofmt_xdate(rotation=30, ha='right') # 自动格式化X轴日期，旋转并右对齐
-
-        # 标注逻辑 (图表最后一个数据点)
-        if (self.current_chart_period == "daily" or self.current_chart_period == "hourly") and not df.empty:
-            last_date = df['date'].iloc[-1]
-            last_price = df['close'].iloc[-1]
-            self.ax.scatter([last_date], [last_price], color='red', s=50, zorder=5) # zorder确保点在最上层
-            self.ax.annotate(f'{last_price:.2f}', (last_date, last_price),
-                             xytext=(5, 5), textcoords='offset points',
-                             color=TEXT_COLOR, bbox=dict(boxstyle="round,pad=0.2", fc=CHART_AREA_COLOR, alpha=0.7))
-
-        self.fig.tight_layout() # 自动调整布局以适应旋转的标签
-        self.canvas.draw()
-        self.status_label.config(text=f"状态: {name}({code}) {self.current_chart_period} 图表已加载", bootstyle="success")
+    def set_status(self, text, bootstyle="info"):
+        self.status_label.config(text=text, bootstyle=bootstyle)
+
+    def _show_chart_error(self, title, msg):
+        self.status_label.config(text=f"状态: {msg}", bootstyle="danger")
+        if title == "提示":
+            messagebox.showinfo(title, msg)
+        else:
+            messagebox.showerror(title, msg)
     
     def sync_and_refresh(self):
         """同步股票价格数据并刷新显示"""
+        if self.refreshing:
+            return
+        self.refreshing = True
+        
         # 禁用按钮，防止重复点击
         if hasattr(self, 'sync_btn'):
             self.sync_btn.configure(state=tk.DISABLED)
@@ -567,122 +562,97 @@ class MarketFrame(tb.Frame):  # 使用ttkbootstrap美化界面
         self.refresh_indicator.config(text="●", bootstyle="warning")
         
         def do_sync():
-            # 同步价格数据
-            stock_manager.sync_stock_prices()
-            
-            # 刷新市场数据
-            self.load_market_data()
-            
-            # 如果有选中的股票，重新加载图表
-            selected_items = self.stock_tree.selection()
-            if selected_items:
-                item = selected_items[0]
-                values = self.stock_tree.item(item, 'values')
-                if values:
-                    code = values[0]
-                    name = values[1]
-                    self.update_chart(code, name)
-            
-            # 恢复按钮状态
-            self.refresh_btn.configure(state=tk.NORMAL)
-            if hasattr(self, 'sync_btn'):
-                self.sync_btn.configure(state=tk.NORMAL)
+            try:
+                # 同步价格数据
+                stock_manager.sync_stock_prices()
+            finally:
+                self.post_reload()
         
         # 使用线程进行同步，避免界面卡顿
         threading.Thread(target=do_sync, daemon=True).start()
 
-    def on_mouse_motion(self, event):
-        """处理鼠标移动事件，显示垂直参考线和价格标记"""
-        # 检查鼠标是否在坐标轴内
-        if not event.inaxes or event.inaxes != self.ax:
-            # 如果鼠标移出了图表区域，隐藏参考线和价格标记
-            if self.hover_line:
-                self.hover_line.set_visible(False)
-            if self.hover_price_text:
-                self.hover_price_text.set_visible(False)
-            self.canvas.draw_idle()
+    def load_older_history(self, oldest_date):
+        """图表滚动到已加载数据的最左端时，在后台线程中取回更早一年的日线"""
+        if self.history_loading or self.history_exhausted or not self.current_stock_code:
             return
-        
-        # 确保有数据可用
-        if self.current_chart_df is None or self.current_chart_df.empty:
+        self.history_loading = True
+        code, period = self.current_stock_code, self.current_chart_period
+        end_date = (oldest_date - timedelta(days=1)).strftime("%Y-%m-%d")
+        start_date = (oldest_date - timedelta(days=DAILY_HISTORY_DAYS)).strftime("%Y-%m-%d")
+        self.status_label.config(text=f"状态: 正在加载 {code} {start_date} 之前的历史数据...", bootstyle="info")
+        
+        def do_load():
+            try:
+                df = bar_store.get_bars(code, start_date=start_date, end_date=end_date)
+            except Exception as e:
+                print(f"加载历史数据失败: {e}")
+                df = pd.DataFrame()
+            ui_dispatcher.post(self.on_older_history_loaded, code, period, df)
+        
+        threading.Thread(target=do_load, daemon=True).start()
+    
+    def on_older_history_loaded(self, code, period, df):
+        """把更早的数据交给渲染线程拼接到图表上（期间切换了股票或周期则丢弃）"""
+        if code != self.current_stock_code or period != self.current_chart_period:
             return
-            
-        df = self.current_chart_df
-        
-        # 获取x轴和y轴的数据
-        try:
-            # 确保date列是datetime类型
-            if 'date' in df.columns:
-                dates = pd.to_datetime(df['date'])
-                prices = df['close'].values
-            else:
-                return
-                
-            # 转换为matplotlib可用的数值
-            date_nums = mdates.date2num(dates)
-            
-            # 找到最接近鼠标x坐标的数据点索引
-            if len(date_nums) == 0:
-                return
-                
-            # 使用numpy找到最接近的索引
-            idx = np.argmin(np.abs(date_nums - event.xdata))
-            
-            # 获取对应的数据
-            closest_date_num = date_nums[idx]
-            closest_price = prices[idx]
-            closest_date = dates.iloc[idx]
-            
-        except Exception as e:
-            print(f"处理鼠标悬停数据时出错: {e}")
+        if df.empty:
+            self.history_loading = False
+            self.history_exhausted = True
+            self.status_label.config(text=f"状态: {code} 没有更早的历史数据", bootstyle="secondary")
             return
-            
-        # 移除旧的标记（如果存在）
-        if self.hover_line:
-            self.hover_line.remove()
-        if self.hover_price_text:
-            self.hover_price_text.remove()
-            
-        # 创建新的垂直参考线
-        self.hover_line = self.ax.axvline(x=closest_date_num, color='gray', linestyle='-', linewidth=1, alpha=0.8)
-        
-        # 计算价格标记的位置
-        y_max = self.ax.get_ylim()[1]
-        y_min = self.ax.get_ylim()[0]
-        y_pos = y_max - (y_max - y_min) * 0.05  # 在图表顶部显示
-        
-        # 格式化日期和价格文本
-        if self.current_chart_period == 'hourly':
-            date_str = closest_date.strftime('%m-%d %H:%M')
-        else:
-            date_str = closest_date.strftime('%Y-%m-%d')
-        
-        price_text = f"{date_str}\n{closest_price:.2f}(元)"
         
-        # 创建价格文本标记
-        self.hover_price_text = self.ax.text(
-            closest_date_num, y_pos, price_text,
-            ha='center', va='bottom',
-            fontsize=9, fontweight='bold', color='red',
-            bbox=dict(boxstyle='round,pad=0.3', facecolor='white', alpha=0.9, edgecolor='gray')
-        )
+        def do_prepend():
+            added = self.chart.prepend(df)
+            ui_dispatcher.post(self.on_history_prepended, code, added)
         
-        # 重绘画布
-        self.canvas.draw_idle()
+        self.canvas.submit(do_prepend)
+    
+    def on_history_prepended(self, code, added):
+        self.history_loading = False
+        if added == 0:
+            self.history_exhausted = True
+            self.status_label.config(text=f"状态: {code} 没有更早的历史数据", bootstyle="secondary")
+        else:
+            self.status_label.config(text=f"状态: 已加载 {added} 条更早的历史数据", bootstyle="success")
+    
+    def on_chart_scroll(self, event):
+        """滚轮缩放：向上放大，向下缩小"""
+        if event.inaxes not in (self.ax, self.volume_ax):
+            return
+        xdata, factor = event.xdata, 0.8 if event.button == 'up' else 1.25
+        self.canvas.submit(lambda: self.chart.zoom(xdata, factor))
+    
+    def on_chart_press(self, event):
+        if event.button == 1 and event.inaxes in (self.ax, self.volume_ax):
+            self.chart_dragging = True
+            x = event.x
+            self.canvas.submit(lambda: self.chart.start_drag(x))
+    
+    def on_chart_release(self, event):
+        if self.chart_dragging:
+            self.chart_dragging = False
+            self.canvas.submit(self.chart.end_drag)
+    
+    def on_mouse_motion(self, event):
+        """处理鼠标移动事件，显示垂直参考线和价格标记；按住左键时平移图表"""
+        if self.chart_dragging:
+            # 拖动位置相对按下时计算，排队中的拖动只需保留最新一次
+            x = event.x
+            self.canvas.submit(lambda: self.chart.drag(x), key="drag")
+            return
+        # 检查鼠标是否在坐标轴内
+        if not event.inaxes or event.inaxes != self.ax:
+            self.canvas.run_or_submit(self.chart.hide_hover, key="hover")
+            return
+        xdata = event.xdata
+        self.canvas.run_or_submit(lambda: self.chart.hover(xdata), key="hover")
 
     def on_mouse_leave(self, event):
         """处理鼠标离开图表区域事件，隐藏垂直参考线和价格标记"""
-        # 移除旧的标记（如果存在）
-        if self.hover_line:
-            self.hover_line.remove()
-            self.hover_line = None
-        if self.hover_price_text:
-            self.hover_price_text.remove()
-            self.hover_price_text = None
-        self.canvas.draw_idle()
+        self.canvas.run_or_submit(self.chart.hide_hover, key="hover")
 
     def on_sync_complete(self):
         """后台同步完成时的回调函数"""
         print("MarketFrame: Received sync complete signal, scheduling UI refresh.")
-        # 使用after方法确保UI更新在主线程中执行
-        self.after(0, self.load_market_data)
+        # 交给主线程调度器执行，与刷新按钮触发的重新加载合并
+        ui_dispatcher.post(self.load_market_data, key=(self, "reload"))
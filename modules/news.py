@@ -10,6 +10,7 @@ import threading
 import webbrowser
 import ttkbootstrap as tb
 import os
+from .ui_dispatcher import ui_dispatcher
 
 class NewsFrame(tb.Frame):
     """新闻页面框架"""
@@ -84,43 +85,42 @@ class NewsFrame(tb.Frame):
         thread.start()
     
     def fetch_news(self):
-        """爬取新闻的主函数"""
+        """爬取新闻的主函数（在后台线程中运行，界面更新交给主线程调度器）"""
         try:
-            # 清空现有数据
-            for item in self.news_tree.get_children():
-                self.news_tree.delete(item)
-            
-            self.news_data = []
-            
             # 获取新闻
             news_list = self.get_stock_news()
             
             # 检查是否获取到数据
             if not news_list:
+                ui_dispatcher.post(self.show_news, [], key=(self, "news"))
                 self.update_status("未获取到任何新闻数据，请检查网络连接或网页结构")
                 return
             
             # 过滤掉标题太短的项目（可能是广告或导航）
             filtered_news = [news for news in news_list if len(news['标题']) > 5]
             
-            # 存储新闻数据
-            self.news_data = filtered_news
-            
             # 更新界面
-            for i, news in enumerate(filtered_news):
-                self.news_tree.insert('', tk.END, values=(news['标题'], news['时间'], news['链接']))
-            
+            ui_dispatcher.post(self.show_news, filtered_news, key=(self, "news"))
             self.update_status(f"成功获取 {len(filtered_news)} 条新闻")
             
         except Exception as e:
             self.update_status(f"爬取过程中出错: {str(e)}")
         finally:
             # 恢复界面状态
-            self.after(0, self.stop_progress)
+            ui_dispatcher.post(self.stop_progress, key=(self, "stop_progress"))
+    
+    def show_news(self, news_list):
+        """（主线程）用新闻列表替换表格内容"""
+        self.news_tree.delete(*self.news_tree.get_children())
+        
+        # 存储新闻数据
+        self.news_data = news_list
+        for news in news_list:
+            self.news_tree.insert('', tk.END, values=(news['标题'], news['时间'], news['链接']))
     
     def update_status(self, message):
-        """更新状态信息（线程安全）"""
-        self.after(0, lambda: self.status_label.config(text=f"状态: {message}"))
+        """更新状态信息（线程安全，连续多条只显示最新一条）"""
+        ui_dispatcher.post(lambda: self.status_label.config(text=f"状态: {message}"), key=(self, "status"))
     
     def stop_progress(self):
         """停止进度条并恢复按钮状态"""
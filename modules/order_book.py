@@ -0,0 +1,180 @@
+import heapq
+import threading
+from .database import db
+
+# (买卖方向, 订单类型) -> 触发方向
+#   "below": 价格跌到触发价及以下时成交；"above": 价格涨到触发价及以上时成交
+ORDER_TRIGGERS = {
+    ('buy', 'limit'): 'below',
+    ('sell', 'limit'): 'above',
+    ('sell', 'stop_loss'): 'below',
+    ('sell', 'take_profit'): 'above',
+}
+
+ORDER_TYPE_NAMES = {'market': '市价', 'limit': '限价', 'stop_loss': '止损', 'take_profit': '止盈'}
+ORDER_STATUS_NAMES = {'open': '未成交', 'filled': '已成交', 'cancelled': '已撤销', 'rejected': '已拒绝'}
+
+
+class OrderBook:
+    """
+    挂单簿：限价单、止损单、止盈单按股票放在两个以触发价为键的堆中，
+    "跌到触发价成交"的订单按触发价从高到低排列（堆中存负价格），
+    "涨到触发价成交"的订单按触发价从低到高排列。
+    价格更新时只从堆顶弹出触发价已被穿越的订单，其余挂单不会被扫描。
+    撤单只从订单表中移除，堆里残留的条目在弹出时跳过。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._below = {}     # 股票代码 -> [(-触发价, 订单号)]
+        self._above = {}     # 股票代码 -> [(触发价, 订单号)]
+        self._orders = {}    # 订单号 -> 订单（只含未成交的）
+        self._listeners = []
+
+    def load(self):
+        """从数据库加载未成交的挂单（启动时调用）"""
+        with self._lock:
+            self._below.clear()
+            self._above.clear()
+            self._orders.clear()
+            for order in db.get_open_orders():
+                self._push(order)
+        print(f"挂单簿: 已加载 {len(self._orders)} 笔未成交挂单")
+
+    def _push(self, order):
+        trigger = ORDER_TRIGGERS.get((order['side'], order['order_type']))
+        if trigger is None:
+            return
+        self._orders[order['id']] = order
+        if trigger == 'below':
+            heapq.heappush(self._below.setdefault(order['stock_code'], []), (-order['trigger_price'], order['id']))
+        else:
+            heapq.heappush(self._above.setdefault(order['stock_code'], []), (order['trigger_price'], order['id']))
+
+    def add_listener(self, callback):
+        """注册成交回调 callback(order, success, message)，在撮合所在的线程中调用"""
+        self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def open_orders(self, username=None):
+        """返回内存中的未成交挂单"""
+        with self._lock:
+            orders = list(self._orders.values())
+        if username is not None:
+            orders = [order for order in orders if order['username'] == username]
+        return sorted(orders, key=lambda order: order['id'])
+
+    def place_order(self, username, stock_code, side, order_type, trigger_price, quantity, client_order_id=None):
+        """
+        提交挂单
+        :param side: "buy" 或 "sell"
+        :param order_type: "limit" 限价, "stop_loss" 止损（卖出）, "take_profit" 止盈（卖出）
+        :param trigger_price: 限价单为委托价，止损/止盈单为触发价
+        :param client_order_id: 客户端订单号，重复提交时返回原订单，不会重复挂单
+        :return: (是否成功, 提示信息, 订单号)
+        """
+        if client_order_id is not None:
+            order = db.get_order_by_client_id(username, client_order_id)
+            if order:
+                return True, f"委托已提交，订单号 {order['id']}", order['id']
+        if (side, order_type) not in ORDER_TRIGGERS:
+            return False, "不支持的订单类型", None
+        if quantity <= 0:
+            return False, "委托数量必须大于0", None
+        if trigger_price <= 0:
+            return False, "委托价格必须大于0", None
+        stock = db.get_stock(stock_code)
+        if not stock:
+            return False, "股票不存在", None
+
+        if side == 'sell':
+            held = db.get_holdings(username).get(stock_code, {}).get('quantity', 0)
+            pending = sum(order['quantity'] for order in self.open_orders(username)
+                          if order['stock_code'] == stock_code and order['side'] == 'sell')
+            if held - pending < quantity:
+                return False, "可卖持仓不足（已扣除未成交的卖单）", None
+        else:
+            user = db.get_user(username)
+            if not user:
+                return False, "用户不存在", None
+            pending = sum(order['trigger_price'] * order['quantity'] for order in self.open_orders(username)
+                          if order['side'] == 'buy')
+            if user['balance'] - pending < trigger_price * quantity:
+                return False, "可用资金不足（已扣除未成交的买单）", None
+
+        order_id, created = db.add_order(username, stock_code, side, order_type, trigger_price, quantity,
+                                         client_order_id)
+        if not created:
+            return True, f"委托已提交，订单号 {order_id}", order_id
+        with self._lock:
+            self._push(db.get_order(order_id))
+
+        # 委托价已被当前价穿越的订单立即撮合
+        self.on_price(stock_code, stock['price'])
+        return True, f"委托已提交，订单号 {order_id}", order_id
+
+    def cancel_order(self, username, order_id):
+        """撤销未成交的挂单"""
+        with self._lock:
+            order = self._orders.get(order_id)
+            if not order or order['username'] != username:
+                return False, "订单不存在或已成交"
+            del self._orders[order_id]
+        db.update_order_status(order_id, 'cancelled', message="用户撤单")
+        return True, "订单已撤销"
+
+    def on_price(self, stock_code, price):
+        """
+        价格更新时撮合：只弹出触发价被穿越的订单，以当前价成交
+        :return: [(订单, 是否成功, 提示信息)]
+        """
+        if not price or price <= 0:
+            return []
+        triggered = []
+        with self._lock:
+            heap = self._below.get(stock_code)
+            while heap and -heap[0][0] >= price:
+                order = self._orders.pop(heapq.heappop(heap)[1], None)
+                if order is not None:
+                    triggered.append(order)
+            heap = self._above.get(stock_code)
+            while heap and heap[0][0] <= price:
+                order = self._orders.pop(heapq.heappop(heap)[1], None)
+                if order is not None:
+                    triggered.append(order)
+
+        if not triggered:
+            return []
+        # 同时触发的订单在一个事务中成交，订单状态随成交一起写入
+        try:
+            fills = db.execute_trades([(order['username'], order['side'], stock_code, order['quantity'], price,
+                                        None, order['id']) for order in triggered])
+        except Exception as e:
+            # 整批没有写入，订单放回挂单簿等下一次价格更新
+            print(f"挂单簿: {stock_code} 撮合失败，{len(triggered)} 笔订单保留: {e}")
+            with self._lock:
+                for order in triggered:
+                    self._push(order)
+            return []
+        results = []
+        for order, (success, message) in zip(triggered, fills):
+            status = 'filled' if success else 'rejected'
+            fill_price = price if success else None
+            order = dict(order, status=status, fill_price=fill_price, message=message)
+            print(f"挂单簿: 订单 {order['id']} {ORDER_TYPE_NAMES[order['order_type']]}"
+                  f"{'买入' if order['side'] == 'buy' else '卖出'} {stock_code} @ {price} -> {message}")
+            results.append((order, success, message))
+            for callback in list(self._listeners):
+                try:
+                    callback(order, success, message)
+                except Exception as e:
+                    print(f"挂单簿: 成交回调出错: {e}")
+        return results
+
+
+# 创建挂单簿实例（启动时加载未成交的挂单）
+order_book = OrderBook()
+order_book.load()
@@ -0,0 +1,118 @@
+import itertools
+import queue
+import threading
+import time
+from .database import db
+
+
+class OrderRequest:
+    """一笔排队中的市价委托"""
+
+    __slots__ = ('order_id', 'username', 'transaction_type', 'stock_code', 'quantity', 'price',
+                 'client_order_id', 'callback', 'submitted_at')
+
+    def __init__(self, order_id, username, transaction_type, stock_code, quantity, price=None,
+                 client_order_id=None, callback=None):
+        self.order_id = order_id
+        self.username = username
+        self.transaction_type = transaction_type
+        self.stock_code = stock_code
+        self.quantity = quantity
+        self.price = price
+        self.client_order_id = client_order_id
+        self.callback = callback
+        self.submitted_at = time.monotonic()
+
+
+class OrderService:
+    """
+    异步下单服务。
+    submit() 只把委托放进队列并立即返回订单号，由唯一的写线程取出执行：
+    写线程每次把队列中积压的委托（最多 max_batch 笔，最多等待 max_wait 秒凑批）
+    交给 Database.execute_trades 在一个事务中执行并一次提交，
+    再逐笔调用回调 callback(order_id, success, message)（在写线程中调用）。
+    """
+
+    def __init__(self, max_batch=64, max_wait=0.005):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.batches = 0      # 已提交的批次数
+        self.processed = 0    # 已处理的委托数
+
+    def submit(self, username, transaction_type, stock_code, quantity, callback=None, price=None, client_order_id=None):
+        """
+        提交一笔市价委托（任意线程可调用，不等待成交）
+        :param client_order_id: 客户端订单号，重试时传同一个号不会重复成交，回调得到第一次的结果
+        :return: 订单号
+        """
+        self._ensure_started()
+        order_id = next(self._ids)
+        self._queue.put(OrderRequest(order_id, username, transaction_type, stock_code, quantity, price,
+                                     client_order_id, callback))
+        return order_id
+
+    def pending(self):
+        """尚未执行的委托数"""
+        return self._queue.qsize()
+
+    def join(self):
+        """等待已提交的委托全部执行完"""
+        self._queue.join()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="order-writer", daemon=True)
+                self._thread.start()
+
+    def _next_batch(self):
+        """阻塞取出第一笔委托，再在 max_wait 内尽量凑满一批"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                try:
+                    results = db.execute_trades([(r.username, r.transaction_type, r.stock_code, r.quantity, r.price,
+                                                  r.client_order_id)
+                                                 for r in batch])
+                except Exception as e:
+                    print(f"下单服务: 批量执行失败: {e}")
+                    results = [(False, f"交易失败: {e}")] * len(batch)
+                self.batches += 1
+                self.processed += len(batch)
+
+                for request, (success, message) in zip(batch, results):
+                    if request.callback is None:
+                        continue
+                    try:
+                        request.callback(request.order_id, success, message)
+                    except Exception as e:
+                        print(f"下单服务: 订单 {request.order_id} 的回调出错: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+
+# 创建下单服务实例（写线程在第一次提交时启动）
+order_service = OrderService()
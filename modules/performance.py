@@ -0,0 +1,192 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+from .database import db
+from .valuation import account_valuation
+from .tax_lots import lot_book
+
+# 每年交易日数（年化用）
+TRADING_DAYS = 252
+# 年化无风险利率（计算夏普比率用）
+RISK_FREE_RATE = 0.02
+# 每天收盘后记录净值的时间
+NAV_RECORD_TIME = "15:05"
+# 检查是否需要记录净值的间隔（秒）
+NAV_CHECK_INTERVAL = 600
+
+
+class PerformanceService:
+    """
+    每日净值与业绩指标。
+    收盘后为每个用户写一行净值（现金、持仓市值、总资产、当日资金调整），全部用户一次批量写入；
+    业绩指标从净值表读出后按 日期×用户 矩阵用NumPy一次算出：
+    日收益率 r_t = (V_t - 当日入金) / V_{t-1} - 1，
+    年化波动率 = std(r)·√252，夏普比率 = (mean(r) - 日无风险利率) / std(r)·√252，
+    最大回撤 = min(净值 / 历史最高净值 - 1)。
+    """
+
+    def __init__(self):
+        self._thread = None
+
+    def record_daily_nav(self, date=None):
+        """
+        按当前价格记录全部用户当天的净值（一次批量写入）
+        :param date: 记录日期 "YYYY-MM-DD"，默认为今天
+        :return: 写入的行数
+        """
+        date = date or datetime.now().strftime("%Y-%m-%d")
+        flows = db.get_daily_flows(date)
+        rows = [(username, date, cash, market_value, cash + market_value, flows.get(username, 0.0))
+                for username, (cash, market_value) in db.get_account_values().items()]
+        count = db.save_nav_rows(rows)
+        print(f"业绩: 已记录 {date} 的 {count} 个用户净值")
+        return count
+
+    def backfill(self, username, start_date=None, end_date=None):
+        """
+        用历史估值补齐用户 start_date（默认为第一笔交易的日期）到 end_date（默认昨天）的每日净值
+        :return: 写入的行数
+        """
+        end_date = end_date or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        if start_date is None:
+            events = db.get_ledger_events(username, until_time=end_date + " 23:59:59")
+            if not events:
+                return 0
+            start_date = events[0]["timestamp"][:10]
+        if start_date > end_date:
+            return 0
+        curve = account_valuation.equity_curve(username, start_date=start_date, end_date=end_date)
+        rows = [(username, day.strftime("%Y-%m-%d"), float(cash), float(value), float(total), float(flow))
+                for day, cash, value, total, flow in zip(curve.index, curve["cash"], curve["market_value"],
+                                                         curve["total_value"], curve["flow"])]
+        return db.save_nav_rows(rows)
+
+    def nav_table(self, username=None, start_date=None):
+        """
+        读取净值表为 日期×用户 矩阵
+        :return: (total_value DataFrame, flow DataFrame)，缺失为NaN/0
+        """
+        history = db.get_nav_history(username, start_date)
+        if not history:
+            empty = pd.DataFrame()
+            return empty, empty
+        frame = pd.DataFrame(history, columns=["username", "date", "total_value", "flow"])
+        frame["date"] = pd.to_datetime(frame["date"])
+        values = frame.pivot(index="date", columns="username", values="total_value")
+        flows = frame.pivot(index="date", columns="username", values="flow").fillna(0.0)
+        return values, flows
+
+    def returns(self, username=None, start_date=None):
+        """扣除资金调整后的日收益率，日期×用户 DataFrame"""
+        return self._returns(*self.nav_table(username, start_date))
+
+    @staticmethod
+    def _returns(values, flows):
+        if values.empty:
+            return values
+        v = values.to_numpy()
+        r = np.full_like(v, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r[1:] = (v[1:] - flows.to_numpy()[1:]) / v[:-1] - 1
+        r[~np.isfinite(r)] = np.nan
+        return pd.DataFrame(r, index=values.index, columns=values.columns)
+
+    def metrics(self, username=None, start_date=None):
+        """
+        一个（或全部）用户的业绩指标
+        :return: {username: {"total_return", "annual_return", "volatility", "sharpe", "max_drawdown", "days",
+                             "latest_value"}}，收益率类指标为小数
+        """
+        values, flows = self.nav_table(username, start_date)
+        returns = self._returns(values, flows)
+        if returns.empty:
+            return {}
+        r = returns.to_numpy()
+        valid = np.isfinite(r)
+        days = valid.sum(axis=0)
+
+        growth = np.cumprod(np.where(valid, 1 + r, 1.0), axis=0)
+        total_return = growth[-1] - 1
+        drawdown = growth / np.maximum.accumulate(growth, axis=0) - 1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(days > 0, np.where(valid, r, 0.0).sum(axis=0) / days, np.nan)
+            deviation = np.where(valid, r - mean, 0.0)
+            std = np.sqrt((deviation ** 2).sum(axis=0) / (days - 1))
+            std[days < 2] = np.nan
+            sharpe = (mean - RISK_FREE_RATE / TRADING_DAYS) / std * np.sqrt(TRADING_DAYS)
+            annual_return = (1 + total_return) ** (TRADING_DAYS / days) - 1
+        sharpe[~np.isfinite(sharpe)] = np.nan
+        annual_return[days == 0] = np.nan
+        latest = values.ffill().iloc[-1].to_numpy()
+
+        result = {}
+        for j, name in enumerate(returns.columns):
+            result[name] = {
+                "total_return": float(total_return[j]),
+                "annual_return": float(annual_return[j]),
+                "volatility": float(std[j] * np.sqrt(TRADING_DAYS)),
+                "sharpe": float(sharpe[j]),
+                "max_drawdown": float(drawdown[:, j].min()),
+                "days": int(days[j]),
+                "latest_value": float(latest[j]),
+            }
+        return result
+
+    def backfill_gaps(self, end_date=None):
+        """
+        补齐每个用户从最后一次记录净值的次日到 end_date（默认昨天）之间漏记的净值
+        （程序没有在收盘后运行的日子），没有记录的用户从第一笔交易开始补
+        :return: 写入的行数
+        """
+        end_date = end_date or (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
+        last_dates = db.get_last_nav_dates()
+        count = 0
+        for username in db.get_account_values():
+            last = last_dates.get(username)
+            start = None if last is None else (datetime.strptime(last, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+            try:
+                count += self.backfill(username, start_date=start, end_date=end_date)
+            except Exception as e:
+                print(f"业绩: 补齐 {username} 的历史净值失败: {e}")
+        if count:
+            print(f"业绩: 已补齐 {count} 条漏记的净值")
+        return count
+
+    def start_scheduler(self):
+        """
+        启动后台线程：每天先补齐漏记的净值，每个工作日收盘后记录一次当天净值；
+        每次检查时顺带处理新成交的税务批次，界面读取已实现盈亏时不必扫描大量事件
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run_scheduler, name="nav-recorder", daemon=True)
+        self._thread.start()
+
+    def _run_scheduler(self):
+        filled_date = None
+        while True:
+            try:
+                lot_book.sync()
+            except Exception as e:
+                print(f"业绩: 处理税务批次失败: {e}")
+            now = datetime.now()
+            today = now.strftime("%Y-%m-%d")
+            if filled_date != today:
+                try:
+                    self.backfill_gaps()
+                    filled_date = today
+                except Exception as e:
+                    print(f"业绩: 补齐历史净值失败: {e}")
+            try:
+                if now.weekday() < 5 and now.strftime("%H:%M") >= NAV_RECORD_TIME \
+                        and len(db.get_nav_users(today)) < len(db.get_account_values()):
+                    self.record_daily_nav(today)
+            except Exception as e:
+                print(f"业绩: 记录每日净值失败: {e}")
+            time.sleep(NAV_CHECK_INTERVAL)
+
+
+# 创建业绩服务实例（由主窗口启动定时记录）
+performance_service = PerformanceService()
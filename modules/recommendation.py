@@ -4,8 +4,18 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import threading
-from .stock_data import stock_manager
+import queue
+import heapq
+import json
+import os
+import time
+from .bar_store import bar_store
+from .correlation import correlation_service
 from .database import db
+from .factor_table import factor_table, FACTOR_NAMES, QueryError
+from .indicators import indicator_registry
+from .ui_dispatcher import ui_dispatcher
+from .virtual_list import VirtualList
 from ttkbootstrap import Style
 
 # 定义颜色
@@ -15,10 +25,15 @@ TEXT_COLOR = "#ffffff"
 BACKGROUND_COLOR = "#0d1926"
 CHART_AREA_COLOR = "#142638"
 
+# 参数扫描工具(param_sweep.py)输出的权重/阈值文件
+WEIGHTS_PATH = os.path.join("data", "recommendation_weights.json")
+
 class StockRecommendationEngine:
     """股票推荐引擎，使用技术分析指标"""
     
-    def __init__(self):
+    def __init__(self, registry=None):
+        # 默认使用全局注册表的副本，add_indicator 注册的自定义信号只属于本引擎
+        self.registry = registry or indicator_registry.copy()
         self.indicators_weights = {
             'ma_signal': 0.25,    # 移动平均线信号
             'rsi_signal': 0.20,   # RSI信号
@@ -26,126 +41,64 @@ class StockRecommendationEngine:
             'price_momentum': 0.25, # 价格动量
             'volatility_signal': 0.15  # 波动率信号
         }
+        self.thresholds = {
+            'rsi_oversold': 30,       # RSI超卖阈值
+            'rsi_overbought': 70,     # RSI超买阈值
+            'volume_ratio_high': 1.5, # 放量阈值（当日量/10日均量）
+            'volume_ratio_low': 0.8,  # 缩量阈值
+            'volatility_high': 0.05,  # 高波动率阈值
+            'volatility_low': 0.02    # 低波动率阈值
+        }
+        if os.path.exists(WEIGHTS_PATH):
+            self.load_weights(WEIGHTS_PATH)
+    
+    def load_weights(self, path=WEIGHTS_PATH):
+        """从JSON文件加载指标权重和阈值（只覆盖文件中出现的键）"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"加载推荐权重文件 {path} 失败: {e}")
+            return False
+        
+        for key, value in data.get("weights", {}).items():
+            if key in self.indicators_weights:
+                self.indicators_weights[key] = float(value)
+        for key, value in data.get("thresholds", {}).items():
+            if key in self.thresholds:
+                self.thresholds[key] = float(value)
+        print(f"已加载推荐权重文件 {path}")
+        return True
+    
+    def add_indicator(self, name, func, inputs=(), weight=0.0, min_length=0):
+        """注册自定义信号，func(ctx, params) 从 ctx 中按 inputs 读取已计算的中间量"""
+        self.registry.add(name, func, inputs, kind="signal", min_length=min_length)
+        self.indicators_weights[name] = weight
+    
+    def compute_signals(self, df, names=None):
+        """一次计算多个信号，共享的中间量（收益率、滚动窗口等）只计算一次"""
+        names = list(names) if names is not None else list(self.indicators_weights.keys())
+        return self.registry.compute(df, names, self.thresholds)
     
     def calculate_ma_signal(self, df):
         """计算移动平均线信号"""
-        if len(df) < 20:
-            return 0
-        
-        # 计算5日和20日移动平均
-        df['ma5'] = df['close'].rolling(window=5).mean()
-        df['ma20'] = df['close'].rolling(window=20).mean()
-        
-        current_price = df['close'].iloc[-1]
-        ma5_current = df['ma5'].iloc[-1]
-        ma20_current = df['ma20'].iloc[-1]
-        
-        # 信号计算
-        if current_price > ma5_current > ma20_current:
-            return 0.8  # 强烈看涨
-        elif current_price > ma5_current:
-            return 0.6  # 看涨
-        elif current_price < ma5_current < ma20_current:
-            return -0.8  # 强烈看跌
-        elif current_price < ma5_current:
-            return -0.6  # 看跌
-        else:
-            return 0  # 中性
+        return self.compute_signals(df, ['ma_signal'])['ma_signal']
     
     def calculate_rsi_signal(self, df):
         """计算RSI信号"""
-        if len(df) < 15:
-            return 0
-        
-        # 计算RSI
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        current_rsi = rsi.iloc[-1]
-        
-        if pd.isna(current_rsi):
-            return 0
-        
-        # RSI信号判断
-        if current_rsi < 30:
-            return 0.7  # 超卖，看涨
-        elif current_rsi > 70:
-            return -0.7  # 超买，看跌
-        elif current_rsi < 50:
-            return 0.3  # 偏看涨
-        else:
-            return -0.3  # 偏看跌
+        return self.compute_signals(df, ['rsi_signal'])['rsi_signal']
     
     def calculate_volume_signal(self, df):
         """计算成交量信号"""
-        if len(df) < 10 or 'volume' not in df.columns:
-            return 0
-        
-        # 计算成交量移动平均
-        df['volume_ma'] = df['volume'].rolling(window=10).mean()
-        
-        current_volume = df['volume'].iloc[-1]
-        volume_ma = df['volume_ma'].iloc[-1]
-        
-        if pd.isna(volume_ma) or volume_ma == 0:
-            return 0
-        
-        volume_ratio = current_volume / volume_ma
-        
-        # 结合价格变化判断
-        price_change = (df['close'].iloc[-1] - df['close'].iloc[-2]) / df['close'].iloc[-2]
-        
-        if volume_ratio > 1.5 and price_change > 0:
-            return 0.6  # 放量上涨
-        elif volume_ratio > 1.5 and price_change < 0:
-            return -0.6  # 放量下跌
-        elif volume_ratio < 0.8:
-            return -0.2  # 缩量，较弱信号
-        else:
-            return 0
+        return self.compute_signals(df, ['volume_signal'])['volume_signal']
     
     def calculate_price_momentum(self, df):
         """计算价格动量信号"""
-        if len(df) < 5:
-            return 0
-        
-        # 计算3日和5日收益率
-        df['return_3d'] = df['close'].pct_change(3)
-        df['return_5d'] = df['close'].pct_change(5)
-        
-        return_3d = df['return_3d'].iloc[-1]
-        return_5d = df['return_5d'].iloc[-1]
-        
-        if pd.isna(return_3d) or pd.isna(return_5d):
-            return 0
-        
-        # 动量信号
-        momentum_score = (return_3d * 0.6 + return_5d * 0.4) * 10
-        return np.clip(momentum_score, -1, 1)
+        return self.compute_signals(df, ['price_momentum'])['price_momentum']
     
     def calculate_volatility_signal(self, df):
         """计算波动率信号"""
-        if len(df) < 10:
-            return 0
-        
-        # 计算10日波动率
-        df['returns'] = df['close'].pct_change()
-        volatility = df['returns'].rolling(window=10).std()
-        current_volatility = volatility.iloc[-1]
-        
-        if pd.isna(current_volatility):
-            return 0
-        
-        # 波动率过高给予负分，适中给予正分
-        if current_volatility > 0.05:  # 5%以上波动率
-            return -0.4
-        elif current_volatility < 0.02:  # 2%以下波动率
-            return 0.2
-        else:
-            return 0.1
+        return self.compute_signals(df, ['volatility_signal'])['volatility_signal']
     
     def analyze_stock(self, code):
         """分析单只股票，返回推荐信号"""
@@ -153,26 +106,20 @@ class StockRecommendationEngine:
             # 获取30天历史数据
             end_date = datetime.now().strftime("%Y-%m-%d")
             start_date = (datetime.now() - timedelta(days=30)).strftime("%Y-%m-%d")
-            df = stock_manager.get_stock_data(code, start_date=start_date, end_date=end_date)
+            df = bar_store.get_bars(code, start_date=start_date, end_date=end_date)
             
             if df.empty:
                 return 0, "数据不足"
             
-            # 计算各项技术指标
-            ma_signal = self.calculate_ma_signal(df.copy())
-            rsi_signal = self.calculate_rsi_signal(df.copy())
-            volume_signal = self.calculate_volume_signal(df.copy())
-            momentum_signal = self.calculate_price_momentum(df.copy())
-            volatility_signal = self.calculate_volatility_signal(df.copy())
+            # 计算各项技术指标（按依赖关系一次性计算）
+            signals = self.compute_signals(df)
+            ma_signal = signals.get('ma_signal', 0)
+            rsi_signal = signals.get('rsi_signal', 0)
+            volume_signal = signals.get('volume_signal', 0)
             
             # 计算综合得分
-            total_score = (
-                ma_signal * self.indicators_weights['ma_signal'] +
-                rsi_signal * self.indicators_weights['rsi_signal'] +
-                volume_signal * self.indicators_weights['volume_signal'] +
-                momentum_signal * self.indicators_weights['price_momentum'] +
-                volatility_signal * self.indicators_weights['volatility_signal']
-            )
+            total_score = sum(value * self.indicators_weights.get(name, 0)
+                              for name, value in signals.items())
             
             # 转换为概率（-1到1转换为0%到100%）
             probability = (total_score + 1) * 50
@@ -195,14 +142,14 @@ class StockRecommendationEngine:
             print(f"分析股票 {code} 时出错: {e}")
             return 50, "分析出错"
     
-    def get_all_recommendations(self):
-        """获取所有股票的推荐"""
-        stocks = db.get_stocks()
-        recommendations = {}
+    def iter_recommendations(self, stocks=None):
+        """逐只分析股票，边分析边产出 (code, 推荐结果)"""
+        if stocks is None:
+            stocks = db.get_stocks()
         
         for code, stock_info in stocks.items():
             probability, reason = self.analyze_stock(code)
-            recommendations[code] = {
+            yield code, {
                 'name': stock_info.get('name', ''),
                 'current_price': stock_info.get('price', 0),
                 'probability': probability,
@@ -210,8 +157,48 @@ class StockRecommendationEngine:
                 'direction': 'up' if probability > 50 else 'down',
                 'confidence': abs(probability - 50) * 2  # 0-100的置信度
             }
-        
-        return recommendations
+    
+    def get_all_recommendations(self):
+        """获取所有股票的推荐"""
+        return dict(self.iter_recommendations())
+
+class TopNTracker:
+    """用有界堆维护当前看涨/看跌前N名，内存占用与股票总数无关"""
+    
+    def __init__(self, n=5):
+        self.n = n
+        self._up = []    # 最小堆 (概率, 代码, 推荐)，堆顶是前N名中最弱的
+        self._down = []  # 最小堆 (-概率, 代码, 推荐)
+    
+    def _push(self, heap, item):
+        if len(heap) < self.n:
+            heapq.heappush(heap, item)
+            return True
+        if item[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, item)
+            return True
+        return False
+    
+    def push(self, code, rec):
+        """加入一条推荐结果，返回排行榜是否发生变化"""
+        probability = rec['probability']
+        if probability > 50:
+            return self._push(self._up, (probability, code, rec))
+        if probability < 50:
+            return self._push(self._down, (-probability, code, rec))
+        return False
+    
+    def top_up(self):
+        """看涨前N名（概率从高到低）"""
+        return [(code, rec) for _, code, rec in sorted(self._up, key=lambda x: x[:2], reverse=True)]
+    
+    def top_down(self):
+        """看跌前N名（概率从低到高）"""
+        return [(code, rec) for _, code, rec in sorted(self._down, key=lambda x: x[:2], reverse=True)]
+    
+    def clear(self):
+        self._up.clear()
+        self._down.clear()
 
 class RecommendationFrame(tb.Frame):
     """股票推荐页面框架"""
@@ -221,6 +208,9 @@ class RecommendationFrame(tb.Frame):
         self.username = username
         self.recommendation_engine = StockRecommendationEngine()
         self.recommendations = {}
+        self.top_tracker = TopNTracker(n=5)
+        self.result_queue = queue.Queue()
+        self.total_to_analyze = 0
         
         # 创建标题
         self.title_label = tb.Label(self, text="股票推荐", font=("微软雅黑", 16, "bold"), 
@@ -250,6 +240,9 @@ class RecommendationFrame(tb.Frame):
         # 创建左侧股票推荐列表
         self.create_stock_list()
         
+        # 创建条件选股页
+        self.create_screener_panel()
+        
         # 创建右侧排行榜
         self.create_ranking_panel()
     
@@ -259,43 +252,149 @@ class RecommendationFrame(tb.Frame):
         self.left_frame = tb.Frame(self.main_frame, bootstyle="dark")
         self.left_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=(0, 10))
         
+        # 推荐列表和条件选股分两个选项卡
+        self.left_notebook = tb.Notebook(self.left_frame)
+        self.left_notebook.pack(fill=tk.BOTH, expand=True)
+        self.recommend_tab = tb.Frame(self.left_notebook, bootstyle="dark")
+        self.left_notebook.add(self.recommend_tab, text="推荐列表")
+        
         # 标题
-        list_title = tb.Label(self.left_frame, text="股票推荐列表", 
+        list_title = tb.Label(self.recommend_tab, text="股票推荐列表", 
                             font=("微软雅黑", 12, "bold"), bootstyle="info")
         list_title.pack(pady=5, anchor="w")
         
         # 创建列表框架
-        self.stock_list_frame = tb.Frame(self.left_frame, bootstyle="dark")
+        self.stock_list_frame = tb.Frame(self.recommend_tab, bootstyle="dark")
         self.stock_list_frame.pack(fill=tk.BOTH, expand=True)
         
-        # 创建Treeview
+        # 创建虚拟列表（只渲染可见行，点击列标题可排序），选中股票时显示分散化提示
         columns = ('代码', '名称', '当前价格', '涨跌概率', '置信度', '推荐理由')
-        self.stock_tree = tb.Treeview(self.stock_list_frame, columns=columns, 
-                                    show='headings', bootstyle="dark")
-        
-        # 设置列标题和宽度
-        self.stock_tree.heading('代码', text='代码')
-        self.stock_tree.heading('名称', text='名称')
-        self.stock_tree.heading('当前价格', text='当前价格')
-        self.stock_tree.heading('涨跌概率', text='涨跌概率')
-        self.stock_tree.heading('置信度', text='置信度')
-        self.stock_tree.heading('推荐理由', text='推荐理由')
-        
-        self.stock_tree.column('代码', width=80)
-        self.stock_tree.column('名称', width=100)
-        self.stock_tree.column('当前价格', width=80)
-        self.stock_tree.column('涨跌概率', width=100)
-        self.stock_tree.column('置信度', width=80)
-        self.stock_tree.column('推荐理由', width=200)
-        
-        # 添加滚动条
-        scrollbar_left = tb.Scrollbar(self.stock_list_frame, orient=tk.VERTICAL, 
-                                    command=self.stock_tree.yview, bootstyle="round-dark")
-        self.stock_tree.configure(yscrollcommand=scrollbar_left.set)
+        widths = {'代码': 80, '名称': 100, '当前价格': 80, '涨跌概率': 100, '置信度': 80, '推荐理由': 200}
+        self.stock_tree = VirtualList(self.stock_list_frame, columns, widths=widths, 
+                                      on_select=self.on_stock_select, bootstyle="dark")
+        
+        # 设置颜色
+        self.stock_tree.tag_configure('strong_up', foreground='#ff6b6b')
+        self.stock_tree.tag_configure('up', foreground='#ffa8a8')
+        self.stock_tree.tag_configure('strong_down', foreground='#51cf66')
+        self.stock_tree.tag_configure('down', foreground='#8ce99a')
         
         # 布局
-        self.stock_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar_left.pack(side=tk.RIGHT, fill=tk.Y)
+        self.stock_tree.pack(fill=tk.BOTH, expand=True)
+    
+    def create_screener_panel(self):
+        """创建条件选股页（在预先生成的因子表上查询）"""
+        self.screener_tab = tb.Frame(self.left_notebook, bootstyle="dark")
+        self.left_notebook.add(self.screener_tab, text="条件选股")
+        
+        # 查询条件
+        query_frame = tb.Frame(self.screener_tab, bootstyle="dark")
+        query_frame.pack(fill=tk.X, pady=5)
+        
+        tb.Label(query_frame, text="选股条件:", bootstyle="light").pack(side=tk.LEFT, padx=5)
+        self.screen_query_var = tk.StringVar(value="rsi14<30 and volume_ratio>1.5 and return_5d>3%")
+        query_entry = tb.Entry(query_frame, textvariable=self.screen_query_var, width=45)
+        query_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        query_entry.bind("<Return>", lambda e: self.run_screen())
+        
+        tb.Label(query_frame, text="排序:", bootstyle="light").pack(side=tk.LEFT, padx=5)
+        self.screen_sort_var = tk.StringVar(value="return_5d")
+        sort_box = tb.Combobox(query_frame, textvariable=self.screen_sort_var, 
+                               values=FACTOR_NAMES, width=12, state="readonly")
+        sort_box.pack(side=tk.LEFT, padx=5)
+        
+        self.screen_btn = tb.Button(query_frame, text="执行选股", command=self.run_screen, 
+                                    bootstyle="info-outline")
+        self.screen_btn.pack(side=tk.LEFT, padx=5)
+        self.rebuild_factor_btn = tb.Button(query_frame, text="重建因子表", 
+                                            command=self.rebuild_factor_table, 
+                                            bootstyle="secondary-outline")
+        self.rebuild_factor_btn.pack(side=tk.LEFT, padx=5)
+        
+        hint = ("可用因子: close, volume, returns(当日涨幅), return_3d, return_5d, ma5, ma20, "
+                "rsi14, volume_ratio(量比), volatility10；支持 and/or/not、括号和百分数，如 5日涨幅>3%")
+        tb.Label(self.screener_tab, text=hint, font=("微软雅黑", 8), 
+                 bootstyle="secondary", wraplength=600, justify=tk.LEFT).pack(anchor="w", padx=5)
+        
+        # 结果列表
+        result_frame = tb.Frame(self.screener_tab, bootstyle="dark")
+        result_frame.pack(fill=tk.BOTH, expand=True, pady=5)
+        
+        columns = ('代码', '名称', '日期', '收盘', '涨跌幅', '5日涨幅', 'RSI', '量比', '波动率')
+        self.screen_tree = tb.Treeview(result_frame, columns=columns, show='headings', bootstyle="dark")
+        for col in columns:
+            self.screen_tree.heading(col, text=col)
+            self.screen_tree.column(col, width=80)
+        self.screen_tree.column('名称', width=100)
+        self.screen_tree.column('日期', width=90)
+        
+        scrollbar = tb.Scrollbar(result_frame, orient=tk.VERTICAL, 
+                                 command=self.screen_tree.yview, bootstyle="round-dark")
+        self.screen_tree.configure(yscrollcommand=scrollbar.set)
+        self.screen_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.screen_tree.tag_configure('up', foreground=UP_COLOR)
+        self.screen_tree.tag_configure('down', foreground=DOWN_COLOR)
+    
+    def run_screen(self):
+        """执行条件选股"""
+        if len(factor_table) == 0:
+            self.status_var.set("因子表为空，请先点击\"重建因子表\"")
+            return
+        
+        start = time.perf_counter()
+        try:
+            result = factor_table.query(self.screen_query_var.get(), 
+                                        sort_by=self.screen_sort_var.get() or None, limit=500)
+        except QueryError as e:
+            self.status_var.set(f"选股条件有误: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        
+        self.screen_tree.delete(*self.screen_tree.get_children())
+        stocks = db.get_stocks()
+        for row in result.itertuples(index=False):
+            tag = "up" if row.returns > 0 else "down" if row.returns < 0 else ""
+            self.screen_tree.insert('', tk.END, values=(
+                row.code,
+                stocks.get(row.code, {}).get('name', ''),
+                str(row.date)[:10],
+                f"{row.close:.2f}",
+                f"{row.returns * 100:.2f}%",
+                f"{row.return_5d * 100:.2f}%",
+                f"{row.rsi14:.1f}",
+                f"{row.volume_ratio:.2f}",
+                f"{row.volatility10 * 100:.2f}%"
+            ), tags=(tag,))
+        
+        self.status_var.set(f"选股完成，{len(result)}只股票符合条件（查询耗时{elapsed_ms:.1f}ms）")
+    
+    def rebuild_factor_table(self, days=180):
+        """补齐本地K线缓存并重新生成因子表"""
+        self.rebuild_factor_btn.config(state=tk.DISABLED)
+        self.status_var.set("正在重建因子表...")
+        
+        def do_rebuild():
+            try:
+                codes = list(db.get_stocks().keys())
+                start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+                for i, code in enumerate(codes, 1):
+                    bar_store.get_bars(code, start_date=start_date)
+                    if i % 20 == 0:
+                        ui_dispatcher.post(self.status_var.set, f"正在缓存历史数据... {i}/{len(codes)}",
+                                           key=(self, "rebuild_status"))
+                factor_table.materialize(codes, days=days)
+                factor_table.save()
+                ui_dispatcher.post(self.status_var.set, f"因子表已重建，共{len(factor_table)}行",
+                                   key=(self, "rebuild_status"))
+            except Exception as e:
+                print(f"重建因子表时出错: {e}")
+                ui_dispatcher.post(self.status_var.set, f"重建因子表失败: {e}", key=(self, "rebuild_status"))
+            finally:
+                ui_dispatcher.post(lambda: self.rebuild_factor_btn.config(state=tk.NORMAL))
+        
+        threading.Thread(target=do_rebuild, daemon=True).start()
     
     def create_ranking_panel(self):
         """创建排行榜面板"""
@@ -334,6 +433,19 @@ class RecommendationFrame(tb.Frame):
         self.down_list.column('概率', width=80)
         self.down_list.pack(fill=tk.X)
         
+        # 分散化提示
+        self.diversify_frame = tb.LabelFrame(self.right_frame, text="分散化提示", 
+                                           bootstyle="warning", padding=10)
+        self.diversify_frame.pack(fill=tk.X, pady=5)
+        
+        self.diversify_var = tk.StringVar(value="选中推荐列表中的股票查看与持仓的相关性")
+        tb.Label(self.diversify_frame, textvariable=self.diversify_var, justify=tk.LEFT, 
+                 font=("微软雅黑", 8), bootstyle="light", wraplength=220).pack(anchor="w")
+        self.correlation_btn = tb.Button(self.diversify_frame, text="更新相关性数据", 
+                                         command=self.update_correlation, 
+                                         bootstyle="warning-outline")
+        self.correlation_btn.pack(anchor="w", pady=(5, 0))
+        
         # 算法说明
         info_frame = tb.LabelFrame(self.right_frame, text="算法说明", 
                                  bootstyle="info", padding=10)
@@ -355,94 +467,166 @@ class RecommendationFrame(tb.Frame):
         info_label.pack(anchor="w")
     
     def refresh_recommendations(self):
-        """刷新推荐数据"""
+        """刷新推荐数据：后台逐只分析，结果分批推送到界面"""
         self.status_var.set("正在分析股票数据...")
         self.refresh_btn.config(state=tk.DISABLED)
         
+        # 清空列表和排行榜
+        self.stock_tree.clear()
+        for tree in (self.up_list, self.down_list):
+            tree.delete(*tree.get_children())
+        self.recommendations = {}
+        self.top_tracker.clear()
+        
+        stocks = db.get_stocks()
+        self.total_to_analyze = len(stocks)
+        result_queue = queue.Queue()
+        self.result_queue = result_queue
+        
         def do_analysis():
             try:
-                # 获取推荐数据
-                self.recommendations = self.recommendation_engine.get_all_recommendations()
-                
-                # 更新界面
-                self.after(0, self.update_display)
-                
+                for code, rec in self.recommendation_engine.iter_recommendations(stocks):
+                    result_queue.put((code, rec))
             except Exception as e:
                 print(f"分析股票数据时出错: {e}")
-                self.after(0, lambda: self.status_var.set(f"分析失败: {e}"))
+                result_queue.put(("error", e))
             finally:
-                self.after(0, lambda: self.refresh_btn.config(state=tk.NORMAL))
+                result_queue.put(None)  # 结束标记
         
-        # 在后台线程中进行分析
+        # 在后台线程中进行分析，界面定时批量取结果
         threading.Thread(target=do_analysis, daemon=True).start()
+        self.after(100, self.drain_results)
     
-    def update_display(self):
-        """更新显示"""
-        # 清空列表
-        for item in self.stock_tree.get_children():
-            self.stock_tree.delete(item)
-        for item in self.up_list.get_children():
-            self.up_list.delete(item)
-        for item in self.down_list.get_children():
-            self.down_list.delete(item)
+    def drain_results(self, batch_size=200):
+        """从结果队列中批量取出分析结果并更新界面（在主线程中执行）"""
+        result_queue = self.result_queue
+        finished = False
+        rankings_changed = False
         
-        if not self.recommendations:
-            self.status_var.set("无推荐数据")
+        for _ in range(batch_size):
+            try:
+                item = result_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                finished = True
+                break
+            code, rec = item
+            if code == "error":
+                self.status_var.set(f"分析失败: {rec}")
+                continue
+            self.recommendations[code] = rec
+            self.insert_recommendation(code, rec)
+            rankings_changed |= self.top_tracker.push(code, rec)
+        
+        if rankings_changed:
+            self.update_rankings()
+        
+        if finished:
+            if self.recommendations:
+                self.status_var.set(f"分析完成，共{len(self.recommendations)}只股票")
+            else:
+                self.status_var.set("无推荐数据")
+            self.refresh_btn.config(state=tk.NORMAL)
             return
         
-        # 更新主列表
-        for code, rec in self.recommendations.items():
-            probability = rec['probability']
-            confidence = rec['confidence']
-            
-            # 格式化显示
-            prob_text = f"{probability:.1f}%"
-            conf_text = f"{confidence:.1f}%"
-            price_text = f"{rec['current_price']:.2f}"
-            
-            # 设置颜色标签
-            if probability > 60:
-                tag = "strong_up"
-            elif probability > 50:
-                tag = "up"
-            elif probability < 40:
-                tag = "strong_down"
-            else:
-                tag = "down"
-            
-            self.stock_tree.insert('', tk.END, 
-                                 values=(code, rec['name'], price_text, prob_text, 
-                                        conf_text, rec['reason']), 
-                                 tags=(tag,))
+        self.status_var.set(f"正在分析股票数据... {len(self.recommendations)}/{self.total_to_analyze}")
+        self.after(200, self.drain_results)
+    
+    def insert_recommendation(self, code, rec):
+        """向主列表中追加一条推荐"""
+        probability = rec['probability']
+        confidence = rec['confidence']
+        
+        # 格式化显示
+        prob_text = f"{probability:.1f}%"
+        conf_text = f"{confidence:.1f}%"
+        price_text = f"{rec['current_price']:.2f}"
+        
+        # 设置颜色标签
+        if probability > 60:
+            tag = "strong_up"
+        elif probability > 50:
+            tag = "up"
+        elif probability < 40:
+            tag = "strong_down"
+        else:
+            tag = "down"
         
-        # 设置颜色
-        self.stock_tree.tag_configure('strong_up', foreground='#ff6b6b')
-        self.stock_tree.tag_configure('up', foreground='#ffa8a8')
-        self.stock_tree.tag_configure('strong_down', foreground='#51cf66')
-        self.stock_tree.tag_configure('down', foreground='#8ce99a')
+        self.stock_tree.append_row((code, rec['name'], price_text, prob_text, 
+                                    conf_text, rec['reason']), tag)
+    
+    def on_stock_select(self, values):
+        """选中股票时显示其相关性和分散化提示"""
+        self.show_diversification(values[0])
+    
+    def show_diversification(self, code):
+        """根据相关性服务生成分散化提示"""
+        if not correlation_service.ready:
+            self.diversify_var.set("相关性数据尚未生成，请点击下方按钮更新")
+            return
+        if code not in correlation_service.codes:
+            self.diversify_var.set(f"{code} 的历史数据不足，暂无相关性信息")
+            return
         
-        # 更新排行榜
-        self.update_rankings()
+        stocks = db.get_stocks()
+        def name_of(c):
+            return stocks.get(c, {}).get('name', c)
+        
+        lines = [f"{name_of(code)}({code})"]
+        holdings = list(db.get_holdings(self.username).keys())
+        result = correlation_service.diversification(code, holdings)
+        if result["max"] is not None:
+            other, corr = result["max"]
+            lines.append(f"与持仓最相关: {name_of(other)} {corr:.2f}")
+            lines.append(f"与持仓平均相关: {result['mean']:.2f}")
+            if corr > 0.7:
+                lines.append("⚠ 与现有持仓高度相关，分散效果有限")
+            elif result["mean"] < 0.3:
+                lines.append("✓ 与现有持仓相关性低，有助于分散风险")
+        else:
+            lines.append("当前无其他持仓")
+        
+        neighbors = correlation_service.neighbors(code, k=3)
+        if neighbors:
+            lines.append("走势最接近: " + "，".join(f"{name_of(c)} {v:.2f}" for c, v in neighbors))
+        label, members = correlation_service.cluster_of(code)
+        if label is not None:
+            lines.append(f"所属聚类: 第{label + 1}类（同类{len(members)}只）")
+        self.diversify_var.set("\n".join(lines))
+    
+    def update_correlation(self):
+        """在后台线程中增量更新相关性数据"""
+        self.correlation_btn.config(state=tk.DISABLED)
+        self.diversify_var.set("正在更新相关性数据...")
         
-        self.status_var.set(f"分析完成，共{len(self.recommendations)}只股票")
+        def do_update():
+            try:
+                correlation_service.update()
+                message = f"相关性数据已更新，共{len(correlation_service.codes)}只股票"
+            except Exception as e:
+                print(f"更新相关性数据时出错: {e}")
+                message = f"更新相关性数据失败: {e}"
+            ui_dispatcher.post(self.diversify_var.set, message, key=(self, "correlation"))
+            ui_dispatcher.post(lambda: self.correlation_btn.config(state=tk.NORMAL))
+        
+        threading.Thread(target=do_update, daemon=True).start()
     
     def update_rankings(self):
         """更新排行榜"""
-        # 按涨跌概率排序
-        sorted_stocks = sorted(self.recommendations.items(), 
-                             key=lambda x: x[1]['probability'], reverse=True)
+        for item in self.up_list.get_children():
+            self.up_list.delete(item)
+        for item in self.down_list.get_children():
+            self.down_list.delete(item)
         
         # 看涨前五（概率最高的）
-        up_stocks = [stock for stock in sorted_stocks if stock[1]['probability'] > 50][:5]
-        for code, rec in up_stocks:
+        for code, rec in self.top_tracker.top_up():
             stock_name = f"{rec['name']}({code})"
             prob_text = f"{rec['probability']:.1f}%"
             self.up_list.insert('', tk.END, values=(stock_name, prob_text))
         
         # 看跌前五（概率最低的）
-        down_stocks = sorted([stock for stock in sorted_stocks if stock[1]['probability'] < 50], 
-                           key=lambda x: x[1]['probability'])[:5]
-        for code, rec in down_stocks:
+        for code, rec in self.top_tracker.top_down():
             stock_name = f"{rec['name']}({code})"
             prob_text = f"{100 - rec['probability']:.1f}%"  # 显示跌的概率
-            self.down_list.insert('', tk.END, values=(stock_name, prob_text)) 
+            self.down_list.insert('', tk.END, values=(stock_name, prob_text))
@@ -4,6 +4,7 @@ import time
 import requests
 from datetime import datetime, timedelta
 from .database import db
+from .order_book import order_book
 import akshare as ak
 import threading
 
@@ -106,6 +107,7 @@ class StockDataManager:
                                     "change": new_change
                                 }
                                 db.update_stock(bs_code, stock_to_save)
+                                order_book.on_price(bs_code, new_price)
                                 print(f"AKShare: 批量更新 {bs_code} - 价格: {new_price}, 涨跌幅: {new_change}%")
                                 continue  # 成功更新，跳过下面的单个更新
                         except Exception as e:
@@ -149,6 +151,7 @@ class StockDataManager:
                             "change": calculated_change
                         }
                         db.update_stock(bs_code, stock_to_save)
+                        order_book.on_price(bs_code, new_price)
                         print(f"AKShare: 已同步 {bs_code} 至数据库 - 价格: {new_price}, 涨跌幅: {calculated_change}%")
                     else:
                         print(f"AKShare: 未能获取 {bs_code} 的有效历史数据进行同步，保留数据库原值。")
@@ -272,7 +275,7 @@ class StockDataManager:
                 return f"sz.{ak_code}"
         return ak_code # 格式不对或无法判断则返回原值
 
-    def get_stock_data(self, code, start_date=None, end_date=None, frequency="d", adjustflag="3"):
+    def get_stock_data(self, code, start_date=None, end_date=None, frequency="d", adjustflag="3", raise_errors=False):
         """
         获取股票历史数据 (使用 AKShare)
         :param code: 股票代码，如"sh.600000"
@@ -280,6 +283,7 @@ class StockDataManager:
         :param end_date: 结束日期，格式YYYY-MM-DD，默认为今天
         :param frequency: 数据频率，d=日k线，w=周k线，m=月k线，默认为d
         :param adjustflag: 复权类型，1=前复权，2=后复权，3=不复权，默认为3
+        :param raise_errors: 为True时获取失败抛出异常（用于区分"没有数据"和"获取失败"），默认返回空DataFrame
         :return: DataFrame格式的股票数据
         """
         ak_code = self._convert_bs_to_ak_code(code)
@@ -360,6 +364,8 @@ class StockDataManager:
 
         except Exception as e:
             print(f"AKShare: 获取股票数据 {code} ({ak_code}) 异常: {e}")
+            if raise_errors:
+                raise
             # 打印更详细的错误信息，比如AKShare可能的网络错误或API限制
             import traceback
             traceback.print_exc()
@@ -534,6 +540,7 @@ class StockDataManager:
                         "change": float(new_change)
                     }
                     db.update_stock(code, stock_data_to_save)
+                    order_book.on_price(code, stock_data_to_save["price"])
                     updated_stocks_info[code] = stock_data_to_save
                     print(f"AKShare: 更新数据库 {code} - 价格: {new_price}, 涨跌幅: {new_change}%")
                 else:
@@ -0,0 +1,141 @@
+import threading
+from collections import deque
+from .database import db
+
+
+class LotBook:
+    """
+    税务批次（先进先出）与已实现盈亏。
+    每笔买入成交形成一个批次（开户时已有的持仓作为 open_event_id=0 的批次），
+    卖出按买入先后从最早的批次开始扣减，每扣减一个批次记一行已实现盈亏：
+    数量 × (卖出价 - 批次买入价)。
+    批次由账本事件（transactions 表）增量推导：处理位置之后的新事件逐个匹配，
+    内存中每个（用户, 股票）一个 deque 存放未卖完的批次，匹配只在队首弹出，均摊 O(1)；
+    批次变化、已实现盈亏和新的处理位置在同一事务中写回 tax_lots / realized_pnl 表。
+    """
+
+    def __init__(self):
+        # {(username, stock_code): deque([[open_event_id, open_date, open_price, original_quantity, quantity]])}
+        self._lots = {}
+        self._watermark = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """从批次表加载未卖完的批次和处理位置"""
+        self._lots = {}
+        for lot in db.get_open_lots():
+            self._lots.setdefault((lot["username"], lot["stock_code"]), deque()).append(
+                [lot["open_event_id"], lot["open_date"], lot["open_price"], lot["original_quantity"], lot["quantity"]])
+        self._watermark = db.get_lot_watermark()
+        self._loaded = True
+
+    def _open(self, changed, username, code, event_id, date, price, quantity):
+        lot = [event_id, date, price, quantity, quantity]
+        self._lots.setdefault((username, code), deque()).append(lot)
+        changed[(username, code, event_id)] = lot
+
+    def _match(self, changed, realized, event):
+        """按先进先出把一笔卖出匹配到批次上"""
+        username, code = event["username"], event["stock_code"]
+        lots = self._lots.get((username, code))
+        remaining = event["quantity"]
+        while remaining > 0 and lots:
+            lot = lots[0]
+            quantity = min(remaining, lot[4])
+            lot[4] -= quantity
+            remaining -= quantity
+            changed[(username, code, lot[0])] = lot
+            realized.append((event["id"], lot[0], username, code, event["stock_name"], event["timestamp"][:10],
+                             quantity, lot[2], event["price"], quantity * (event["price"] - lot[2])))
+            if lot[4] == 0:
+                lots.popleft()
+        if remaining > 0:
+            print(f"税务批次: {username} 卖出 {code} 事件 {event['id']} 有 {remaining} 股找不到买入批次")
+
+    def sync(self):
+        """
+        处理上次之后的新成交，更新批次和已实现盈亏
+        :return: 处理的事件数
+        """
+        with self._lock:
+            for _ in range(3):
+                if not self._loaded:
+                    self._load()
+                expected = self._watermark
+                changed = {}
+                realized = []
+                try:
+                    if expected is None:
+                        # 第一次处理：开户时已有的持仓作为最早的批次
+                        for username, holdings in db.get_opening_holdings().items():
+                            for code, (quantity, cost, _) in holdings.items():
+                                if quantity > 0:
+                                    self._open(changed, username, code, 0, None, cost, quantity)
+                    events = db.get_events_after(expected or 0)
+                    for event in events:
+                        if event["type"] == "buy":
+                            self._open(changed, event["username"], event["stock_code"], event["id"],
+                                       event["timestamp"][:10], event["price"], event["quantity"])
+                        elif event["type"] == "sell":
+                            self._match(changed, realized, event)
+                    watermark = events[-1]["id"] if events else (expected or 0)
+                    if expected is not None and watermark == expected:
+                        return 0
+                    lots = [(username, code, *lot) for (username, code, _), lot in changed.items()]
+                    if db.save_lot_changes(lots, realized, expected, watermark):
+                        self._watermark = watermark
+                        return len(events)
+                except Exception:
+                    self._loaded = False
+                    raise
+                # 处理位置已被其他进程推进，重新加载后再处理
+                self._loaded = False
+            print("税务批次: 处理位置多次冲突，本次未更新")
+            return 0
+
+    def forget_user(self, username):
+        """丢弃内存中该用户的批次（用户被删除后调用，同名重建的用户不会沿用旧批次）"""
+        with self._lock:
+            for key in [key for key in self._lots if key[0] == username]:
+                del self._lots[key]
+
+    def open_lots(self, username, stock_code=None):
+        """
+        未卖完的批次（按买入先后）
+        :return: [{"stock_code", "open_event_id", "open_date", "open_price", "original_quantity", "quantity"}]
+        """
+        self.sync()
+        with self._lock:
+            result = []
+            for (name, code), lots in sorted(self._lots.items()):
+                if name != username or (stock_code is not None and code != stock_code):
+                    continue
+                for event_id, date, price, original, quantity in lots:
+                    result.append({"stock_code": code, "open_event_id": event_id, "open_date": date,
+                                   "open_price": price, "original_quantity": original, "quantity": quantity})
+            return result
+
+    def realized_by_trade(self, username, start_date=None, end_date=None):
+        """每笔卖出的已实现盈亏：sell_event_id, date, stock_code, stock_name, quantity, cost, proceeds, pnl"""
+        self.sync()
+        return db.get_realized_pnl(username, "trade", start_date, end_date)
+
+    def realized_by_day(self, username, start_date=None, end_date=None):
+        """每天的已实现盈亏：date, quantity, cost, proceeds, pnl"""
+        self.sync()
+        return db.get_realized_pnl(username, "day", start_date, end_date)
+
+    def realized_by_symbol(self, username, start_date=None, end_date=None):
+        """每只股票的已实现盈亏：stock_code, stock_name, quantity, cost, proceeds, pnl"""
+        self.sync()
+        return db.get_realized_pnl(username, "symbol", start_date, end_date)
+
+    def realized_total(self, username, start_date=None, end_date=None):
+        """已实现盈亏合计"""
+        return sum(row["pnl"] for row in self.realized_by_symbol(username, start_date, end_date))
+
+
+# 创建税务批次实例（删除用户时清理其批次）
+lot_book = LotBook()
+db.add_delete_listener(lot_book.forget_user)
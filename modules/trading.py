@@ -4,6 +4,10 @@ import ttkbootstrap as tb
 import pandas as pd
 from .database import db
 from .stock_data import stock_manager
+from .virtual_list import VirtualList
+from .order_book import order_book, ORDER_TYPE_NAMES, ORDER_TRIGGERS
+from .ui_dispatcher import ui_dispatcher
+from .order_service import order_service
 
 class TradingFrame(tb.Frame):
     """交易操作页面框架"""
@@ -34,9 +38,16 @@ class TradingFrame(tb.Frame):
         # 创建交易表单
         self.create_trade_form()
         
+        # 创建当前委托列表
+        self.create_order_list()
+        
         # 创建交易记录
         self.create_transaction_list()
         
+        # 挂单成交时（在行情更新线程中触发）刷新界面
+        order_book.add_listener(self.on_order_filled)
+        self.bind("<Destroy>", lambda e: order_book.remove_listener(self.on_order_filled) if e.widget is self else None)
+        
         # 加载数据
         self.load_data()
     
@@ -61,30 +72,19 @@ class TradingFrame(tb.Frame):
         self.stock_frame = tb.Frame(self.left_frame)
         self.stock_frame.pack(fill=tk.BOTH, expand=True)
         
-        # 创建股票列表
+        # 创建股票列表（虚拟列表，只渲染可见行）
         columns = ('代码', '名称', '价格', '涨跌幅')
-        self.stock_tree = tb.Treeview(self.stock_frame, columns=columns, show='headings')
+        widths = {col: 80 for col in columns}
+        self.stock_tree = VirtualList(self.stock_frame, columns, widths=widths, 
+                                      on_select=self.on_stock_select)
         
-        # 设置列标题
-        for col in columns:
-            self.stock_tree.heading(col, text=col)
-        
-        # 设置列宽
-        self.stock_tree.column('代码', width=80)
-        self.stock_tree.column('名称', width=80)
-        self.stock_tree.column('价格', width=80)
-        self.stock_tree.column('涨跌幅', width=80)
-        
-        # 添加滚动条
-        scrollbar = tb.Scrollbar(self.stock_frame, orient=tk.VERTICAL, command=self.stock_tree.yview)
-        self.stock_tree.configure(yscrollcommand=scrollbar.set)
+        # 设置颜色
+        self.stock_tree.tag_configure('up', foreground='red')
+        self.stock_tree.tag_configure('down', foreground='green')
+        self.stock_tree.tag_configure('flat', foreground='black')
         
         # 布局
-        self.stock_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        
-        # 绑定选择事件
-        self.stock_tree.bind("<<TreeviewSelect>>", self.on_stock_select)
+        self.stock_tree.pack(fill=tk.BOTH, expand=True)
     
     def create_trade_form(self):
         """创建交易表单"""
@@ -158,14 +158,81 @@ class TradingFrame(tb.Frame):
         self.amount_label = tb.Label(trade_frame, textvariable=self.amount_var)
         self.amount_label.grid(row=2, column=1, columnspan=2, sticky="w", padx=10, pady=5)
         
+        # 订单类型：市价单立即按当前价成交，其余为挂单
+        tb.Label(trade_frame, text="订单类型:").grid(row=3, column=0, sticky="w", padx=10, pady=5)
+        self.order_type_var = tk.StringVar(value=ORDER_TYPE_NAMES['market'])
+        order_type_combo = tb.Combobox(trade_frame, textvariable=self.order_type_var, width=8, state="readonly",
+                                       values=[ORDER_TYPE_NAMES[t] for t in ('market', 'limit', 'stop_loss', 'take_profit')])
+        order_type_combo.grid(row=3, column=1, sticky="w", padx=10, pady=5)
+        
+        # 委托价（限价单的价格，止损/止盈单的触发价）
+        tb.Label(trade_frame, text="委托价:").grid(row=4, column=0, sticky="w", padx=10, pady=5)
+        self.order_price_var = tk.StringVar()
+        order_price_entry = tb.Entry(trade_frame, textvariable=self.order_price_var, width=10)
+        order_price_entry.grid(row=4, column=1, sticky="w", padx=10, pady=5)
+        
         # 监听数量变化
         self.quantity_var.trace_add("write", self.update_amount)
+        self.order_type_var.trace_add("write", self.update_amount)
+        self.order_price_var.trace_add("write", self.update_amount)
         
         # 提交按钮
         self.submit_btn = tb.Button(form_frame, text="执行交易", command=self.execute_trade)
         self.submit_btn.pack(pady=10)
         self.submit_btn.config(state=tk.DISABLED)
     
+    def create_order_list(self):
+        """创建当前委托（未成交挂单）列表"""
+        header = tb.Frame(self.right_frame)
+        header.pack(fill=tk.X, pady=(10, 0))
+        tb.Label(header, text="当前委托", style="Header.TLabel").pack(side=tk.LEFT)
+        cancel_btn = tb.Button(header, text="撤单", command=self.cancel_order, bootstyle="outline-danger")
+        cancel_btn.pack(side=tk.RIGHT)
+        
+        columns = ('订单号', '类型', '方向', '代码', '委托价', '数量')
+        self.order_tree = tb.Treeview(self.right_frame, columns=columns, show='headings', height=4)
+        for col in columns:
+            self.order_tree.heading(col, text=col)
+            self.order_tree.column(col, width=70)
+        self.order_tree.pack(fill=tk.X, pady=5)
+        self.load_orders()
+    
+    def load_orders(self):
+        """加载当前用户的未成交挂单"""
+        for item in self.order_tree.get_children():
+            self.order_tree.delete(item)
+        for order in order_book.open_orders(self.username):
+            side = "买入" if order["side"] == "buy" else "卖出"
+            self.order_tree.insert('', tk.END, iid=str(order["id"]), values=(
+                order["id"], ORDER_TYPE_NAMES.get(order["order_type"], order["order_type"]), side,
+                order["stock_code"], f"{order['trigger_price']:.2f}", order["quantity"]))
+    
+    def cancel_order(self):
+        """撤销选中的挂单"""
+        selected = self.order_tree.selection()
+        if not selected:
+            messagebox.showinfo("提示", "请先选择要撤销的委托")
+            return
+        success, message = order_book.cancel_order(self.username, int(selected[0]))
+        if success:
+            messagebox.showinfo("成功", message)
+        else:
+            messagebox.showerror("错误", message)
+        self.load_orders()
+    
+    def on_order_filled(self, order, success, message):
+        """挂单成交回调（行情更新线程），界面刷新交给主线程调度器"""
+        if order["username"] != self.username:
+            return
+        ui_dispatcher.post(self.refresh_after_fill, key=(self, "order_filled"))
+    
+    def refresh_after_fill(self):
+        self.load_orders()
+        self.update_user_info()
+        if self.code_var.get():
+            self.update_holding_quantity(self.code_var.get())
+        self.append_transactions()
+    
     def create_transaction_list(self):
         """创建交易记录列表"""
         # 创建标题
@@ -200,36 +267,27 @@ class TradingFrame(tb.Frame):
         self.transaction_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
     
+    @staticmethod
+    def format_stock_row(code, info):
+        """生成一行的显示值和颜色标签"""
+        name = info.get("name", "")
+        price = info.get("price", 0)
+        change = info.get("change", 0)
+        
+        # 根据涨跌幅设置颜色标签
+        if change > 0:
+            tag = "up"
+        elif change < 0:
+            tag = "down"
+        else:
+            tag = "flat"
+        return (code, name, f"{price:.2f}", f"{change:.2f}%"), tag
+    
     def load_data(self):
         """加载市场数据"""
-        # 清空列表
-        for item in self.stock_tree.get_children():
-            self.stock_tree.delete(item)
-        
         # 获取股票数据
         stocks = db.get_stocks()
-        
-        # 添加到列表
-        for code, info in stocks.items():
-            name = info.get("name", "")
-            price = info.get("price", 0)
-            change = info.get("change", 0)
-            
-            # 根据涨跌幅设置颜色标签
-            if change > 0:
-                tag = "up"
-            elif change < 0:
-                tag = "down"
-            else:
-                tag = "flat"
-            
-            # 插入数据
-            self.stock_tree.insert('', tk.END, values=(code, name, f"{price:.2f}", f"{change:.2f}%"), tags=(tag,))
-        
-        # 设置颜色
-        self.stock_tree.tag_configure('up', foreground='red')
-        self.stock_tree.tag_configure('down', foreground='green')
-        self.stock_tree.tag_configure('flat', foreground='black')
+        self.stock_tree.update_rows([self.format_stock_row(code, info) for code, info in stocks.items()])
     
     def load_transactions(self):
         """加载交易记录"""
@@ -238,10 +296,24 @@ class TradingFrame(tb.Frame):
             self.transaction_tree.delete(item)
         
         # 获取交易记录
-        transactions = db.get_user_transactions(self.username)
+        self.last_transaction_id = 0
+        self.insert_transactions(db.get_user_transactions(self.username))
         
-        # 添加到列表
+        # 设置颜色
+        self.transaction_tree.tag_configure('buy', foreground='red')
+        self.transaction_tree.tag_configure('sell', foreground='green')
+    
+    def append_transactions(self):
+        """只把上次加载之后新增的交易记录插到列表顶部"""
+        if getattr(self, "last_transaction_id", None) is None:
+            self.load_transactions()
+            return
+        self.insert_transactions(db.get_user_transactions(self.username, since_id=self.last_transaction_id))
+    
+    def insert_transactions(self, transactions):
+        """按时间顺序把交易记录插到列表顶部"""
         for transaction in transactions:
+            self.last_transaction_id = max(self.last_transaction_id, transaction.get("id", 0))
             # 交易类型
             trade_type = "买入" if transaction.get("type") == "buy" else "卖出"
             # 交易时间
@@ -260,10 +332,6 @@ class TradingFrame(tb.Frame):
             
             # 插入数据
             self.transaction_tree.insert('', 0, values=(timestamp, trade_type, stock_name, f"{price:.2f}", quantity, f"{amount:.2f}"), tags=(tag,))
-        
-        # 设置颜色
-        self.transaction_tree.tag_configure('buy', foreground='red')
-        self.transaction_tree.tag_configure('sell', foreground='green')
     
     def search_stock(self):
         """搜索股票"""
@@ -275,41 +343,15 @@ class TradingFrame(tb.Frame):
         # 搜索股票
         results = stock_manager.search_stocks(keyword)
         
-        # 清空列表
-        for item in self.stock_tree.get_children():
-            self.stock_tree.delete(item)
-        
-        # 添加搜索结果
-        for stock in results:
-            code = stock.get("code", "")
-            name = stock.get("name", "")
-            price = stock.get("price", 0)
-            change = stock.get("change", 0)
-            
-            # 根据涨跌幅设置颜色标签
-            if change > 0:
-                tag = "up"
-            elif change < 0:
-                tag = "down"
-            else:
-                tag = "flat"
-            
-            # 插入数据
-            self.stock_tree.insert('', tk.END, values=(code, name, f"{price:.2f}", f"{change:.2f}%"), tags=(tag,))
+        # 列表只保留搜索结果
+        self.stock_tree.set_rows([self.format_stock_row(stock.get("code", ""), stock) for stock in results])
         
         # 如果没有结果
         if not results:
             messagebox.showinfo("提示", f"未找到与 '{keyword}' 相关的股票")
     
-    def on_stock_select(self, event):
-        """处理股票选择事件"""
-        selected_items = self.stock_tree.selection()
-        if not selected_items:
-            return
-        
-        # 获取选中的股票
-        item = selected_items[0]
-        values = self.stock_tree.item(item, 'values')
+    def on_stock_select(self, values):
+        """处理股票选择事件（values为选中行的显示值）"""
         if not values:
             return
         
@@ -351,7 +393,10 @@ class TradingFrame(tb.Frame):
         """更新交易金额"""
         try:
             quantity = int(self.quantity_var.get())
-            price = float(self.price_var.get())
+            if self.order_type_var.get() == ORDER_TYPE_NAMES['market']:
+                price = float(self.price_var.get())
+            else:
+                price = float(self.order_price_var.get())
             amount = quantity * price
             self.amount_var.set(f"{amount:.2f}")
         except:
@@ -372,18 +417,47 @@ class TradingFrame(tb.Frame):
             messagebox.showerror("错误", "请输入有效的交易数量")
             return
         
-        # 执行交易
-        success, message = db.execute_trade(self.username, trade_type, code, quantity)
+        # 挂单交给挂单簿，价格触发后成交
+        order_type = {name: key for key, name in ORDER_TYPE_NAMES.items()}[self.order_type_var.get()]
+        if order_type != 'market':
+            if (trade_type, order_type) not in ORDER_TRIGGERS:
+                messagebox.showerror("错误", "止损单和止盈单只能用于卖出")
+                return
+            try:
+                trigger_price = float(self.order_price_var.get())
+            except ValueError:
+                messagebox.showerror("错误", "请输入有效的委托价")
+                return
+            success, message, _ = order_book.place_order(self.username, code, trade_type, order_type,
+                                                         trigger_price, quantity)
+            if success:
+                messagebox.showinfo("成功", message)
+                self.quantity_var.set("")
+                self.order_price_var.set("")
+                self.load_orders()
+            else:
+                messagebox.showerror("错误", message)
+            return
         
+        # 市价单交给下单服务在后台写线程中执行，界面不等待数据库
+        order_service.submit(self.username, trade_type, code, quantity, callback=self.on_trade_done)
+        self.quantity_var.set("")
+    
+    def on_trade_done(self, order_id, success, message):
+        """市价单执行完毕回调（下单服务写线程），界面更新交给主线程调度器"""
+        ui_dispatcher.post(self.show_trade_result, success, message)
+        if success:
+            ui_dispatcher.post(self.refresh_after_trade, key=(self, "trade_done"))
+    
+    def show_trade_result(self, success, message):
         if success:
             messagebox.showinfo("成功", message)
-            # 更新用户信息
-            self.update_user_info()
-            # 更新持仓数量
-            self.update_holding_quantity(code)
-            # 更新交易记录
-            self.load_transactions()
-            # 清空数量
-            self.quantity_var.set("")
         else:
-            messagebox.showerror("错误", message) 
+            messagebox.showerror("错误", message)
+    
+    def refresh_after_trade(self):
+        """连续成交时合并为一次刷新：余额、持仓和新增的交易记录"""
+        self.update_user_info()
+        if self.code_var.get():
+            self.update_holding_quantity(self.code_var.get())
+        self.append_transactions() 
@@ -0,0 +1,76 @@
+import threading
+import tkinter as tk
+from collections import OrderedDict
+
+
+class UIDispatcher:
+    """
+    主线程界面更新调度器。
+    后台线程不直接调用Tk，而是用 post() 把界面更新排进队列，
+    由Tk主线程每隔 interval_ms 取出执行，每轮最多执行 max_per_tick 个。
+    带 key 的更新在队列中只保留一份（用新的替换旧的，位置不变），
+    例如连续几次刷新只会执行一次"重新加载行情列表"。
+    """
+
+    def __init__(self, interval_ms=50, max_per_tick=20):
+        self.interval_ms = interval_ms
+        self.max_per_tick = max_per_tick
+        self._lock = threading.Lock()
+        self._queue = OrderedDict()  # key -> (函数, 参数)
+        self._seq = 0                # 不带 key 的更新用自增序号作键
+        self._root = None
+        self._after_id = None
+
+    def attach(self, root):
+        """绑定到Tk根窗口并开始处理队列（在主线程中调用一次）"""
+        if self._root is not None and self._after_id is not None:
+            self._root.after_cancel(self._after_id)
+        self._root = root
+        self._schedule()
+
+    def post(self, func, *args, key=None):
+        """
+        提交一个界面更新，可在任意线程中调用
+        :param func: 在主线程中执行的函数
+        :param args: 传给 func 的参数
+        :param key: 合并键，队列中已有同一 key 的更新时只保留最新的一个
+        """
+        with self._lock:
+            if key is None:
+                self._seq += 1
+                key = ('_seq', self._seq)
+            self._queue[key] = (func, args)
+
+    def cancel(self, key):
+        """撤销尚未执行的更新"""
+        with self._lock:
+            self._queue.pop(key, None)
+
+    def pending(self):
+        with self._lock:
+            return len(self._queue)
+
+    def _schedule(self):
+        try:
+            self._after_id = self._root.after(self.interval_ms, self._drain)
+        except tk.TclError:
+            self._after_id = None  # 窗口已关闭
+
+    def _drain(self):
+        """（主线程）执行队列中的更新，超出本轮上限的留到下一轮"""
+        batch = []
+        with self._lock:
+            while self._queue and len(batch) < self.max_per_tick:
+                batch.append(self._queue.popitem(last=False)[1])
+        for func, args in batch:
+            try:
+                func(*args)
+            except tk.TclError:
+                pass  # 控件已销毁（如退出登录后），忽略
+            except Exception as e:
+                print(f"界面更新出错: {e}")
+        self._schedule()
+
+
+# 创建全局调度器实例（由主窗口在启动时 attach）
+ui_dispatcher = UIDispatcher()
@@ -0,0 +1,119 @@
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from .database import db
+from .bar_store import bar_store
+
+
+class AccountValuation:
+    """
+    历史时点的账户估值。
+    以账本（开户快照 + transactions 事件）得到每个交易日收盘时的现金和各股票持仓：
+    事件按日期落到日期轴上，按股票做向量化累加（cumsum）；
+    再乘以K线缓存中对应日期的收盘价（停牌等缺失日取之前最近的收盘价，
+    没有缓存时取该股票最近一次的成交价，再没有则取开户时的成本价）。
+    一次计算即可得到整段日期的权益曲线。
+    """
+
+    def equity_curve(self, username, start_date=None, end_date=None, dates=None):
+        """
+        计算一段时间内每日收盘时的账户价值
+        :param start_date: 开始日期 "YYYY-MM-DD"，默认为第一笔事件的日期
+        :param end_date: 结束日期，默认为今天
+        :param dates: 直接指定要估值的日期列表（此时忽略 start_date/end_date）
+        :return: DataFrame，索引为日期，列为 cash 现金、market_value 持仓市值、total_value 总资产、
+                 flow 当日资金调整（入金为正）
+        """
+        opening = db.get_ledger_snapshot(username, max_event_id=0) or {"balance": 0.0, "holdings": {}}
+        events = db.get_ledger_events(username)
+        event_days = np.array([e["timestamp"][:10] for e in events], dtype='datetime64[D]')
+
+        # 估值日期轴
+        if dates is not None:
+            days = np.unique(np.array(dates, dtype='datetime64[D]'))
+        else:
+            end = np.datetime64(end_date or datetime.now().strftime("%Y-%m-%d"), 'D')
+            if start_date:
+                start = np.datetime64(start_date, 'D')
+            else:
+                start = event_days.min() if len(events) else end
+            days = None
+
+        codes = sorted(set(opening["holdings"]) | {e["stock_code"] for e in events if e["stock_code"]})
+        bar_dates, bar_codes, panel = bar_store.load_panel(codes, end_date=str(days[-1] if days is not None else end),
+                                                           fields=('close',))
+        if days is None:
+            days = bar_dates[(bar_dates >= start) & (bar_dates <= end)]
+            if len(days) == 0 or days[-1] < end:
+                # 缓存的K线没有覆盖到的日期按工作日补齐
+                extra = pd.bdate_range(max(start, days[-1] + 1) if len(days) else start, end).values
+                days = np.union1d(days, extra.astype('datetime64[D]'))
+        n_days, n_codes = len(days), len(codes)
+        column = {code: j for j, code in enumerate(codes)}
+
+        # 事件落到日期轴：在 days[row] 收盘时及之后生效，晚于最后一天的落在多出的一行上
+        rows = np.searchsorted(days, event_days, side='left')
+        types = np.array([e["type"] for e in events])
+        amounts = np.array([e["amount"] or 0.0 for e in events], dtype=float)
+        is_buy, is_sell, is_deposit = types == 'buy', types == 'sell', types == 'deposit'
+        traded = is_buy | is_sell
+
+        # 现金：开户余额 + 按日累加的现金流
+        cash_flow = np.where(is_buy, -amounts, 0.0) + np.where(is_sell | is_deposit, amounts, 0.0)
+        cash = opening["balance"] + np.cumsum(np.bincount(rows, weights=cash_flow, minlength=n_days + 1))[:n_days]
+        flow = np.bincount(rows[is_deposit], weights=amounts[is_deposit], minlength=n_days + 1)[:n_days]
+
+        # 持仓：按股票累加的数量变化
+        quantities = np.zeros((n_days + 1, n_codes))
+        cols = np.array([column.get(e["stock_code"], -1) for e in events], dtype=int)
+        signed = np.array([e["quantity"] or 0 for e in events], dtype=float) * np.where(is_buy, 1.0, -1.0)
+        np.add.at(quantities, (rows[traded], cols[traded]), signed[traded])
+        quantities = np.cumsum(quantities, axis=0)[:n_days]
+        for code, (quantity, _, _) in opening["holdings"].items():
+            quantities[:, column[code]] += quantity
+
+        prices = self._prices_on(days, codes, bar_dates, bar_codes, panel['close'])
+        # 没有K线的用最近一次成交价补齐
+        trade_prices = np.full((n_days + 1, n_codes), np.nan)
+        trade_prices[rows[traded], cols[traded]] = np.array([e["price"] for e in events], dtype=float)[traded]
+        trade_prices = pd.DataFrame(trade_prices[:n_days]).ffill().to_numpy()
+        prices = np.where(np.isnan(prices), trade_prices, prices)
+        for code, (_, cost, _) in opening["holdings"].items():
+            j = column[code]
+            prices[np.isnan(prices[:, j]), j] = cost
+
+        market_value = np.nansum(np.where(quantities != 0, quantities * prices, 0.0), axis=1)
+        return pd.DataFrame({
+            "cash": cash,
+            "market_value": market_value,
+            "total_value": cash + market_value,
+            "flow": flow,
+        }, index=pd.DatetimeIndex(days, name="date"))
+
+    @staticmethod
+    def _prices_on(days, codes, bar_dates, bar_codes, close):
+        """取每个估值日之前（含当天）最近的收盘价，返回 len(days)×len(codes) 数组"""
+        prices = np.full((len(days), len(codes)), np.nan)
+        if len(bar_dates) == 0 or not bar_codes:
+            return prices
+        filled = pd.DataFrame(close).ffill().to_numpy()
+        rows = np.searchsorted(bar_dates, days, side='right') - 1
+        has_bar = rows >= 0
+        position = {code: j for j, code in enumerate(bar_codes)}
+        for j, code in enumerate(codes):
+            if code in position:
+                prices[has_bar, j] = filled[rows[has_bar], position[code]]
+        return prices
+
+    def value_at(self, username, date):
+        """
+        某一日收盘时的账户价值
+        :return: {"date", "cash", "market_value", "total_value"}
+        """
+        row = self.equity_curve(username, dates=[date]).iloc[0]
+        return {"date": date, "cash": float(row["cash"]), "market_value": float(row["market_value"]),
+                "total_value": float(row["total_value"])}
+
+
+# 创建估值服务实例
+account_valuation = AccountValuation()
@@ -0,0 +1,368 @@
+import tkinter as tk
+import ttkbootstrap as tb
+
+
+def default_sort_key(value):
+    """排序键：能解析成数字的按数值排（忽略 +、%、逗号），否则按文本排"""
+    text = str(value).strip().replace(',', '').replace('%', '').lstrip('+')
+    try:
+        return (0, float(text), '')
+    except ValueError:
+        return (1, 0.0, str(value))
+
+
+class VirtualList(tb.Frame):
+    """
+    虚拟列表：Treeview 中只保留刚好填满可见区域的固定数量的行，
+    数据保存在内存模型中，滚动、排序和过滤都只操作模型里的下标数组，
+    每次滚动只改写内容发生变化的可见行，几千上万行数据也不会拖慢界面。
+
+    选中状态按键列（默认为第一列，即股票代码）记录，刷新数据后保持不变。
+    """
+
+    DEFAULT_ROW_HEIGHT = 20
+    DEFAULT_HEADER_HEIGHT = 25
+
+    def __init__(self, parent, columns, widths=None, key_column=0, on_select=None,
+                 sort_keys=None, **tree_kwargs):
+        """
+        :param columns: 列名元组
+        :param widths: {列名: 宽度}
+        :param key_column: 作为行主键的列下标
+        :param on_select: 选中行变化时的回调，参数为该行的显示值元组
+        :param sort_keys: {列名: 排序键函数}，未指定的列使用 default_sort_key
+        :param tree_kwargs: 传给 Treeview 的其它参数（如 bootstyle）
+        """
+        if 'bootstyle' in tree_kwargs:
+            super().__init__(parent, bootstyle=tree_kwargs['bootstyle'])
+        else:
+            super().__init__(parent)
+        self.columns = tuple(columns)
+        self.key_column = key_column
+        self.on_select = on_select
+        self.sort_keys = sort_keys or {}
+
+        # 模型
+        self._rows = []        # [(显示值, 颜色标签), ...]
+        self._index = {}       # 主键 -> 模型下标
+        self._view = []        # 过滤、排序后的模型下标
+        self._filter = None
+        self._sort_column = None
+        self._sort_descending = False
+        self._key_cache = {}   # 列名 -> 排序键列表（模型变化时清空）
+        self._offset = 0
+        self._selected_key = None
+        self._refresh_pending = False
+
+        # 视图：固定的行池
+        self.tree = tb.Treeview(self, columns=self.columns, show='headings',
+                                selectmode='browse', **tree_kwargs)
+        for col in self.columns:
+            self.tree.heading(col, text=col, command=lambda c=col: self.sort_by(c))
+            if widths and col in widths:
+                self.tree.column(col, width=widths[col])
+        self._slots = []       # 行池中的 Treeview 行id
+        self._slot_content = []  # 每个行位当前显示的 (显示值, 颜色标签)，用于跳过未变化的行
+
+        self.scrollbar = tb.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar,
+                                      bootstyle="round")
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.tree.bind(sequence, self._on_wheel)
+        for sequence, delta in (("<Up>", -1), ("<Down>", 1), ("<Prior>", "-page"),
+                                ("<Next>", "page"), ("<Home>", "home"), ("<End>", "end")):
+            self.tree.bind(sequence, lambda e, d=delta: self._on_key(d))
+
+        self._resize_slots(1)
+
+    # ---------- 模型操作 ----------
+
+    def set_rows(self, rows):
+        """
+        替换全部数据，保持选中项、排序、过滤和滚动位置
+        :param rows: [(显示值元组, 颜色标签), ...]
+        """
+        self._rows = [(tuple(values), tag) for values, tag in rows]
+        self._index = {values[self.key_column]: i for i, (values, _) in enumerate(self._rows)}
+        self._key_cache.clear()
+        self._rebuild_view()
+
+    def update_rows(self, rows, remove_missing=True):
+        """
+        按主键增量更新（定时刷新行情用）：只修改内容有变化的行，
+        排序和过滤只对这些行用二分查找重新定位，界面只改写内容变化的可见行，
+        开销与变化的行数成正比；有行需要删除时退回 set_rows
+        :param rows: [(显示值元组, 颜色标签), ...]
+        :param remove_missing: 为True时删除 rows 中没有的行
+        :return: 有变化（含新增）的行数
+        """
+        rows = [(tuple(values), tag) for values, tag in rows]
+        if remove_missing:
+            matched = sum(1 for values, _ in rows if values[self.key_column] in self._index)
+            if matched < len(self._index):
+                self.set_rows(rows)
+                return len(rows)
+
+        changed = 0
+        for row in rows:
+            values = row[0]
+            i = self._index.get(values[self.key_column])
+            if i is not None:
+                if self._rows[i] == row:
+                    continue
+                # 按旧内容从视图中取出
+                position = self._position(i)
+                if position < len(self._view) and self._view[position] == i:
+                    del self._view[position]
+                self._rows[i] = row
+                for column, keys in self._key_cache.items():
+                    keys[i] = self._sort_key(column, values)
+            else:
+                i = len(self._rows)
+                self._index[values[self.key_column]] = i
+                self._rows.append(row)
+                for column, keys in self._key_cache.items():
+                    keys.append(self._sort_key(column, values))
+            if self._filter is None or self._filter(values):
+                self._view.insert(self._position(i), i)
+            changed += 1
+        if changed:
+            self._render()
+        return changed
+
+    def append_row(self, values, tag=''):
+        """追加（或按主键替换）一行，界面在空闲时合并刷新"""
+        values = tuple(values)
+        key = values[self.key_column]
+        i = self._index.get(key)
+        if i is None:
+            self._index[key] = len(self._rows)
+            self._rows.append((values, tag))
+        else:
+            self._rows[i] = (values, tag)
+        self._key_cache.clear()
+        if not self._refresh_pending:
+            self._refresh_pending = True
+            self.after_idle(self._rebuild_view)
+
+    def clear(self):
+        self._selected_key = None
+        self._offset = 0
+        self.set_rows([])
+
+    def set_filter(self, predicate=None):
+        """设置过滤条件，predicate(显示值) 返回True的行才显示；None表示不过滤"""
+        self._filter = predicate
+        self._offset = 0
+        self._rebuild_view()
+
+    def set_text_filter(self, text):
+        """按关键字过滤（任一列包含该关键字，不区分大小写）"""
+        text = (text or '').strip().lower()
+        if not text:
+            self.set_filter(None)
+        else:
+            self.set_filter(lambda values: any(text in str(v).lower() for v in values))
+
+    def sort_by(self, column, descending=None):
+        """按列排序；再次点击同一列时切换升降序"""
+        if descending is None:
+            descending = not self._sort_descending if column == self._sort_column else False
+        self._sort_column = column
+        self._sort_descending = descending
+        for col in self.columns:
+            arrow = (' ▼' if descending else ' ▲') if col == column else ''
+            self.tree.heading(col, text=col + arrow)
+        self._rebuild_view()
+
+    def _sort_key(self, column, values):
+        return self.sort_keys.get(column, default_sort_key)(values[self.columns.index(column)])
+
+    def _sort_keys_for(self, column):
+        keys = self._key_cache.get(column)
+        if keys is None:
+            col = self.columns.index(column)
+            key_func = self.sort_keys.get(column, default_sort_key)
+            keys = [key_func(values[col]) for values, _ in self._rows]
+            self._key_cache[column] = keys
+        return keys
+
+    def _before(self, a, b):
+        """模型下标 a 在视图中是否排在 b 之前（与 _rebuild_view 的稳定排序一致：排序键相同时按模型下标）"""
+        if self._sort_column is not None:
+            keys = self._sort_keys_for(self._sort_column)
+            if keys[a] != keys[b]:
+                return keys[a] > keys[b] if self._sort_descending else keys[a] < keys[b]
+        return a < b
+
+    def _position(self, i):
+        """二分查找模型下标 i 在视图中的位置（不在视图中时为应插入的位置）"""
+        low, high = 0, len(self._view)
+        while low < high:
+            middle = (low + high) // 2
+            if self._before(self._view[middle], i):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def _rebuild_view(self):
+        self._refresh_pending = False
+        if self._filter is None:
+            view = list(range(len(self._rows)))
+        else:
+            view = [i for i, (values, _) in enumerate(self._rows) if self._filter(values)]
+        if self._sort_column is not None:
+            keys = self._sort_keys_for(self._sort_column)
+            view.sort(key=keys.__getitem__, reverse=self._sort_descending)
+        self._view = view
+        self._render()
+
+    # ---------- 选中 ----------
+
+    def selection(self):
+        """返回选中行的主键，没有选中时为None"""
+        return self._selected_key if self._selected_key in self._index else None
+
+    def selected_values(self):
+        """返回选中行的显示值元组，没有选中时为None"""
+        key = self.selection()
+        return self._rows[self._index[key]][0] if key is not None else None
+
+    def select(self, key, see=True):
+        """按主键选中一行，see为True时滚动到该行"""
+        if key not in self._index:
+            return
+        self._selected_key = key
+        if see:
+            i = self._index[key]
+            if i in self._view:
+                position = self._view.index(i)
+                if not self._offset <= position < self._offset + len(self._slots):
+                    self._offset = position
+        self._render()
+        self._notify_select()
+
+    def _notify_select(self):
+        if self.on_select:
+            values = self.selected_values()
+            if values is not None:
+                self.on_select(values)
+
+    def _on_tree_select(self, event=None):
+        selected = self.tree.selection()
+        if not selected or selected[0] not in self._slots:
+            return
+        position = self._offset + self._slots.index(selected[0])
+        if position >= len(self._view):
+            return
+        key = self._rows[self._view[position]][0][self.key_column]
+        if key != self._selected_key:  # 渲染时程序设置的选中也会触发此事件，忽略
+            self._selected_key = key
+            self._notify_select()
+
+    # ---------- 渲染与滚动 ----------
+
+    def _max_offset(self):
+        return max(0, len(self._view) - len(self._slots))
+
+    def _render(self):
+        self._offset = min(max(0, self._offset), self._max_offset())
+        selected_slot = None
+        for slot, item in enumerate(self._slots):
+            position = self._offset + slot
+            if position < len(self._view):
+                content = self._rows[self._view[position]]
+                if content[0][self.key_column] == self._selected_key:
+                    selected_slot = item
+            else:
+                content = (('',) * len(self.columns), '')
+            if self._slot_content[slot] != content:
+                self.tree.item(item, values=content[0], tags=(content[1],) if content[1] else ())
+                self._slot_content[slot] = content
+
+        current = self.tree.selection()
+        if selected_slot is None and current:
+            self.tree.selection_remove(*current)
+        elif selected_slot is not None and current != (selected_slot,):
+            self.tree.selection_set(selected_slot)
+
+        total = len(self._view)
+        if total:
+            self.scrollbar.set(self._offset / total, min(1.0, (self._offset + len(self._slots)) / total))
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll_to(self, offset):
+        self._offset = int(offset)
+        self._render()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.scroll_to(float(amount) * len(self._view))
+        elif action == 'scroll':
+            step = len(self._slots) if unit == 'pages' else 1
+            self.scroll_to(self._offset + int(amount) * step)
+
+    def _on_wheel(self, event):
+        if getattr(event, 'num', None) == 4:
+            delta = -3
+        elif getattr(event, 'num', None) == 5:
+            delta = 3
+        else:
+            delta = -3 if event.delta > 0 else 3
+        self.scroll_to(self._offset + delta)
+        return "break"  # 阻止 Treeview 自身滚动
+
+    def _on_key(self, delta):
+        if not self._view:
+            return "break"
+        position = None
+        if self._selected_key in self._index:
+            i = self._index[self._selected_key]
+            if i in self._view:
+                position = self._view.index(i)
+        page = max(1, len(self._slots) - 1)
+        if delta == 'home':
+            position = 0
+        elif delta == 'end':
+            position = len(self._view) - 1
+        elif position is None:
+            position = self._offset
+        else:
+            step = {'page': page, '-page': -page}.get(delta, delta)
+            position = min(max(0, position + step), len(self._view) - 1)
+        self.select(self._rows[self._view[position]][0][self.key_column])
+        return "break"
+
+    def _resize_slots(self, count):
+        """调整行池大小"""
+        while len(self._slots) < count:
+            self._slots.append(self.tree.insert('', tk.END, values=('',) * len(self.columns)))
+            self._slot_content.append(None)
+        while len(self._slots) > count:
+            self.tree.delete(self._slots.pop())
+            self._slot_content.pop()
+
+    def _on_resize(self, event):
+        bbox = self.tree.bbox(self._slots[0]) if self._slots else None
+        if bbox:
+            header, row_height = bbox[1], bbox[3]
+        else:
+            header, row_height = self.DEFAULT_HEADER_HEIGHT, self.DEFAULT_ROW_HEIGHT
+        count = max(1, (event.height - header) // max(1, row_height))
+        if count != len(self._slots):
+            self._resize_slots(count)
+            self._render()
+
+    # ---------- 透传 ----------
+
+    def tag_configure(self, tag, **kwargs):
+        self.tree.tag_configure(tag, **kwargs)
+
+    def __len__(self):
+        return len(self._view)
@@ -0,0 +1,186 @@
+import tkinter as tk
+from tkinter import messagebox
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+import ttkbootstrap as tb
+from matplotlib.figure import Figure
+from .database import db
+from .stock_data import stock_manager
+from .bar_store import bar_store
+from .chart import OffscreenCanvas, SparklineGrid
+from .ui_dispatcher import ui_dispatcher
+
+# 迷你走势图显示的历史天数（自然日）
+SPARKLINE_DAYS = 90
+# 每行显示的格子数
+GRID_COLUMNS = 6
+# 检查最新报价的间隔（毫秒）
+QUOTE_INTERVAL_MS = 5000
+
+
+class WatchlistFrame(tb.Frame):
+    """自选股页面：同时显示全部自选股和持仓股的迷你走势图"""
+
+    def __init__(self, parent, username):
+        super().__init__(parent, bootstyle="dark")
+        self.username = username
+        self.codes = []           # 当前显示的股票代码（与网格格子一一对应）
+        self.quotes = {}          # 代码 -> (最新价, 涨跌幅)，上次显示的报价
+        self.selected_code = None
+
+        # 创建标题
+        self.title_label = tb.Label(self, text="自选股", font=("微软雅黑", 16, "bold"),
+                                    bootstyle="inverse-dark")
+        self.title_label.pack(pady=10, padx=10, anchor="w")
+
+        # 控制区：添加/移除/刷新
+        self.top_frame = tb.Frame(self, bootstyle="dark")
+        self.top_frame.pack(fill=tk.X, padx=10, pady=5)
+
+        tb.Label(self.top_frame, text="股票代码/名称:", bootstyle="inverse-dark").pack(side=tk.LEFT)
+        self.code_var = tk.StringVar()
+        self.code_entry = tb.Entry(self.top_frame, textvariable=self.code_var, width=15)
+        self.code_entry.pack(side=tk.LEFT, padx=5)
+        self.code_entry.bind("<Return>", lambda e: self.add_stock())
+
+        self.add_btn = tb.Button(self.top_frame, text="加入自选", command=self.add_stock,
+                                 bootstyle="outline-success")
+        self.add_btn.pack(side=tk.LEFT, padx=5)
+        self.remove_btn = tb.Button(self.top_frame, text="移除选中", command=self.remove_selected,
+                                    bootstyle="outline-danger")
+        self.remove_btn.pack(side=tk.LEFT, padx=5)
+        self.refresh_btn = tb.Button(self.top_frame, text="刷新", command=self.load_watchlist,
+                                     bootstyle="outline-info")
+        self.refresh_btn.pack(side=tk.LEFT, padx=5)
+
+        self.status_var = tk.StringVar(value="状态: 就绪")
+        tb.Label(self.top_frame, textvariable=self.status_var, bootstyle="inverse-dark").pack(side=tk.RIGHT)
+
+        # 走势图网格（后台渲染）
+        self.chart_frame = tb.Frame(self, bootstyle="dark")
+        self.chart_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        self.fig = Figure(figsize=(8, 5), dpi=100)
+        self.canvas = OffscreenCanvas(self.fig, master=self.chart_frame)
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+        with self.canvas.render_lock:
+            self.grid = SparklineGrid(self.fig, self.canvas, columns=GRID_COLUMNS)
+        self.canvas.mpl_connect('button_press_event', self.on_click)
+
+        self.load_watchlist()
+        self.after(QUOTE_INTERVAL_MS, self.poll_quotes)
+
+    def watch_codes(self):
+        """自选股加上（不在自选股中的）持仓股"""
+        codes = db.get_watchlist(self.username)
+        holdings = db.get_holdings(self.username)
+        return codes + [code for code in holdings if code not in codes]
+
+    def load_watchlist(self, fetch_missing=True):
+        """重新加载全部走势图：读取K线缓存在后台线程中完成"""
+        codes = self.watch_codes()
+        self.codes = codes
+        if not codes:
+            self.quotes = {}
+            self.status_var.set("状态: 自选股为空")
+            self.canvas.submit(lambda: self.grid.show_message("自选股为空，请在上方输入股票代码或名称添加"),
+                               key="grid")
+            return
+
+        found = db.get_stocks(codes)
+        stocks = {code: found.get(code, {}) for code in codes}
+        names = [stocks[code].get("name", code) for code in codes]
+        prices = np.array([stocks[code].get("price") or np.nan for code in codes], dtype=float)
+        changes = np.array([stocks[code].get("change") or 0.0 for code in codes], dtype=float)
+        self.quotes = {code: (stocks[code].get("price"), stocks[code].get("change")) for code in codes}
+        self.status_var.set(f"状态: 正在加载 {len(codes)} 只股票的走势...")
+
+        def do_load():
+            start_date = (datetime.now() - timedelta(days=SPARKLINE_DAYS)).strftime("%Y-%m-%d")
+            dates, cached, panel = bar_store.load_panel(codes, start_date=start_date, fields=('close',))
+
+            # 按自选股顺序排列各列，最后追加一行最新报价
+            position = {code: j for j, code in enumerate(cached)}
+            columns = np.array([position.get(code, -1) for code in codes])
+            closes = np.full((len(dates) + 1, len(codes)), np.nan)
+            has_bars = columns >= 0
+            closes[:-1, has_bars] = panel['close'][:, columns[has_bars]]
+            closes[-1] = prices
+
+            def do_set_data():
+                self.grid.set_data(codes, names, closes, changes)
+                # 加载期间轮询到的新报价可能已先一步送到网格，重新套用最新报价，避免被加载时读到的旧价覆盖
+                self.grid.update_quotes(self.quotes)
+
+            self.canvas.submit(do_set_data, key="grid")
+            missing = [code for code, ok in zip(codes, has_bars) if not ok]
+            ui_dispatcher.post(self.status_var.set, f"状态: 已显示 {len(codes)} 只股票"
+                               + (f"，{len(missing)} 只暂无K线缓存" if missing else ""), key=(self, "status"))
+
+            # 没有缓存的股票在后台补齐后再刷新一次
+            if missing and fetch_missing:
+                for code in missing:
+                    try:
+                        bar_store.get_bars(code, start_date=start_date)
+                    except Exception as e:
+                        print(f"获取 {code} 的K线失败: {e}")
+                ui_dispatcher.post(self.load_watchlist, False, key=(self, "reload"))
+
+        threading.Thread(target=do_load, daemon=True).start()
+
+    def poll_quotes(self):
+        """定时检查最新报价，只把有变化的股票交给网格增量更新"""
+        try:
+            if self.codes and self.winfo_ismapped():
+                quotes = {code: (stock.get("price"), stock.get("change"))
+                          for code, stock in db.get_stocks(self.codes).items()}
+                changed = {code: quote for code, quote in quotes.items() if self.quotes.get(code) != quote}
+                # 整体替换而不是原地修改，后台渲染线程读取时不会遇到字典正在变化
+                self.quotes = {**self.quotes, **quotes}
+                if changed:
+                    self.canvas.submit(lambda: self.grid.update_quotes(changed))
+        finally:
+            self.after(QUOTE_INTERVAL_MS, self.poll_quotes)
+
+    def on_click(self, event):
+        """点击格子选中股票"""
+        index = self.grid.index_at(event.xdata, event.ydata)
+        if index is None or index >= len(self.codes):
+            return
+        self.selected_code = self.codes[index]
+        self.canvas.submit(lambda: self.grid.select(index), key="select")
+        self.status_var.set(f"状态: 已选中 {self.selected_code}")
+
+    def add_stock(self):
+        """按代码或名称加入自选股"""
+        keyword = self.code_var.get().strip()
+        if not keyword:
+            messagebox.showinfo("提示", "请输入股票代码或名称")
+            return
+        code = keyword if db.get_stock(keyword) else None
+        if code is None:
+            results = stock_manager.search_stocks(keyword)
+            if not results:
+                messagebox.showinfo("提示", f"未找到与 '{keyword}' 相关的股票")
+                return
+            code = results[0]["code"]
+
+        success, message = db.add_to_watchlist(self.username, code)
+        if not success:
+            messagebox.showinfo("提示", message)
+            return
+        self.code_var.set("")
+        self.load_watchlist()
+
+    def remove_selected(self):
+        """移除选中的自选股（持仓股始终显示，不能移除）"""
+        if not self.selected_code:
+            messagebox.showinfo("提示", "请先点击选中一只股票")
+            return
+        if self.selected_code not in db.get_watchlist(self.username):
+            messagebox.showinfo("提示", "持仓股会自动显示，清仓后才会移除")
+            return
+        db.remove_from_watchlist(self.username, self.selected_code)
+        self.selected_code = None
+        self.canvas.submit(lambda: self.grid.select(None), key="select")
+        self.load_watchlist()
@@ -0,0 +1,327 @@
+"""
+推荐引擎参数扫描工具
+
+在本地缓存的日K线面板上，对 StockRecommendationEngine 的指标权重和阈值
+做网格/随机搜索。面板通过共享内存交给进程池中的各个工作进程，
+每组参数以全市场向量化方式打分，按信息系数(IC)等指标排序输出报告，
+并把最优参数写入引擎启动时加载的权重文件。
+
+用法示例:
+    python param_sweep.py --mode random --samples 5000 --days 500
+    python param_sweep.py --mode grid --weight-step 0.25 --workers 8
+"""
+import os
+import sys
+import csv
+import json
+import itertools
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+# 指标模块只依赖 numpy/pandas，工作进程导入它不会触发数据库和行情初始化
+from modules.indicators import indicator_registry
+
+WEIGHT_KEYS = ['ma_signal', 'rsi_signal', 'volume_signal', 'price_momentum', 'volatility_signal']
+THRESHOLD_KEYS = ['rsi_oversold', 'rsi_overbought', 'volume_ratio_high', 'volume_ratio_low',
+                  'volatility_high', 'volatility_low']
+
+DEFAULT_WEIGHTS = {'ma_signal': 0.25, 'rsi_signal': 0.20, 'volume_signal': 0.15,
+                   'price_momentum': 0.25, 'volatility_signal': 0.15}
+DEFAULT_THRESHOLDS = {'rsi_oversold': 30, 'rsi_overbought': 70, 'volume_ratio_high': 1.5,
+                      'volume_ratio_low': 0.8, 'volatility_high': 0.05, 'volatility_low': 0.02}
+
+# 网格搜索的阈值候选值
+THRESHOLD_GRID = {
+    'rsi_oversold': [20, 25, 30, 35],
+    'rsi_overbought': [65, 70, 75, 80],
+    'volume_ratio_high': [1.2, 1.5, 1.8, 2.0],
+    'volume_ratio_low': [0.8],
+    'volatility_high': [0.04, 0.05, 0.06],
+    'volatility_low': [0.01, 0.015, 0.02, 0.025],
+}
+
+# 随机搜索的阈值取值范围
+THRESHOLD_RANGES = {
+    'rsi_oversold': (15, 40),
+    'rsi_overbought': (60, 85),
+    'volume_ratio_high': (1.1, 2.5),
+    'volume_ratio_low': (0.5, 0.95),
+    'volatility_high': (0.03, 0.08),
+    'volatility_low': (0.005, 0.03),
+}
+
+REPORT_PATH = os.path.join("data", "param_sweep_report.csv")
+WEIGHTS_PATH = os.path.join("data", "recommendation_weights.json")
+
+# 工作进程内的全局状态（由 _init_worker 填充）
+_shm = None
+_features = None
+
+
+def compute_features(close, volume, horizon=1):
+    """
+    计算与阈值无关的中间量。均线、RSI、量比、收益率和波动率都由引擎所用的
+    indicator_registry 在 日期×股票 面板上一次算出，注册的指标改动后扫描随之改变
+    :param close: T×N 收盘价
+    :param volume: T×N 成交量
+    :param horizon: 前瞻收益的天数
+    :return: 特征字典，各项均为 T×N 数组
+    """
+    ctx = {'close': pd.DataFrame(close), 'volume': pd.DataFrame(volume)}
+    factors = {name: value.values for name, value in indicator_registry.evaluate(
+        ctx, ['ma5', 'ma20', 'rsi14', 'volume_ratio', 'returns', 'return_3d', 'return_5d', 'volatility10']).items()}
+
+    # 均线信号（无阈值，直接得到信号值，分档同 ma_signal）
+    ma5, ma20 = factors['ma5'], factors['ma20']
+    ma_signal = np.select(
+        [(close > ma5) & (ma5 > ma20), close > ma5, (close < ma5) & (ma5 < ma20), close < ma5],
+        [0.8, 0.6, -0.8, -0.6], default=0.0)
+    ma_signal[np.isnan(ma20)] = 0.0
+
+    # 动量信号（无阈值，加权同 price_momentum）
+    momentum = np.clip((factors['return_3d'] * 0.6 + factors['return_5d'] * 0.4) * 10, -1, 1)
+    momentum[np.isnan(momentum)] = 0.0
+
+    # 前瞻收益
+    forward_return = np.full_like(close, np.nan)
+    if horizon < len(close):
+        forward_return[:-horizon] = close[horizon:] / close[:-horizon] - 1
+
+    return {
+        'ma_signal': ma_signal,
+        'rsi': factors['rsi14'],
+        'volume_ratio': factors['volume_ratio'],
+        'price_change': factors['returns'],
+        'momentum': momentum,
+        'volatility': factors['volatility10'],
+        'forward_return': forward_return,
+        # 与引擎一致：历史不足20个交易日的不参与打分
+        'valid': ~np.isnan(ma20) & np.isfinite(forward_return),
+    }
+
+
+def score_panel(features, weights, thresholds):
+    """按一组权重/阈值对整个面板打分，返回 T×N 综合得分（-1到1）"""
+    rsi = features['rsi']
+    rsi_signal = np.select(
+        [rsi < thresholds['rsi_oversold'], rsi > thresholds['rsi_overbought'], rsi < 50, rsi >= 50],
+        [0.7, -0.7, 0.3, -0.3], default=0.0)
+
+    ratio = features['volume_ratio']
+    change = features['price_change']
+    volume_signal = np.select(
+        [(ratio > thresholds['volume_ratio_high']) & (change > 0),
+         (ratio > thresholds['volume_ratio_high']) & (change < 0),
+         ratio < thresholds['volume_ratio_low']],
+        [0.6, -0.6, -0.2], default=0.0)
+
+    vol = features['volatility']
+    volatility_signal = np.select(
+        [vol > thresholds['volatility_high'], vol < thresholds['volatility_low'], vol >= 0],
+        [-0.4, 0.2, 0.1], default=0.0)
+
+    return (features['ma_signal'] * weights['ma_signal'] +
+            rsi_signal * weights['rsi_signal'] +
+            volume_signal * weights['volume_signal'] +
+            features['momentum'] * weights['price_momentum'] +
+            volatility_signal * weights['volatility_signal'])
+
+
+def evaluate(features, weights, thresholds):
+    """评估一组参数：逐日截面IC、IC信息比率和方向命中率"""
+    score = score_panel(features, weights, thresholds)
+    fwd = features['forward_return']
+    valid = features['valid']
+
+    s = np.where(valid, score, 0.0)
+    r = np.where(valid, fwd, 0.0)
+    n = valid.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        s_mean = s.sum(axis=1) / n
+        r_mean = r.sum(axis=1) / n
+        s_dev = np.where(valid, s - s_mean[:, None], 0.0)
+        r_dev = np.where(valid, r - r_mean[:, None], 0.0)
+        cov = (s_dev * r_dev).sum(axis=1)
+        ic = cov / np.sqrt((s_dev ** 2).sum(axis=1) * (r_dev ** 2).sum(axis=1))
+    ic = ic[(n >= 3) & np.isfinite(ic)]
+
+    directional = valid & (score != 0) & (fwd != 0)
+    hits = (np.sign(score) == np.sign(fwd)) & directional
+    n_dir = int(directional.sum())
+
+    mean_ic = float(ic.mean()) if len(ic) else 0.0
+    ic_std = float(ic.std()) if len(ic) > 1 else 0.0
+    return {
+        'mean_ic': mean_ic,
+        'ic_ir': mean_ic / ic_std if ic_std > 0 else 0.0,
+        'hit_rate': float(hits.sum()) / n_dir if n_dir else 0.0,
+        'n_days': int(len(ic)),
+        'n_obs': int(valid.sum()),
+    }
+
+
+def generate_grid(weight_step=0.25):
+    """网格：阈值候选值的笛卡尔积 × 步长为 weight_step 的权重单纯形"""
+    units = int(round(1 / weight_step))
+    weight_sets = []
+    for combo in itertools.product(range(units + 1), repeat=len(WEIGHT_KEYS) - 1):
+        rest = units - sum(combo)
+        if rest >= 0:
+            weight_sets.append(dict(zip(WEIGHT_KEYS, [c / units for c in combo] + [rest / units])))
+
+    keys = list(THRESHOLD_GRID.keys())
+    for values in itertools.product(*(THRESHOLD_GRID[k] for k in keys)):
+        thresholds = dict(zip(keys, values))
+        if thresholds['volatility_low'] >= thresholds['volatility_high']:
+            continue
+        for weights in weight_sets:
+            yield weights, thresholds
+
+
+def generate_random(samples, seed=None):
+    """随机搜索：权重服从Dirichlet分布，阈值在给定范围内均匀取值"""
+    rng = np.random.default_rng(seed)
+    # 第一组总是当前默认参数，便于和搜索结果比较
+    yield dict(DEFAULT_WEIGHTS), dict(DEFAULT_THRESHOLDS)
+    for _ in range(samples - 1):
+        w = rng.dirichlet(np.ones(len(WEIGHT_KEYS)))
+        weights = dict(zip(WEIGHT_KEYS, np.round(w, 4).tolist()))
+        thresholds = {k: round(float(rng.uniform(lo, hi)), 4) for k, (lo, hi) in THRESHOLD_RANGES.items()}
+        yield weights, thresholds
+
+
+def _init_worker(shm_name, shape, horizon):
+    """工作进程初始化：挂载共享内存中的面板并计算一次特征"""
+    global _shm, _features
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    panel = np.ndarray((2,) + tuple(shape), dtype=np.float64, buffer=_shm.buf)
+    _features = compute_features(panel[0], panel[1], horizon)
+
+
+def _evaluate_chunk(param_sets):
+    """在工作进程中评估一批参数"""
+    return [(weights, thresholds, evaluate(_features, weights, thresholds))
+            for weights, thresholds in param_sets]
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_sweep(close, volume, param_sets, workers=None, horizon=1, chunk_size=32):
+    """
+    用进程池评估所有参数组合
+    :param close: T×N 收盘价面板
+    :param volume: T×N 成交量面板
+    :param param_sets: (weights, thresholds) 的可迭代对象
+    :return: [(weights, thresholds, metrics), ...]
+    """
+    shape = close.shape
+    shm = shared_memory.SharedMemory(create=True, size=2 * close.size * 8)
+    try:
+        panel = np.ndarray((2,) + shape, dtype=np.float64, buffer=shm.buf)
+        panel[0] = close
+        panel[1] = volume
+        results = []
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(shm.name, shape, horizon)) as pool:
+            for i, chunk_result in enumerate(pool.map(_evaluate_chunk, _chunks(param_sets, chunk_size))):
+                results.extend(chunk_result)
+                if (i + 1) % 20 == 0:
+                    print(f"参数扫描: 已评估 {len(results)} 组参数")
+        del panel
+        return results
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def write_report(results, metric, path=REPORT_PATH, top=None):
+    """按指定指标排序并写出CSV报告，返回排序后的结果"""
+    ranked = sorted(results, key=lambda r: r[2][metric], reverse=True)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.writer(f)
+        metric_keys = ['mean_ic', 'ic_ir', 'hit_rate', 'n_days', 'n_obs']
+        writer.writerow(['rank'] + metric_keys + WEIGHT_KEYS + THRESHOLD_KEYS)
+        for rank, (weights, thresholds, metrics) in enumerate(ranked[:top] if top else ranked, 1):
+            writer.writerow([rank] + [round(metrics[k], 6) for k in metric_keys] +
+                            [weights[k] for k in WEIGHT_KEYS] + [thresholds[k] for k in THRESHOLD_KEYS])
+    return ranked
+
+
+def save_weights(weights, thresholds, metrics, path=WEIGHTS_PATH):
+    """写出引擎可加载的权重文件"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "weights": weights,
+            "thresholds": thresholds,
+            "metrics": metrics,
+            "generated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }, f, ensure_ascii=False, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="推荐引擎权重/阈值参数扫描")
+    parser.add_argument("--mode", choices=["random", "grid"], default="random")
+    parser.add_argument("--samples", type=int, default=2000, help="随机搜索的参数组数")
+    parser.add_argument("--weight-step", type=float, default=0.25, help="网格搜索的权重步长")
+    parser.add_argument("--days", type=int, default=365, help="使用最近多少个自然日的历史")
+    parser.add_argument("--horizon", type=int, default=1, help="前瞻收益天数")
+    parser.add_argument("--metric", choices=["mean_ic", "ic_ir", "hit_rate"], default="ic_ir")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--fetch", action="store_true", help="先把数据库中所有股票的历史补齐到本地缓存")
+    parser.add_argument("--no-save", action="store_true", help="只输出报告，不覆盖权重文件")
+    args = parser.parse_args(argv)
+
+    # 只在主进程中导入应用模块，工作进程不会触发数据库和行情初始化
+    from modules.bar_store import bar_store
+    from modules.database import db
+
+    start_date = (datetime.now() - timedelta(days=args.days)).strftime("%Y-%m-%d")
+    codes = list(db.get_stocks().keys())
+    if args.fetch:
+        for i, code in enumerate(codes, 1):
+            print(f"参数扫描: 缓存 {code} 历史数据 ({i}/{len(codes)})")
+            bar_store.get_bars(code, start_date=start_date)
+
+    dates, codes, panel = bar_store.load_panel(codes, start_date=start_date)
+    if len(dates) < 30 or not codes:
+        print("参数扫描: 本地缓存的历史数据不足，请先使用 --fetch 缓存历史数据")
+        return 1
+    print(f"参数扫描: 面板 {len(dates)} 个交易日 × {len(codes)} 只股票")
+
+    if args.mode == "grid":
+        param_sets = generate_grid(args.weight_step)
+    else:
+        param_sets = generate_random(args.samples, args.seed)
+
+    results = run_sweep(panel['close'], panel['volume'], param_sets,
+                        workers=args.workers, horizon=args.horizon)
+    ranked = write_report(results, args.metric)
+    print(f"参数扫描: 共评估 {len(ranked)} 组参数，报告已写入 {REPORT_PATH}")
+
+    best_weights, best_thresholds, best_metrics = ranked[0]
+    print(f"最优参数: 权重 {best_weights}")
+    print(f"          阈值 {best_thresholds}")
+    print(f"          指标 {best_metrics}")
+    if not args.no_save:
+        save_weights(best_weights, best_thresholds, best_metrics)
+        print(f"参数扫描: 最优参数已写入 {WEIGHTS_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,9 +6,13 @@ import sys
 import os
 from modules.login import LoginFrame
 from modules.market import MarketFrame
+from modules.watchlist import WatchlistFrame
+from modules.heatmap import HeatmapFrame
 from modules.trading import TradingFrame
 from modules.news import NewsFrame
 from modules.account import AccountFrame
+from modules.ui_dispatcher import ui_dispatcher
+from modules.performance import performance_service
 
 
 class StockSimulationApp:
@@ -21,6 +25,12 @@ class StockSimulationApp:
         # 设置ttkbootstrap暗色主题  
         self.style = Style(theme="darkly") 
         
+        # 后台线程的界面更新统一由主线程调度器执行
+        ui_dispatcher.attach(self.root)
+        
+        # 后台补齐历史净值，并在每个交易日收盘后记录净值
+        performance_service.start_scheduler()
+        
         # 用户信息
         self.current_user = None        # 登录后赋值
         self.user_type = None           # "admin" 或 "user"
@@ -76,6 +86,8 @@ class StockSimulationApp:
         # 添加导航按钮
         nav_buttons = [
             ("市场信息", "market", self.show_market, "outline-info"),
+            ("自选股", "watchlist", self.show_watchlist, "outline-info"),
+            ("市场热力图", "heatmap", self.show_heatmap, "outline-info"),
             ("交易操作", "trading", self.show_trading, "outline-success"),
             ("股票推荐", "recommendation", self.show_recommendation, "outline-warning"),
             ("新闻资讯", "news", self.show_news, "outline-secondary"),
@@ -100,6 +112,12 @@ class StockSimulationApp:
         # 市场信息页面
         self.frames["market"] = MarketFrame(self.content_frame, self.current_user)
         
+        # 自选股页面
+        self.frames["watchlist"] = WatchlistFrame(self.content_frame, self.current_user)
+        
+        # 市场热力图页面
+        self.frames["heatmap"] = HeatmapFrame(self.content_frame, self.current_user)
+        
         # 交易操作页面
         self.frames["trading"] = TradingFrame(self.content_frame, self.current_user)
         
@@ -131,6 +149,14 @@ class StockSimulationApp:
         """显示市场信息页面"""
         self.show_frame("market")
     
+    def show_watchlist(self):
+        """显示自选股页面"""
+        self.show_frame("watchlist")
+    
+    def show_heatmap(self):
+        """显示市场热力图页面"""
+        self.show_frame("heatmap")
+    
     def show_trading(self):
         """显示交易操作页面"""
         self.show_frame("trading")